@@ -6,46 +6,133 @@ import time
 import sys
 import os
 import overpy
-from typing import Tuple, Iterable
+from typing import Iterable
 from pygeotile.tile import Tile
 from pygeotile.point import Point
-import requests
 import shapely.geometry as geometry
 import numpy as np
-from PIL import Image, ImageDraw
-import shutil
 import random
-
-query_template = """
-[out:json][timeout:50];
-( 
-  relation[{tag}]({bbox});
-  way[{tag}]({bbox});
-);
-//out geom;
-(._;>;);
-out body;
-"""
-
-
-def first(iterable):
-    if iterable:
-        return iterable[0]
-    return None
+from .features import ResultView, parse_tag, matches, relation_ways
+from .projection import NodeCoordinates
+from .pipeline import TilePipeline, BlockPrefetcher, TileJob
+from .imagery import ImageryDownloader
+from .imagestore import ImageryStore
+from .raster import burn_polygon, burn_label, label_dtype, LabelSpec
+from .cache import ResponseCache, CachingOverpass
+from .scheduler import ScheduledOverpass
+from .sources import OverpassSource, OsmFileSource, query_template
+from .ledger import TileLedger, TileResult
+from .writers import TiffWriter, ShardWriter, MosaicWriter
+from .metrics import Metrics, Progress
+from .stream import TileStream, TileSample
+from .tilequeue import TileQueue, QueuedTile, Heartbeat, worker_name, CLAIMED, DONE, FAILED
+from .tiling import iter_tiles, iter_blocks, grid_tile, GridTile
+from .geometries import PreparedArea, PreparedGeometries, ClippedPolygons, zoom_of
+
+# TileSample is re-exported as the type of the samples yielded by Airtiler.stream(), query_template for callers which
+# used it from this module before the sources were split out
+__all__ = ['Airtiler', 'TileSample', 'main', 'query_template']
 
 
 class Airtiler:
     def __init__(self, image_width=256, bing_key=None):
         self._image_width = image_width
         self._bing_key = bing_key
+        self._imagery = ImageryDownloader(bing_key=bing_key)
+        self.metrics = Metrics()
+        self._progress_interval = 10
+        self._tile_order = "rows"
+        self._labels = None
+        self._overpass_settings = {}
+        self._source = OverpassSource(ScheduledOverpass(metrics=self.metrics))
+        self._writer = TiffWriter()
         self._tile_rect = geometry.box(0, 0, image_width, image_width)
 
+    def use_overpass(self, urls: Iterable[str] = None, rate: float = None, concurrency: int = 2) -> None:
+        """
+         * Distributes the Overpass queries across the endpoints, failing over to the next one if an endpoint
+           throttles or fails.
+        :param rate: The initial number of queries per second, which adapts to the throttling of the servers
+                     (default: unlimited until the first throttling)
+        :param concurrency: The maximum number of concurrent queries per endpoint
+        """
+        self._overpass_settings = dict(urls=urls, rate=rate, concurrency=concurrency)
+        self._source = OverpassSource(ScheduledOverpass(metrics=self.metrics, **self._overpass_settings))
+
+    def use_cache(self, directory: str, ttl: float = None, max_size: int = None) -> None:
+        """
+         * Answers the Overpass queries from an on-disk cache in the directory, if possible.
+        :param ttl: The time in seconds after which a cached response expires
+        :param max_size: The maximum size of the cache in bytes
+        """
+        cache = ResponseCache(directory, ttl=ttl, max_size=max_size)
+        self._source = OverpassSource(CachingOverpass(cache, metrics=self.metrics, **self._overpass_settings))
+
+    def use_imagery_store(self, directory: str, max_size: int = None, max_age: float = None) -> None:
+        """
+         * Downloads each imagery tile once into a store in the directory, which can be shared by several bounding
+           boxes and configs, and links it into the output directories.
+        :param max_size: The maximum size of the store in bytes
+        :param max_age: The time in seconds after which an image is revalidated (default: never)
+        """
+        self._imagery.use_store(ImageryStore(directory, max_size=max_size, max_age=max_age))
+
+    def add_metrics_hook(self, hook) -> None:
+        """
+         * Calls hook(stage, seconds, counts) each time a stage of a tile finished, e.g. hook('query', 0.8, {}) or
+           hook('render', 0.01, {'polygons': 12}). The stages are 'query', 'index', 'prefetch', 'occupancy', 'prepare',
+           'geometry', 'render', 'write' and 'imagery'; the received Overpass bytes are counted in the stage
+           'overpass'. With workers, the hook is called from several threads.
+        """
+        self.metrics.hooks.append(hook)
+
+    def use_labels(self, mode: str, tags: Iterable[str], priority: Iterable[str] = None) -> dict:
+        """
+         * Renders all tags into a single label raster 'labels' per tile instead of a mask per tag. Returns the
+           class (mode 'classes') or bit (mode 'bitmask') of each tag.
+        :param mode: 'classes' for a uint8 map of the 1-based index of the tag in tags (0 is the background),
+                     'bitmask' for a raster in which bit i is set, if the tag with index i covers the pixel
+        :param priority: The tags ordered by priority, highest first. In the mode 'classes', a pixel covered by
+                         several tags gets the class with the highest priority. Tags which are not listed have
+                         a lower priority than the listed ones (default: the order of tags)
+        """
+        if mode == "masks":
+            self._labels = None
+            return {}
+        names = [value or attr for attr, value in map(parse_tag, tags)]
+        label_dtype(mode, len(names))
+        if mode == "classes":
+            classes = {name: i + 1 for i, name in enumerate(names)}
+        else:
+            classes = {name: 1 << i for i, name in enumerate(names)}
+        # the tags are rendered in order, so the last one wins; tags missing in priority have the lowest priority
+        listed = [value or attr for attr, value in map(parse_tag, priority or tags)]
+        order = [n for n in reversed(names) if n not in listed] + [n for n in reversed(listed) if n in classes]
+        self._labels = LabelSpec(mode=mode, classes=classes, order=order)
+        return classes
+
+    def use_osm_file(self, path: str, tags: Iterable[str], index_zoom: int = 16) -> None:
+        """
+         * Reads the OSM data from a local .osm.pbf or OSM XML extract instead of querying the Overpass API.
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError("OSM file does not exist: {}".format(path))
+        print("Reading '{}'...".format(path))
+        self._source = OsmFileSource(path, tags, index_zoom=index_zoom)
+
     @staticmethod
-    def _tiles_from_bbox(bbox, zoom_level):
+    def _tiles_from_bbox(bbox, zoom_level, order="rows") -> Iterable[GridTile]:
         """
-         * Returns all tiles for the specified bounding box
+         * Lazily yields all tiles for the specified bounding box
         """
+        range_x, range_y = Airtiler._tile_range(bbox, zoom_level)
+        return iter_tiles(zoom_level, range_x, range_y, order)
 
+    @staticmethod
+    def _tile_range(bbox, zoom_level):
+        """
+         * Returns the ranges of the TMS x and y coordinates of the tiles of the bounding box
+        """
         if isinstance(bbox, dict):
             point_min = Point.from_latitude_longitude(latitude=bbox['tl'], longitude=bbox['tr'])
             point_max = Point.from_latitude_longitude(latitude=bbox['bl'], longitude=bbox['br'])
@@ -56,75 +143,313 @@ class Airtiler:
             raise RuntimeError("bbox must bei either a dict or a list")
         tile_min = Tile.for_point(point_min, zoom_level)
         tile_max = Tile.for_point(point_max, zoom_level)
-        tiles = []
-        for x in range(tile_min.tms_x, tile_max.tms_x + 1):
-            for y in range(tile_min.tms_y, tile_max.tms_y + 1):
-                tiles.append(Tile.from_tms(tms_x=x, tms_y=y, zoom=zoom_level))
-        return tiles
+        return range(tile_min.tms_x, tile_max.tms_x + 1), range(tile_min.tms_y, tile_max.tms_y + 1)
 
-    def _process_bbox(self, bbox_name: str, bbox: Iterable, zoom_level: int, output_directory: str,
-                      separate_instances: bool, tags: Iterable[str]) -> bool:
+    @staticmethod
+    def _count_unfinished(finished, range_x, range_y, occupied=None) -> int:
+        """
+         * Returns the number of tiles within the ranges (and in occupied, if given), which are not finished, without
+           enumerating the tiles.
+        """
+        nr_tiles = len(occupied) if occupied is not None else len(range_x) * len(range_y)
+        for name in finished:
+            _, x, y = map(int, name.split("_"))
+            if x in range_x and y in range_y and (occupied is None or (x, y) in occupied):
+                nr_tiles -= 1
+        return nr_tiles
+
+    def _prefetch(self, tiles, tags, zoom_level) -> PreparedArea:
+        """
+         * Queries the data of all tags for the area covered by the tiles at once.
+        """
+        min_lat = min(t.min_lat for t in tiles)
+        min_lon = min(t.min_lon for t in tiles)
+        max_lat = max(t.max_lat for t in tiles)
+        max_lon = max(t.max_lon for t in tiles)
+        if not tags:
+            tags = ['building']
+        with self.metrics.timer("prefetch"):
+            feature_index = self._source.prefetch(tags, min_lon, min_lat, max_lon, max_lat, zoom_level)
+        return PreparedArea(feature_index, min_lon, min_lat, max_lon, max_lat)
+
+    @staticmethod
+    def _prepare_directory(bbox_name, output_directory, zoom_level, ledger) -> str:
+        """
+         * Creates the directory of the bbox and zoom level and returns the path of the latter.
+        """
         if not os.path.isdir(output_directory):
             print("Creating folder: {}".format(output_directory))
             os.makedirs(output_directory)
         else:
             print("Downloading to folder: {}".format(output_directory))
 
-        tiles_path = os.path.join(output_directory, 'tiles.txt')
+        ledger.import_tiles_txt(bbox_name, os.path.join(output_directory, 'tiles.txt'))
         output_directory = os.path.join(output_directory, str(zoom_level))
         if not os.path.isdir(output_directory):
             os.makedirs(output_directory)
+        return output_directory
 
-        tiles = self._tiles_from_bbox(bbox=bbox, zoom_level=zoom_level)
+    def _process_bbox(self, bbox_name: str, bbox: Iterable, zoom_level: int, output_directory: str,
+                      separate_instances: bool, tags: Iterable[str], ledger: TileLedger, prefetch: bool = False,
+                      prefetch_size: int = 16, workers: int = 1, occupancy: bool = False,
+                      occupancy_zoom_offset: int = 4) -> bool:
+        output_directory = self._prepare_directory(bbox_name, output_directory, zoom_level, ledger)
+        range_x, range_y = self._tile_range(bbox, zoom_level)
+        self._writer.begin(output_directory, zoom_level, range_x, range_y)
+        blocks = iter_blocks(zoom_level, range_x, range_y, prefetch_size if prefetch else 0, self._tile_order)
+        occupied = None
+        if occupancy:
+            occupied = self._skip_empty_tiles(bbox_name, bbox, zoom_level, tags, ledger, occupancy_zoom_offset)
+            blocks = ([t for t in block if t.tms in occupied] for block in blocks)
+        finished = ledger.finished_tiles(bbox_name, zoom_level)
+        nr_tiles = self._count_unfinished(finished, range_x, range_y, occupied)
+        fetch_block = (lambda tiles: self._prefetch(tiles, tags, zoom_level)) if prefetch else None
+        return self._process_tiles(bbox_name, {zoom_level: output_directory}, blocks, separate_instances, tags, ledger,
+                                   workers=workers, fetch_block=fetch_block, nr_tiles=nr_tiles, loaded_tiles=finished)
+
+    def _process_pyramid(self, bbox_name: str, bbox: Iterable, zoom_levels: Iterable[int], output_directory: str,
+                         separate_instances: bool, tags: Iterable[str], ledger: TileLedger, prefetch_size: int = 16,
+                         workers: int = 1, occupancy: bool = False, occupancy_zoom_offset: int = 4,
+                         **kwargs) -> bool:
+        """
+         * Processes all zoom levels of the bbox with a single query per block of prefetch_size x prefetch_size tiles
+           at the shallowest zoom level. The masks of each zoom level are rendered from the same data, the imagery is
+           downloaded per zoom level. If occupancy is set, the empty tiles of each zoom level are skipped.
+        """
+        zoom_levels = sorted(set(zoom_levels), reverse=True)
+        min_zoom = zoom_levels[-1]
+        directories = {z: self._prepare_directory(bbox_name, output_directory, z, ledger) for z in zoom_levels}
+        ranges = {z: self._tile_range(bbox, z) for z in zoom_levels}
+        for z in zoom_levels:
+            self._writer.begin(directories[z], z, *ranges[z])
+        occupied = {z: None for z in zoom_levels}
+        if occupancy:
+            for z in zoom_levels:
+                occupied[z] = self._skip_empty_tiles(bbox_name, bbox, z, tags, ledger, occupancy_zoom_offset)
+        finished = {z: ledger.finished_tiles(bbox_name, z) for z in zoom_levels}
+        nr_tiles = sum(self._count_unfinished(finished[z], *ranges[z], occupied[z]) for z in zoom_levels)
 
-        loaded_tiles = []
-        if os.path.isfile(tiles_path):
-            with open(tiles_path, 'r', encoding="utf-8") as f:
-                lines = f.readlines()
-                loaded_tiles = list(map(lambda l: l[:-1], lines))  # remove '\n'
+        def children(coarse_block, z):
+            tiles = self._children(coarse_block, z, *ranges[z], order=self._tile_order)
+            return tiles if occupied[z] is None else [t for t in tiles if t.tms in occupied[z]]
 
-        all_downloaded = True
-        nr_tiles = len(tiles)
-        if tiles:
-            subdomain, tile_url_template = self._get_bing_data()
-            bing_url = None
-            for i, tile in enumerate(tiles):
-                print("{} @ zoom {}: {:.1f}% (Tile {}/{}) -> {}".format(bbox_name, zoom_level, 100 / nr_tiles * i, i + 1,
-                                                                        nr_tiles, tile.tms))
-                tms_x, tms_y = tile.tms
-                tile_name = "{z}_{x}_{y}".format(z=zoom_level, x=tms_x, y=tms_y)
-                if tile_name in loaded_tiles:
-                    continue
+        def blocks():
+            # the tiles of all zoom levels below a coarse block form one block, so its data is fetched once
+            for coarse_block in iter_blocks(min_zoom, *ranges[min_zoom], prefetch_size, self._tile_order):
+                yield [t for z in zoom_levels for t in children(coarse_block, z)]
 
-                if tile_url_template and subdomain:
-                    bing_url = tile_url_template.format(subdomain=subdomain, quadkey=tile.quad_tree)
+        def fetch_block(tiles):
+            return self._prefetch(tiles, tags, zoom_levels[0])
 
-                min_lat, min_lon = tile.bounds[0].latitude_longitude
-                max_lat, max_lon = tile.bounds[1].latitude_longitude
-                all_downloaded = self.download_bbox(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat,
-                                                    output_directory=output_directory, file_name=tile_name,
-                                                    separate_instances=separate_instances, bing_url=bing_url, tags=tags)
+        return self._process_tiles(bbox_name, directories, blocks(), separate_instances, tags, ledger,
+                                   workers=workers, fetch_block=fetch_block, nr_tiles=nr_tiles,
+                                   loaded_tiles=set().union(*finished.values()))
 
-                with open(tiles_path, 'a') as f:
-                    f.write("{}\n".format(tile_name))
-        return all_downloaded
+    def _occupied_tiles(self, bbox, zoom_level, tags, zoom_offset=4) -> set:
+        """
+         * Returns the TMS coordinates of the tiles of the bbox, which may contain a feature, from a single query of
+           the skeleton data per parent tile zoom_offset levels above.
+        """
+        tags = tags or ['building']
+        margin = max(self.highway_width.values()) / self._image_width
+        range_x, range_y = self._tile_range(bbox, zoom_level)
+        occupied = set()
+        for parent in self._tiles_from_bbox(bbox=bbox, zoom_level=max(0, zoom_level - zoom_offset),
+                                            order=self._tile_order):
+            with self.metrics.timer("occupancy"):
+                occupied.update(self._source.occupancy(tags, parent.min_lon, parent.min_lat, parent.max_lon,
+                                                       parent.max_lat, zoom_level, margin))
+        return set((x, y) for x, y in occupied if x in range_x and y in range_y)
+
+    def _skip_empty_tiles(self, bbox_name, bbox, zoom_level, tags, ledger, zoom_offset=4) -> set:
+        """
+         * Records the tiles of the bbox without any feature as empty and returns the TMS coordinates of the remaining
+           ones.
+        """
+        finished = ledger.finished_tiles(bbox_name, zoom_level)
+        occupied = self._occupied_tiles(bbox, zoom_level, tags, zoom_offset)
+        range_x, range_y = self._tile_range(bbox, zoom_level)
+        for x in range_x:
+            for y in range_y:
+                if (x, y) in occupied:
+                    continue
+                tile_name = "{z}_{x}_{y}".format(z=zoom_level, x=x, y=y)
+                if tile_name not in finished:
+                    ledger.record(bbox_name, zoom_level, tile_name, TileResult(masks={}, has_image=False,
+                                                                               image_failed=False))
+        ledger.flush()
+        nr_tiles = len(range_x) * len(range_y)
+        print("{} @ zoom {}: {} of {} tiles are empty".format(bbox_name, zoom_level, nr_tiles - len(occupied),
+                                                               nr_tiles))
+        return occupied
 
-    def _get_bing_data(self) -> Tuple:
-        if not self._bing_key:
-            return None, None
+    @staticmethod
+    def _children(tiles, zoom_level, range_x, range_y, order="rows"):
+        """
+         * Returns the tiles at the deeper zoom level, which cover the tiles and lie within the ranges.
+        """
+        children = []
+        for tile in tiles:
+            factor = 2 ** (zoom_level - tile.zoom)
+            xs = range(max(range_x.start, tile.tms_x * factor), min(range_x.stop, (tile.tms_x + 1) * factor))
+            ys = range(max(range_y.start, tile.tms_y * factor), min(range_y.stop, (tile.tms_y + 1) * factor))
+            children.extend(iter_tiles(zoom_level, xs, ys, order))
+        return children
+
+    def _process_tiles(self, bbox_name: str, output_directories: dict, blocks, separate_instances: bool,
+                       tags: Iterable[str], ledger: TileLedger, workers: int = 1, fetch_block=None,
+                       nr_tiles: int = None, loaded_tiles: set = None) -> bool:
+        """
+         * Processes the tiles of the blocks, which are not finished yet. The tiles may be of several zoom levels,
+           each of which is written to its directory in output_directories. If fetch_block is set, it is called with
+           the tiles of a block and returns the FeatureIndex of the block.
+        :param blocks: A list or, if nr_tiles is given, a lazy iterable of the blocks
+        :param nr_tiles: The number of unfinished tiles in the blocks
+        :param loaded_tiles: The names of the finished tiles, which are read from the ledger if not given
+        """
+        if loaded_tiles is None:
+            loaded_tiles = set()
+            for z in output_directories:
+                loaded_tiles.update(ledger.finished_tiles(bbox_name, z))
+        if nr_tiles is None:
+            nr_tiles = sum(1 for block in blocks for t in block
+                           if "{}_{}_{}".format(t.zoom, t.tms_x, t.tms_y) not in loaded_tiles)
 
-        response = requests.get("https://dev.virtualearth.net/REST/V1/Imagery/Metadata/Aerial?key={key}"
-                                .format(key=self._bing_key))
-        data = response.json()
-        resource_set = self._get(data.get('resourceSets', []), 0, {})
-        resource = self._get(resource_set.get('resources', []), 0, {})
-        subdomain = self._get(resource.get('imageUrlSubdomains', []), 0, None)
-        image_url = resource.get('imageUrl', None)
-        return subdomain, image_url
+        all_downloaded = True
+        if nr_tiles:
+            # the tiles of a block are kept until its FeatureIndex is fetched, so the blocks can be generated lazily
+            unfetched_blocks = {}
+            if fetch_block:
+                fetch_block = (lambda block_index, fetch=fetch_block: fetch(unfetched_blocks.pop(block_index)))
+            jobs = self._tile_jobs(bbox_name, blocks, loaded_tiles, output_directories, nr_tiles,
+                                   unfetched_blocks if fetch_block else None)
+            zoom_levels = ", ".join(map(str, sorted(output_directories, reverse=True)))
+            progress = Progress("{} @ zoom {}".format(bbox_name, zoom_levels), nr_tiles, self._progress_interval)
+
+            def record(job, result):
+                ledger.record(bbox_name, job.zoom, job.tile_name, result)
+                self.metrics.tile_done()
+                progress.tile_done()
+
+            def record_failure(job, error):
+                ledger.record_failure(bbox_name, job.zoom, job.tile_name, error)
+
+            if workers > 1:
+                pipeline = TilePipeline(self, workers=workers, separate_instances=separate_instances, tags=tags)
+                prefetcher = BlockPrefetcher(fetch_block) if fetch_block else None
+                pipeline.run(jobs, on_complete=record, on_error=record_failure, feature_index_for=prefetcher)
+            else:
+                tags = tags or ['building']
+                feature_index = None
+                feature_index_block = None
+                for job in jobs:
+                    try:
+                        if fetch_block and job.block != feature_index_block:
+                            feature_index = fetch_block(job.block)
+                            feature_index_block = job.block
+                        masks_by_tag = self._get_masks_by_tag(tags, job.min_lon, job.min_lat, job.max_lon,
+                                                              job.max_lat, separate_instances, 0,
+                                                              feature_index=feature_index)
+                        result = self._write_tile(masks_by_tag, job.output_directory, job.tile_name,
+                                                  job.bing_url)
+                    except Exception as e:
+                        record_failure(job, e)
+                        raise
+                    record(job, result)
+            ledger.flush()
+        return all_downloaded
 
-    @staticmethod
-    def _get(coll, index, default):
-        return coll[index] if len(coll) > index else default
+    def _tile_jobs(self, bbox_name, blocks, loaded_tiles, output_directories, nr_tiles, unfetched_blocks=None):
+        """
+         * Yields a TileJob for each of the nr_tiles tiles which have not been loaded yet, ordered by block. If
+           unfetched_blocks is set, the tiles of each block with a job are added to it by the index of the block.
+        """
+        i = 0
+        for block_index, block in enumerate(blocks):
+            for tile in block:
+                tile_name = "{z}_{x}_{y}".format(z=tile.zoom, x=tile.tms_x, y=tile.tms_y)
+                if tile_name in loaded_tiles:
+                    continue
+                print("{} @ zoom {}: {:.1f}% (Tile {}/{}) -> {}".format(bbox_name, tile.zoom, 100 / nr_tiles * i,
+                                                                        i + 1, nr_tiles, tile.tms))
+                i += 1
+                if unfetched_blocks is not None and block_index not in unfetched_blocks:
+                    unfetched_blocks[block_index] = block
+
+                bing_url = self._imagery.url_for(tile.quad_tree)
+                yield TileJob(tile_name=tile_name, zoom=tile.zoom, min_lon=tile.min_lon, min_lat=tile.min_lat,
+                              max_lon=tile.max_lon, max_lat=tile.max_lat, bing_url=bing_url,
+                              output_directory=output_directories[tile.zoom], block=block_index)
+
+    def _publish(self, queue: TileQueue, bboxes, cities, gloabl_zoom_levels) -> int:
+        """
+         * Publishes all tiles of all bounding boxes and zoom levels to the queue.
+        """
+        def queued_tiles():
+            for bbox_name in cities:
+                bbox = bboxes[bbox_name]
+                for z in self._zoom_levels(bbox_name, bbox, gloabl_zoom_levels):
+                    range_x, range_y = self._tile_range(bbox, z)
+                    for x in range_x:
+                        for y in range_y:
+                            yield QueuedTile(bbox=bbox_name, zoom=z, tile="{}_{}_{}".format(z, x, y), tms_x=x, tms_y=y)
+
+        published = queue.publish(queued_tiles())
+        print("{} tiles published".format(published))
+        return published
+
+    def _work(self, queue: TileQueue, output_directory: str, separate_instances: bool, tags: Iterable[str],
+              batch_size: int = 8, poll_interval: float = 10, worker: str = None) -> bool:
+        """
+         * Processes the tiles claimed from the queue until no tile is left, which is pending or claimed by another
+           worker. Until the tiles are published completely, the worker waits for more tiles. A tile which fails, or
+           whose imagery could not be downloaded, is released to be retried.
+        """
+        worker = worker or worker_name()
+        tags = tags or ['building']
+        waiting = False
+        with Heartbeat(queue, worker):
+            while True:
+                claimed = queue.claim(worker, batch_size)
+                if not claimed:
+                    counts = queue.counts()
+                    published = queue.published
+                    if published and not counts[CLAIMED]:
+                        print("Queue finished: {} tiles done, {} failed".format(counts[DONE], counts[FAILED]))
+                        return True
+                    if not published and not waiting:
+                        print("Waiting for the tiles to be published to the queue...")
+                    waiting = not published
+                    time.sleep(poll_interval)
+                    continue
+                try:
+                    while claimed:
+                        tile = claimed[0]
+                        print("{} @ zoom {}: Tile {} ({})".format(tile.bbox, tile.zoom, tile.tile, worker))
+                        try:
+                            result = self._process_queued_tile(tile, output_directory, separate_instances, tags)
+                        except Exception as e:
+                            print("Tile {} failed: {}".format(tile.tile, e))
+                            queue.release(worker, tile, "{}: {}".format(type(e).__name__, e))
+                        else:
+                            if result.image_failed:
+                                queue.release(worker, tile, "The imagery could not be downloaded")
+                            elif not queue.complete(worker, tile):
+                                print("The lease of tile {} was lost".format(tile.tile))
+                            self.metrics.tile_done()
+                        claimed.pop(0)
+                finally:
+                    for tile in claimed:
+                        queue.release(worker, tile, "Interrupted")
+
+    def _process_queued_tile(self, tile: QueuedTile, output_directory: str, separate_instances: bool,
+                             tags: Iterable[str]) -> TileResult:
+        directory = os.path.join(output_directory, tile.bbox, str(tile.zoom))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        t = grid_tile(tile.zoom, tile.tms_x, tile.tms_y)
+        masks_by_tag = self._get_masks_by_tag(tags, t.min_lon, t.min_lat, t.max_lon, t.max_lat, separate_instances, 0)
+        return self._write_tile(masks_by_tag, directory, tile.tile, self._imagery.url_for(t.quad_tree))
 
     highway_width = {
         "motorway": 8,
@@ -148,121 +473,209 @@ class Airtiler:
         "elevator": 0
     }
 
-    def _get_masks_by_tag(self, tags, min_lon, min_lat, max_lon, max_lat, separate_instances, verbose):
-        offset_lat = max_lat - min_lat
-        offset_lon = max_lon - min_lon
-        pixels_per_lat = self._image_width / offset_lat
-        pixels_per_lon = self._image_width / offset_lon
-        bbox = "{},{},{},{}".format(min_lat, min_lon, max_lat, max_lon)
-        mask_by_tag = {}
+    def _get_masks_by_tag(self, tags, min_lon, min_lat, max_lon, max_lat, separate_instances, verbose,
+                          feature_index=None):
+        polygons_by_tag = self._get_polygons_by_tag(tags, min_lon, min_lat, max_lon, max_lat,
+                                                    feature_index=feature_index)
+        return self._render_masks(polygons_by_tag, separate_instances, verbose)
+
+    def _get_polygons_by_tag(self, tags, min_lon, min_lat, max_lon, max_lat, feature_index=None):
+        """
+         * Queries the data of each tag from the source and returns the polygons per tag in pixel coordinates of
+           the tile. If a feature_index is given, the data is taken from it instead. If it is a PreparedArea, the
+           geometries prepared for the whole area are clipped to the tile.
+        """
+        if isinstance(feature_index, PreparedArea):
+            return self._clip_prepared(feature_index, tags, min_lon, min_lat, max_lon, max_lat)
+        source = feature_index or self._source
+        polygons_by_tag = {}
         for tag in tags:
-            if "=" in tag:
-                attr, value = tag.split("=")
-                query_tag = "\"{}\"=\"{}\"".format(attr, value)
-                tag = value
-            else:
-                query_tag = "\"{}\"".format(tag)
-            query = query_template.format(bbox=bbox, tag=query_tag)
-            api = overpy.Overpass()
-            res = api.query(query)
-            mask = np.zeros((self._image_width, self._image_width), dtype=np.uint8)
-            handled_way_ids = []
-            for rel in res.relations:
-                outer_points = []
-                inner_point_lists = []
-                for mem in rel.members:
-                    print(mem)
-                    way = first(list(filter(lambda n: n.id == mem.ref, res.ways)))
-                    if way:
-                        handled_way_ids.append(way.id)
-                        current_points = []
-                        for node in way.nodes:
-                            x = pixels_per_lon * (float(node.lon) - min_lon)
-                            y = pixels_per_lat * (float(node.lat) - max_lat) * -1
-                            current_points.append((x, y))
-                        if mem.role == "outer":
-                            outer_points.extend(current_points)
-                        else:
-                            inner_point_lists.append(current_points)
-                if outer_points:
-                    if inner_point_lists:
-                        poly = geometry.Polygon(outer_points, inner_point_lists)
-                    else:
-                        poly = geometry.Polygon(outer_points)
-                    self._process_polygon(mask, poly, separate_instances, verbose)
+            with self.metrics.timer("query" if feature_index is None else "index"):
+                res = source.query(tag, min_lon, min_lat, max_lon, max_lat)
+            geometry_start = time.perf_counter()
+            coordinates = res.coordinates if isinstance(res, ResultView) else NodeCoordinates(res.ways)
+            points_by_way = coordinates.project(res.ways, min_lon, min_lat, max_lon, max_lat, self._image_width)
+            polygons = self._build_polygons(res, tag, points_by_way)
+            polygons_by_tag[self._tag_name(tag)] = polygons
+            self.metrics.record("geometry", time.perf_counter() - geometry_start, polygons=len(polygons))
+        return polygons_by_tag
 
-            for way in res.ways:
-                if way.id in handled_way_ids:
-                    continue
-                points = []
-                for node in way.nodes:
-                    x = pixels_per_lon * (float(node.lon) - min_lon)
-                    y = pixels_per_lat * (float(node.lat) - max_lat) * -1
-                    points.append((x, y))
-                poly = None
-                try:
-                    if "highway" in way.tags:
-                        hw_type = way.tags["highway"]
-                        is_tunnel = "tunnel" in way.tags
-                        if is_tunnel:
-                            continue
-                        if hw_type in self.highway_width:
-                            width = self.highway_width[hw_type]
-                            poly = geometry.LineString(points).buffer(width)
-                        else:
-                            print("Unknown highway type: ", hw_type)
+    @staticmethod
+    def _tag_name(tag):
+        attr, value = parse_tag(tag)
+        return value if value is not None else tag
+
+    def _clip_prepared(self, area: PreparedArea, tags, min_lon, min_lat, max_lon, max_lat) -> dict:
+        """
+         * Returns the polygons per tag of the tile, clipped from the geometries prepared once for the area.
+        """
+        zoom_level = zoom_of(min_lon, max_lon)
+        polygons_by_tag = {}
+        for tag in tags:
+            geometries = area.geometries(tag, zoom_level, lambda view, zoom, origin, tag=tag:
+                                         self._prepare_geometries(view, tag, zoom, origin))
+            with self.metrics.timer("geometry", polygons=0) as counts:
+                polygons = geometries.clip(min_lon, max_lat)
+                counts["polygons"] = len(polygons)
+            polygons_by_tag[self._tag_name(tag)] = polygons
+        return polygons_by_tag
+
+    def _prepare_geometries(self, res: ResultView, tag, zoom_level, origin) -> PreparedGeometries:
+        with self.metrics.timer("prepare", polygons=0) as counts:
+            points_by_way = res.coordinates.project_grid(res.ways, zoom_level, self._image_width, *origin)
+            geometries = PreparedGeometries(self._build_polygons(res, tag, points_by_way), zoom_level,
+                                            self._image_width, origin)
+            counts["polygons"] = len(geometries)
+        return geometries
+
+    def _build_polygons(self, res, tag, points_by_way) -> list:
+        """
+         * Returns the polygons of the relations and ways of the result, which match the tag. Highways are buffered
+           by their width.
+        """
+        polygons = []
+        ways_by_id = {w.id: w for w in res.ways}
+        relations_by_id = {r.id: r for r in res.relations}
+        handled_way_ids = set()
+        for rel in res.relations:
+            if not matches(rel, tag):
+                continue
+            outer_points = []
+            inner_point_lists = []
+            for way, role in relation_ways(rel, relations_by_id, ways_by_id):
+                handled_way_ids.add(way.id)
+                current_points = points_by_way[way.id]
+                if role == "outer":
+                    outer_points.append(current_points)
+                else:
+                    inner_point_lists.append(current_points)
+            if outer_points:
+                outer_points = np.concatenate(outer_points)
+                if inner_point_lists:
+                    poly = geometry.Polygon(outer_points, inner_point_lists)
+                else:
+                    poly = geometry.Polygon(outer_points)
+                polygons.append(poly)
+
+        for way in res.ways:
+            if way.id in handled_way_ids:
+                continue
+            points = points_by_way[way.id]
+            poly = None
+            try:
+                if "highway" in way.tags:
+                    hw_type = way.tags["highway"]
+                    is_tunnel = "tunnel" in way.tags
+                    if is_tunnel:
+                        continue
+                    if hw_type in self.highway_width:
+                        width = self.highway_width[hw_type]
+                        poly = geometry.LineString(points).buffer(width)
                     else:
-                        poly = geometry.Polygon(points)
-                except:
-                    continue
-                self._process_polygon(mask, poly, separate_instances, verbose)
-            mask_by_tag[tag] = mask
+                        print("Unknown highway type: ", hw_type)
+                else:
+                    poly = geometry.Polygon(points)
+            except:
+                continue
+            polygons.append(poly)
+        return polygons
+
+    def _render_masks(self, polygons_by_tag, separate_instances, verbose=0):
+        if self._labels:
+            return {"labels": self._render_labels(polygons_by_tag, separate_instances, verbose)}
+        mask_by_tag = {}
+        with self.metrics.timer("render", polygons=0) as counts:
+            for tag, polygons in polygons_by_tag.items():
+                mask = np.zeros((self._image_width, self._image_width), dtype=np.uint8)
+                if isinstance(polygons, ClippedPolygons):
+                    self._update_mask(mask, polygons, separate_instances=separate_instances)
+                else:
+                    for poly in polygons:
+                        self._process_polygon(mask, poly, separate_instances, verbose)
+                mask_by_tag[tag] = mask
+                counts["polygons"] += len(polygons)
         return mask_by_tag
 
+    def _render_labels(self, polygons_by_tag, separate_instances, verbose=0) -> np.ndarray:
+        """
+         * Renders the polygons of all tags in a single pass into one label raster, the tags with the lowest priority
+           first.
+        """
+        labels_spec = self._labels
+        labels = np.zeros((self._image_width, self._image_width),
+                          dtype=label_dtype(labels_spec.mode, len(labels_spec.classes)))
+        bitmask = labels_spec.mode == "bitmask"
+        with self.metrics.timer("render", polygons=0) as counts:
+            for tag in labels_spec.order:
+                polygons = polygons_by_tag.get(tag, [])
+                if not isinstance(polygons, ClippedPolygons):
+                    polygons = [self._clip_polygon(poly, verbose) for poly in polygons if poly]
+                self._update_labels(labels, polygons, labels_spec.classes[tag], bitmask, separate_instances)
+                counts["polygons"] += len(polygons)
+        return labels
+
+    def _update_labels(self, labels, polygons, value, bitmask, separate_instances=False) -> None:
+        for p in polygons:
+            if isinstance(p, geometry.MultiPolygon):
+                self._update_labels(labels, p.geoms, value, bitmask, separate_instances=True)
+            elif isinstance(p, geometry.Polygon) and not p.is_empty:
+                burn_label(labels, p, value, bitmask=bitmask, separate_instances=separate_instances)
+
+    def _clip_polygon(self, poly, verbose=0):
+        if verbose:
+            print(poly.wkt)
+        if not poly.is_valid:
+            poly = poly.buffer(0)
+        poly = poly.intersection(self._tile_rect)
+        if verbose:
+            print(poly.wkt)
+        return poly
+
     def _process_polygon(self, mask, poly, separate_instances, verbose=0):
         if poly:
-            if verbose:
-                print(poly.wkt)
-            if not poly.is_valid:
-                poly = poly.buffer(0)
-            poly = poly.intersection(self._tile_rect)
-            if verbose:
-                print(poly.wkt)
-            self._update_mask(mask, [poly], separate_instances=separate_instances)
+            self._update_mask(mask, [self._clip_polygon(poly, verbose)], separate_instances=separate_instances)
 
     def download_bbox(self, min_lon, min_lat, max_lon, max_lat, output_directory, file_name, separate_instances=False,
-                      bing_url=None, tags=None, verbose=0):
+                      bing_url=None, tags=None, verbose=0, feature_index=None):
         if not os.path.isdir(output_directory):
             os.makedirs(output_directory)
 
         if not tags:
             tags = ['building']
 
-        masks_by_tag = self._get_masks_by_tag(tags, min_lon, min_lat, max_lon, max_lat, separate_instances, verbose)
-        any_mask_written = False
-        for tag in masks_by_tag:
-            mask = masks_by_tag[tag]
-            if mask.max():
-                any_mask_written = True
-                mask_path = os.path.join(output_directory, "{name}_{tag}.tif".format(name=file_name, tag=tag))
-                Image.fromarray(mask).save(mask_path)
-
-        if any_mask_written:
-            img_path = os.path.join(output_directory, "{}.tiff".format(file_name))
-            img_exists = os.path.isfile(img_path)
-            if bing_url and not img_exists:
-                self._download_imagery(bing_url, img_path)
+        masks_by_tag = self._get_masks_by_tag(tags, min_lon, min_lat, max_lon, max_lat, separate_instances, verbose,
+                                              feature_index=feature_index)
+        self._write_tile(masks_by_tag, output_directory, file_name, bing_url)
+        return True
+
+    def _write_tile(self, masks_by_tag, output_directory, file_name, bing_url=None) -> TileResult:
+        """
+         * Writes the non-empty masks and downloads the imagery, if any mask was written.
+        """
+        written = {tag: bool(mask.max()) for tag, mask in masks_by_tag.items()}
+        has_image = False
+        image_failed = False
+        if any(written.values()):
+            img_path = self._writer.image_path(output_directory, file_name)
+            has_image = os.path.isfile(img_path)
+            # with a store, existing imagery is linked again, so it is revalidated once it is stale
+            if bing_url and (not has_image or self._imagery.store):
+                downloaded = self._download_imagery(bing_url, img_path)
+                image_failed = not downloaded and not has_image
+                has_image = has_image or downloaded
+            non_empty_masks = {tag: mask for tag, mask in masks_by_tag.items() if written[tag]}
+            with self.metrics.timer("write", bytes=sum(m.nbytes for m in non_empty_masks.values())):
+                self._writer.write(output_directory, file_name, non_empty_masks, img_path if has_image else None)
         else:
             print("Tile is empty...")
-        return True
+        return TileResult(masks=written, has_image=has_image, image_failed=image_failed)
 
-    @staticmethod
-    def _download_imagery(bing_url, img_path):
-        response = requests.get(bing_url, stream=True)
-        response.raw.decode_content = True
-        with open(img_path, 'wb') as file:
-            shutil.copyfileobj(response.raw, file)
-        del response
+    def _download_imagery(self, bing_url, img_path) -> bool:
+        with self.metrics.timer("imagery", bytes=0) as counts:
+            downloaded = self._imagery.download(bing_url, img_path)
+            if downloaded:
+                counts["bytes"] = os.path.getsize(img_path)
+        return downloaded
 
     def _update_mask(self, mask: np.ndarray, polygons: Iterable, separate_instances: bool = False) -> None:
         """
@@ -277,16 +690,9 @@ class Airtiler:
             if isinstance(p, geometry.MultiPolygon):
                 self._update_mask(mask=mask, polygons=p.geoms, separate_instances=True)
                 continue
-            elif not isinstance(p, geometry.Polygon):
+            elif not isinstance(p, geometry.Polygon) or p.is_empty:
                 continue
-            poly_area = Image.fromarray(np.zeros(mask.shape, dtype=np.uint8))
-            holes = Image.fromarray(np.zeros(mask.shape, dtype=np.uint8))
-            outline_color = 0 if separate_instances else 255
-            ImageDraw.Draw(poly_area).polygon(p.exterior.coords, fill=255, outline=outline_color)
-            for h in p.interiors:
-                ImageDraw.Draw(holes).polygon(h.coords, fill=255, outline=255)
-            mask[np.nonzero(np.array(poly_area, dtype=np.uint8))] = 255
-            mask[np.nonzero(np.array(holes, dtype=np.uint8))] = 0
+            burn_polygon(mask, p, separate_instances=separate_instances)
 
     def _process_internal(self, config: dict) -> bool:
         """
@@ -303,43 +709,174 @@ class Airtiler:
         random.shuffle(cities)
 
         options = config.get("options", {})
+        self.metrics.reset()
+        self._progress_interval = options.get("progress_interval", 10)
+        self._tile_order = options.get("tile_order", "rows")
         gloabl_zoom_levels = options.get("zoom_levels", [])
         separate_instances = options.get("separate_instances", False)
+        prefetch = options.get("prefetch", False)
+        prefetch_size = options.get("prefetch_size", 16)
+        workers = options.get("workers", 1)
+        pyramid = options.get("pyramid", False)
+        occupancy = options.get("occupancy", False)
+        occupancy_zoom_offset = options.get("occupancy_zoom_offset", 4)
+        labels = options.get("labels", "masks")
 
         query = config.get("query", {})
         tags = query.get("tags", [])
 
+        output_directory = self._target_directory(options)
+
+        overpass_options = [o for o in ("overpass_endpoints", "overpass_rate", "overpass_concurrency", "cache")
+                            if options.get(o)]
+        if isinstance(self._source, OsmFileSource):
+            # the local extract replaces the Overpass API, so its endpoints and response cache do not apply
+            if overpass_options:
+                print("Reading from an OSM file, ignoring the options: {}".format(", ".join(overpass_options)))
+        elif "overpass_endpoints" in options or "overpass_rate" in options or "overpass_concurrency" in options:
+            self.use_overpass(options.get("overpass_endpoints"), rate=options.get("overpass_rate"),
+                              concurrency=options.get("overpass_concurrency", 2))
+        if options.get("cache", False) and not isinstance(self._source, OsmFileSource):
+            max_size = options.get("cache_max_size")
+            self.use_cache(os.path.join(output_directory, ".cache", "overpass"), ttl=options.get("cache_ttl"),
+                           max_size=max_size * 1024 * 1024 if max_size else None)
+
+        if options.get("imagery_store"):
+            max_size = options.get("imagery_store_max_size")
+            self.use_imagery_store(os.path.join(output_directory, options["imagery_store"]),
+                                   max_size=max_size * 1024 * 1024 if max_size else None,
+                                   max_age=options.get("imagery_max_age"))
+
+        classes = self.use_labels(labels, tags or ['building'], options.get("label_priority"))
+        if classes:
+            with open(os.path.join(output_directory, "labels.json"), 'w', encoding="utf-8") as f:
+                json.dump({"mode": labels, "classes": classes}, f, indent=2)
+
+        output = options.get("output", "tiff")
+        if output == "shards":
+            self._writer = ShardWriter(shard_size=options.get("shard_size", 1000))
+        elif output == "mosaic":
+            self._writer = MosaicWriter(tile_size=self._image_width)
+        elif output == "tiff":
+            self._writer = TiffWriter()
+        else:
+            raise RuntimeError("Unknown output '{}', must be one of 'tiff', 'shards' or 'mosaic'.".format(output))
+
+        try:
+            if options.get("queue"):
+                if output != "tiff":
+                    raise RuntimeError("Only the 'tiff' output can be used with a queue.")
+                # the tiles are published once with publish(), e.g. on a coordinator; workers only claim them
+                queue = self._queue(options, output_directory)
+                return self._work(queue, output_directory, separate_instances=separate_instances, tags=tags,
+                                  batch_size=options.get("queue_batch", 8))
+            with TileLedger(os.path.join(output_directory, 'tiles.db')) as ledger:
+                return self._process_bboxes(bboxes, cities, gloabl_zoom_levels, output_directory, ledger, pyramid,
+                                            separate_instances=separate_instances, tags=tags, prefetch=prefetch,
+                                            prefetch_size=prefetch_size, workers=workers, occupancy=occupancy,
+                                            occupancy_zoom_offset=occupancy_zoom_offset)
+        finally:
+            self._writer.close()
+            self.metrics.write_report(os.path.join(output_directory, options.get("report", "run_report.json")))
+
+    @staticmethod
+    def _target_directory(options: dict) -> str:
         output_directory = options.get("target_dir", ".")
         if not os.path.isabs(output_directory):
             output_directory = os.path.join(os.getcwd(), output_directory)
         if not os.path.isdir(output_directory):
             os.makedirs(output_directory)
         assert os.path.isdir(output_directory)
+        return output_directory
 
+    @staticmethod
+    def _queue(options: dict, output_directory: str) -> TileQueue:
+        return TileQueue(os.path.join(output_directory, options["queue"]), lease=options.get("queue_lease", 300))
+
+    def publish(self, config: dict) -> int:
+        """
+         * Only publishes the tiles of the config to the queue specified in its options, e.g. on the coordinator.
+           Workers on any node, which process the same config, claim the tiles from the queue.
+        """
+        options = config.get("options", {})
+        if not options.get("queue"):
+            raise RuntimeError("No 'queue' was specified in the options of the config.")
+        if "boundingboxes" not in config:
+            raise RuntimeError("No 'boundingboxes' were specified in the config.")
+        bboxes = config['boundingboxes']
+        queue = self._queue(options, self._target_directory(options))
+        return self._publish(queue, bboxes, list(bboxes.keys()), options.get("zoom_levels", []))
+
+    def _process_bboxes(self, bboxes, cities, gloabl_zoom_levels, output_directory, ledger, pyramid=False,
+                        **kwargs) -> bool:
         all_downloaded = True
         for bbox_name in cities:
             print("Processing '{}'...".format(bbox_name))
             bbox = bboxes[bbox_name]
 
-            zoom_levels = gloabl_zoom_levels
-            if isinstance(bbox, dict):
-                if 'zoom_levels' in bbox:
-                    zoom_levels = bbox['zoom_levels']
+            zoom_levels = self._zoom_levels(bbox_name, bbox, gloabl_zoom_levels)
 
-            if not zoom_levels:
-                raise RuntimeError("Neither the config nor the bounding box '{}' have any zoom_levels specified.")
+            if pyramid:
+                complete = self._process_pyramid(bbox_name=bbox_name,
+                                                 bbox=bbox,
+                                                 zoom_levels=zoom_levels,
+                                                 output_directory=os.path.join(output_directory, bbox_name),
+                                                 ledger=ledger,
+                                                 **kwargs)
+                if not complete:
+                    all_downloaded = False
+                continue
 
             for z in zoom_levels:
                 complete = self._process_bbox(bbox_name=bbox_name,
                                               bbox=bbox,
                                               zoom_level=z,
                                               output_directory=os.path.join(output_directory, bbox_name),
-                                              separate_instances=separate_instances,
-                                              tags=tags)
+                                              ledger=ledger,
+                                              **kwargs)
                 if not complete:
                     all_downloaded = False
         return all_downloaded
 
+    @staticmethod
+    def _zoom_levels(bbox_name, bbox, gloabl_zoom_levels):
+        zoom_levels = gloabl_zoom_levels
+        if isinstance(bbox, dict):
+            if 'zoom_levels' in bbox:
+                zoom_levels = bbox['zoom_levels']
+
+        if not zoom_levels:
+            raise RuntimeError("Neither the config nor the bounding box '{}' have any zoom_levels specified."
+                               .format(bbox_name))
+        return zoom_levels
+
+    def stream(self, config: dict, buffer_size: int = 16, shuffle_window: int = 0, seed=None,
+               skip_empty: bool = True) -> TileStream:
+        """
+         * Returns an iterable of a TileSample (image, masks, metadata) per tile of all bounding boxes and zoom levels
+           of the config, as numpy arrays and without writing anything to disk.
+        :param buffer_size: The maximum number of tiles loaded ahead of the consumer
+        :param shuffle_window: If greater than 1, the tiles are shuffled within a window of that many tiles
+        :param skip_empty: If true, tiles without any mask are skipped
+        """
+        if "boundingboxes" not in config:
+            raise RuntimeError("No 'boundingboxes' were specified in the config.")
+        bboxes = config['boundingboxes']
+        options = config.get("options", {})
+        gloabl_zoom_levels = options.get("zoom_levels", [])
+        order = options.get("tile_order", "rows")
+
+        def tiles():
+            for bbox_name, bbox in bboxes.items():
+                for z in self._zoom_levels(bbox_name, bbox, gloabl_zoom_levels):
+                    for tile in self._tiles_from_bbox(bbox=bbox, zoom_level=z, order=order):
+                        yield bbox_name, tile
+
+        return TileStream(self, tiles(), config.get("query", {}).get("tags", []),
+                          separate_instances=options.get("separate_instances", False), buffer_size=buffer_size,
+                          shuffle_window=shuffle_window, seed=seed, skip_empty=skip_empty,
+                          workers=max(1, options.get("workers", 4)))
+
     def process(self, config) -> None:
         run = True
         while run:
@@ -350,8 +887,8 @@ class Airtiler:
                 run = not downloads_complete
             except KeyboardInterrupt:
                 run = False
-            except overpy.exception.OverpassTooManyRequests:
-                print("OverpassTooManyRequests: Waiting 2s...")
+            except (overpy.exception.OverpassTooManyRequests, overpy.exception.OverpassGatewayTimeout) as e:
+                print("{}: All Overpass endpoints are unavailable, waiting 2s...".format(type(e).__name__))
                 time.sleep(2)
             except Exception as e:
                 print("Error occured: " + str(e))
@@ -360,10 +897,29 @@ class Airtiler:
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-c', '--config', type=str, help="Path to the configuration file", required=True)
+    parser.add_argument('-c', '--config', type=str, help="Path to the configuration file")
     parser.add_argument('-k', '--bing-access-token', type=str, help="Access key to the Bing REST API", required=True)
+    parser.add_argument('--osm-file', type=str,
+                        help="Path to a local .osm.pbf or OSM XML extract, which is used instead of the Overpass API")
+    parser.add_argument('--publish', action='store_true',
+                        help="Only publish the tiles of the config to the queue specified in its options")
+    parser.add_argument('--backfill-imagery', type=str, metavar='DIR',
+                        help="Only download the missing imagery of the masks below the directory")
+    parser.add_argument('--imagery-store', type=str, metavar='DIR',
+                        help="Shared imagery store used by --backfill-imagery")
     args = parser.parse_args()
 
+    if args.backfill_imagery:
+        downloader = ImageryDownloader(bing_key=args.bing_access_token)
+        if args.imagery_store:
+            downloader.use_store(ImageryStore(args.imagery_store))
+        downloaded = downloader.backfill(args.backfill_imagery)
+        print("{} images downloaded".format(downloaded))
+        return
+
+    if not args.config:
+        parser.error("the following arguments are required: -c/--config")
+
     if not os.path.isfile(args.config):
         raise FileNotFoundError("Config file does not exist")
 
@@ -371,6 +927,11 @@ def main():
         config = json.load(f)
 
     airtiler = Airtiler(bing_key=args.bing_access_token)
+    if args.publish:
+        airtiler.publish(config)
+        return
+    if args.osm_file:
+        airtiler.use_osm_file(args.osm_file, tags=config.get("query", {}).get("tags", []))
     airtiler.process(config)
 
 
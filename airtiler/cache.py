@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from .scheduler import ScheduledOverpass
+
+
+class ResponseCache:
+    """
+     * Content addressed on-disk cache of raw Overpass responses. The responses are stored gzip compressed, keyed by
+       the hash of the query, which contains the bbox.
+     * Entries older than ttl seconds are ignored and removed. If the cache grows beyond max_size bytes, the least
+       recently used entries are evicted. The last use of an entry is tracked by its access time.
+    """
+
+    def __init__(self, directory: str, ttl: float = None, max_size: int = None):
+        self._directory = directory
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._size = sum(os.path.getsize(p) for p, _ in self._entries())
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _path(self, query: str) -> str:
+        if isinstance(query, str):
+            query = query.encode("utf-8")
+        key = hashlib.sha256(query).hexdigest()
+        return os.path.join(self._directory, key[:2], "{}.json.gz".format(key))
+
+    def _entries(self):
+        for root, _, files in os.walk(self._directory):
+            for name in files:
+                if name.endswith(".json.gz"):
+                    path = os.path.join(root, name)
+                    yield path, os.stat(path)
+
+    def _remove(self, path) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._size -= size
+        except OSError:
+            pass
+
+    def get(self, query: str):
+        """
+         * Returns the raw response of the query or None, if it is not cached or has expired. An entry which is removed
+           by another thread while it is read is a miss as well.
+        """
+        path = self._path(query)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            now = time.time()
+            if self._ttl and now - stat.st_mtime > self._ttl:
+                self._remove(path)
+                return None
+            os.utime(path, (now, stat.st_mtime))
+        try:
+            with gzip.open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, query: str, data: bytes) -> None:
+        path = self._path(query)
+        directory = os.path.dirname(path)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with self._lock:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(data)
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            # replaced atomically, so that a concurrent get() still reads either the old or the new entry
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path) - old_size
+            if self._max_size and self._size > self._max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+         * Removes the least recently used entries, until the cache uses at most 90% of max_size.
+        """
+        target = self._max_size * 0.9
+        for path, _ in sorted(self._entries(), key=lambda e: e[1].st_atime):
+            if self._size <= target:
+                break
+            self._remove(path)
+
+
+class CachingOverpass(ScheduledOverpass):
+    """
+     * Overpass API, which answers queries from the ResponseCache if possible and stores successful responses.
+       Queries which are not cached are scheduled like by the ScheduledOverpass.
+    """
+
+    def __init__(self, cache: ResponseCache, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache = cache
+        self._local = threading.local()
+
+    def query(self, query):
+        data = self._cache.get(query)
+        if data is not None:
+            return super().parse_json(data)
+        self._local.query = query
+        try:
+            return super().query(query)
+        finally:
+            self._local.query = None
+
+    def parse_json(self, data, encoding="utf-8"):
+        result = super().parse_json(data, encoding=encoding)
+        query = getattr(self._local, 'query', None)
+        if query is not None:
+            self._cache.put(query, data if isinstance(data, bytes) else data.encode(encoding))
+        return result
@@ -0,0 +1,217 @@
+import math
+from collections import namedtuple
+from typing import Iterable, Tuple
+import overpy
+from pygeotile.tile import Tile
+from .projection import NodeCoordinates, mercator
+
+ResultView = namedtuple('ResultView', 'relations ways coordinates')
+
+union_query_template = """
+[out:json][timeout:{timeout}];
+(
+{selectors}
+);
+(._;>>;);
+out {out};
+"""
+
+selector_template = """  relation[{tag}]({bbox});
+  way[{tag}]({bbox});"""
+
+
+def parse_tag(tag: str) -> Tuple[str, str]:
+    """
+     * Splits a configured tag like 'building' or 'landuse=vineyard' into key and value. The value is None,
+       if the tag only consists of a key.
+    """
+    if "=" in tag:
+        attr, value = tag.split("=")
+        return attr, value
+    return tag, None
+
+
+def query_tag(tag: str) -> str:
+    """
+     * Returns the tag in the format used by the Overpass QL, e.g. "landuse"="vineyard"
+    """
+    attr, value = parse_tag(tag)
+    if value is None:
+        return "\"{}\"".format(attr)
+    return "\"{}\"=\"{}\"".format(attr, value)
+
+
+def build_union_query(tags: Iterable[str], min_lon, min_lat, max_lon, max_lat, timeout=180, out="body") -> str:
+    """
+     * Returns a single Overpass query, which fetches all ways and relations of all tags inside the bbox.
+    :param out: The verbosity of the output, e.g. 'skel qt' to fetch the geometry without tags
+    """
+    bbox = "{},{},{},{}".format(min_lat, min_lon, max_lat, max_lon)
+    selectors = "\n".join(selector_template.format(tag=query_tag(t), bbox=bbox) for t in tags)
+    return union_query_template.format(timeout=timeout, selectors=selectors, out=out)
+
+
+def matches(element, tag: str) -> bool:
+    return tags_match(element.tags, tag)
+
+
+def tags_match(tags: dict, tag: str) -> bool:
+    attr, value = parse_tag(tag)
+    if attr not in tags:
+        return False
+    return value is None or tags[attr] == value
+
+
+def relation_ways(rel, relations_by_id, ways_by_id, role=None, visited=None):
+    """
+     * Yields (way, role) for all member ways of the relation, which are contained in the result. Member relations
+       are resolved recursively; their ways inherit the role of the member relation, if they have none of their own.
+    """
+    if visited is None:
+        visited = set()
+    visited.add(rel.id)
+    for mem in rel.members:
+        mem_role = mem.role or role
+        if isinstance(mem, overpy.RelationWay):
+            way = ways_by_id.get(mem.ref)
+            if way:
+                yield way, mem_role
+        elif isinstance(mem, overpy.RelationRelation) and mem.ref not in visited:
+            child = relations_by_id.get(mem.ref)
+            if child:
+                yield from relation_ways(child, relations_by_id, ways_by_id, mem_role, visited)
+
+
+def occupied_tiles(relations, ways, coordinates: NodeCoordinates, zoom_level: int, range_x: range, range_y: range,
+                   margin: float = 0.0) -> set:
+    """
+     * Returns the TMS coordinates (x, y) of the tiles within the ranges, which are touched by the envelope of a way
+       or of all member ways of a relation. The envelopes are grown by margin tiles, e.g. for buffered highways.
+    """
+    ways_by_id = {w.id: w for w in ways}
+    relations_by_id = {r.id: r for r in relations}
+    envelopes = [coordinates.bounds([w]) for w in ways]
+    envelopes.extend(coordinates.bounds([w for w, _ in relation_ways(r, relations_by_id, ways_by_id)])
+                     for r in relations)
+    n = 2 ** zoom_level
+    occupied = set()
+    for envelope in envelopes:
+        if not envelope:
+            continue
+        min_lon, min_lat, max_lon, max_lat = envelope
+        left, top = mercator(min_lon, max_lat)
+        right, bottom = mercator(max_lon, min_lat)
+        min_x = max(range_x.start, int(math.floor(left * n - margin)))
+        max_x = min(range_x.stop - 1, int(math.floor(right * n + margin)))
+        min_y = max(range_y.start, n - 1 - int(math.floor(bottom * n + margin)))
+        max_y = min(range_y.stop - 1, n - 1 - int(math.floor(top * n - margin)))
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                occupied.add((x, y))
+    return occupied
+
+
+def tile_range(min_lon, min_lat, max_lon, max_lat, zoom_level) -> Tuple[range, range]:
+    """
+     * Returns the ranges of the TMS x and y coordinates of the tiles at the zoom level, which cover the bbox.
+    """
+    tile_min = Tile.for_latitude_longitude(latitude=min_lat, longitude=min_lon, zoom=zoom_level)
+    tile_max = Tile.for_latitude_longitude(latitude=max_lat, longitude=max_lon, zoom=zoom_level)
+    min_x, max_x = sorted((tile_min.tms_x, tile_max.tms_x))
+    min_y, max_y = sorted((tile_min.tms_y, tile_max.tms_y))
+    return range(min_x, max_x + 1), range(min_y, max_y + 1)
+
+
+class FeatureIndex:
+    """
+     * Holds the result of a single Overpass query covering many tiles and provides the relations and ways of a tag
+       per tile, as if they had been queried for that tile only.
+     * The spatial index is a grid of the tiles at the given zoom level. Each element is registered in all tiles
+       its envelope covers.
+    """
+
+    def __init__(self, result, tags: Iterable[str], zoom_level: int):
+        self._zoom_level = zoom_level
+        self._ways_by_id = {w.id: w for w in result.ways}
+        self._relations_by_id = {r.id: r for r in result.relations}
+        self.coordinates = NodeCoordinates(result.ways)
+        self._members = {}
+        self._grid = {}
+        for tag in tags:
+            relations = [r for r in result.relations if matches(r, tag)]
+            member_way_ids = set()
+            for rel in relations:
+                members = self._member_ways(rel)
+                member_way_ids.update(w.id for w in members)
+                self._register(tag, 'relations', rel, members)
+            for way in result.ways:
+                if way.id not in member_way_ids and matches(way, tag):
+                    self._register(tag, 'ways', way, [way])
+
+    def _resolve(self, rel):
+        """
+         * Returns the relation itself with all its nested member relations and all member ways.
+        """
+        if rel.id not in self._members:
+            visited = set()
+            ways = [way for way, _ in relation_ways(rel, self._relations_by_id, self._ways_by_id, visited=visited)]
+            self._members[rel.id] = [self._relations_by_id[i] for i in visited], ways
+        return self._members[rel.id]
+
+    def _member_ways(self, rel):
+        return self._resolve(rel)[1]
+
+    def _tile_range(self, min_lon, min_lat, max_lon, max_lat):
+        return tile_range(min_lon, min_lat, max_lon, max_lat, self._zoom_level)
+
+    def _register(self, tag, kind, element, ways):
+        bounds = self.coordinates.bounds(ways)
+        if not bounds:
+            return
+        range_x, range_y = self._tile_range(*bounds)
+        for x in range_x:
+            for y in range_y:
+                cell = self._grid.setdefault((tag, x, y), {'relations': [], 'ways': []})
+                cell[kind].append(element)
+
+    def query(self, tag, min_lon, min_lat, max_lon, max_lat, inset: float = 0.01) -> ResultView:
+        """
+         * Returns the relations and ways of the tag, which may intersect the specified bbox. Member ways and member
+           relations are contained as well, just like in the result of a per tile query.
+        :param inset: The fraction of the bbox, by which it is shrunk, so the elements of the neighbouring tiles, which
+                      only touch the border of a tile, are not returned
+        """
+        inset_lon = (max_lon - min_lon) * inset
+        inset_lat = (max_lat - min_lat) * inset
+        range_x, range_y = self._tile_range(min_lon + inset_lon, min_lat + inset_lat,
+                                            max_lon - inset_lon, max_lat - inset_lat)
+        relations = {}
+        ways = {}
+        for x in range_x:
+            for y in range_y:
+                cell = self._grid.get((tag, x, y))
+                if not cell:
+                    continue
+                for rel in cell['relations']:
+                    member_relations, member_ways = self._resolve(rel)
+                    for member in member_relations:
+                        relations[member.id] = member
+                    for way in member_ways:
+                        ways[way.id] = way
+                for way in cell['ways']:
+                    ways[way.id] = way
+        return ResultView(relations=list(relations.values()), ways=list(ways.values()), coordinates=self.coordinates)
+
+    def occupancy(self, tags, min_lon, min_lat, max_lon, max_lat, zoom_level, margin=0.0) -> set:
+        """
+         * Returns the tiles of the bbox at the zoom level, which may contain an element of one of the tags.
+        """
+        relations = {}
+        ways = {}
+        for tag in tags:
+            view = self.query(tag, min_lon, min_lat, max_lon, max_lat)
+            relations.update((r.id, r) for r in view.relations)
+            ways.update((w.id, w) for w in view.ways)
+        range_x, range_y = tile_range(min_lon, min_lat, max_lon, max_lat, zoom_level)
+        return occupied_tiles(relations.values(), ways.values(), self.coordinates, zoom_level, range_x, range_y,
+                              margin=margin)
@@ -0,0 +1,91 @@
+import math
+import threading
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+from .features import FeatureIndex, ResultView
+from .projection import mercator
+
+
+class ClippedPolygons(list):
+    """
+     * The polygons of a tile, which are already valid and clipped to the tile, so they can be rendered as they are.
+    """
+    pass
+
+
+def zoom_of(min_lon, max_lon) -> int:
+    """
+     * Returns the zoom level of a tile from its longitudes.
+    """
+    return int(round(math.log2(360.0 / (max_lon - min_lon))))
+
+
+def grid_origin(min_lon, max_lat, zoom_level):
+    """
+     * Returns the Google coordinates of the tile at the zoom level, whose north west corner is the specified point.
+    """
+    n = 2 ** zoom_level
+    x, y = mercator(min_lon, max_lat)
+    return int(round(float(x) * n)), int(round(float(y) * n))
+
+
+class PreparedGeometries:
+    """
+     * The valid and (for highways) buffered geometries of a tag in pixel coordinates of the tile grid at a zoom level,
+       relative to the tile origin (in Google coordinates). They are indexed by an STRtree, so only the geometries,
+       whose bounds intersect a tile, are clipped to it.
+    """
+
+    def __init__(self, polygons, zoom_level: int, image_width: int, origin):
+        self._geometries = np.array([p if p.is_valid else p.buffer(0) for p in polygons if p], dtype=object)
+        self._tree = STRtree(self._geometries)
+        self._zoom_level = zoom_level
+        self._image_width = image_width
+        self._origin = origin
+
+    def __len__(self):
+        return len(self._geometries)
+
+    def clip(self, min_lon, max_lat) -> ClippedPolygons:
+        """
+         * Returns the geometries clipped to the tile with the specified north west corner, in pixel coordinates of
+           the tile, in the order of the polygons.
+        """
+        x, y = grid_origin(min_lon, max_lat, self._zoom_level)
+        x0 = (x - self._origin[0]) * self._image_width
+        y0 = (y - self._origin[1]) * self._image_width
+        x1 = x0 + self._image_width
+        y1 = y0 + self._image_width
+        candidates = np.sort(self._tree.query(shapely.box(x0, y0, x1, y1)))
+        if not len(candidates):
+            return ClippedPolygons()
+        clipped = shapely.clip_by_rect(self._geometries[candidates], x0, y0, x1, y1)
+        clipped = shapely.transform(clipped, lambda points: points - (x0, y0))
+        return ClippedPolygons(p for p in clipped if not p.is_empty)
+
+
+class PreparedArea:
+    """
+     * The data of a fetched area, e.g. a prefetched block of tiles. The geometries of each tag and zoom level are
+       built once by build(view, zoom_level, origin) and shared by all tiles of the area. It can be used from several
+       threads.
+    """
+
+    def __init__(self, feature_index: FeatureIndex, min_lon, min_lat, max_lon, max_lat):
+        self.feature_index = feature_index
+        self.bounds = (min_lon, min_lat, max_lon, max_lat)
+        self._geometries = {}
+        self._lock = threading.Lock()
+
+    def query(self, tag, min_lon, min_lat, max_lon, max_lat) -> ResultView:
+        return self.feature_index.query(tag, min_lon, min_lat, max_lon, max_lat)
+
+    def geometries(self, tag: str, zoom_level: int, build) -> PreparedGeometries:
+        with self._lock:
+            key = (tag, zoom_level)
+            if key not in self._geometries:
+                min_lon, min_lat, max_lon, max_lat = self.bounds
+                view = self.feature_index.query(tag, min_lon, min_lat, max_lon, max_lat, inset=0)
+                self._geometries[key] = build(view, zoom_level, grid_origin(min_lon, max_lat, zoom_level))
+            return self._geometries[key]
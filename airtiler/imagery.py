@@ -0,0 +1,273 @@
+import asyncio
+import itertools
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple, List
+import requests
+from requests.adapters import HTTPAdapter
+from pygeotile.tile import Tile
+from .imagestore import ImageryStore, StoredImage
+
+metadata_url = "https://dev.virtualearth.net/REST/V1/Imagery/Metadata/Aerial?key={key}"
+mask_name_pattern = re.compile(r"^(\d+)_(\d+)_(\d+)_.+\.tif$")
+
+
+def _get(coll, index, default):
+    return coll[index] if len(coll) > index else default
+
+
+class ImageryDownloader:
+    """
+     * Downloads Bing imagery tiles over a pooled, keep-alive HTTP session. The requests are distributed across all
+       subdomains returned by the imagery metadata and failed requests are retried with exponential backoff.
+     * download() is blocking and safe to be used from several threads, download_all() downloads many tiles
+       concurrently using asyncio.
+     * If a store is used, each tile is downloaded once into the ImageryStore, revalidated once it is stale and
+       linked to the requested paths.
+    """
+
+    def __init__(self, bing_key=None, concurrency=8, retries=3, backoff=0.5, timeout=30):
+        self._bing_key = bing_key
+        self._concurrency = concurrency
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._session = None
+        self._subdomains = None
+        self._image_url = None
+        self._subdomain_cycle = None
+        self._lock = threading.Lock()
+        self._metadata_lock = threading.Lock()
+        self._quadkey_pattern = None
+        self.store = None
+
+    def use_store(self, store: ImageryStore) -> None:
+        self.store = store
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if not self._session:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self._concurrency)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def set_metadata(self, subdomains: List[str], image_url: str) -> None:
+        self._subdomains = list(subdomains)
+        self._image_url = image_url
+        self._subdomain_cycle = itertools.cycle(self._subdomains) if self._subdomains else None
+        self._quadkey_pattern = None
+        if image_url:
+            parts = re.split(r"(\{\w+\})", image_url)
+            self._quadkey_pattern = re.compile("".join(
+                "(?P<quadkey>[0-3]*)" if p == "{quadkey}" else "[^/?]*" if p.startswith("{") else re.escape(p)
+                for p in parts))
+
+    def quadkey_of(self, url: str):
+        """
+         * Returns the quadkey of a url returned by url_for() or None, if it is not an imagery url.
+        """
+        match = self._quadkey_pattern.fullmatch(url) if self._quadkey_pattern else None
+        return match.group("quadkey") if match else None
+
+    def load_metadata(self) -> Tuple:
+        """
+         * Loads the subdomains and the url template of the imagery once. Returns (None, None) without a Bing key.
+        """
+        with self._metadata_lock:
+            if self._subdomains is None:
+                if not self._bing_key:
+                    self.set_metadata([], None)
+                else:
+                    response = self.session.get(metadata_url.format(key=self._bing_key), timeout=self._timeout)
+                    data = response.json()
+                    resource_set = _get(data.get('resourceSets', []), 0, {})
+                    resource = _get(resource_set.get('resources', []), 0, {})
+                    self.set_metadata(resource.get('imageUrlSubdomains', []), resource.get('imageUrl', None))
+            return self._subdomains, self._image_url
+
+    def url_for(self, quadkey: str):
+        """
+         * Returns the url of the tile, using the next subdomain in turn. Returns None, if no imagery is available.
+        """
+        self.load_metadata()
+        if not self._image_url or not self._subdomain_cycle:
+            return None
+        with self._lock:
+            subdomain = next(self._subdomain_cycle)
+        return self._image_url.format(subdomain=subdomain, quadkey=quadkey)
+
+    def _get_once(self, url, path) -> None:
+        response = self.session.get(url, stream=True, timeout=self._timeout)
+        try:
+            response.raise_for_status()
+            tmp_path = "{}.part".format(path)
+            with open(tmp_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    file.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            response.close()
+
+    def _retry(self, url, action):
+        """
+         * Returns the result of action(), which is retried with exponential backoff on errors. Returns None, if the
+           last attempt failed as well.
+        """
+        for attempt in range(self._retries + 1):
+            try:
+                return action()
+            except requests.RequestException as e:
+                if attempt == self._retries:
+                    print("Download of {} failed: {}".format(url, e))
+                    return None
+                time.sleep(self._backoff * 2 ** attempt)
+
+    def download(self, url, path) -> bool:
+        """
+         * Downloads the url to path. The file is only created, once it has been downloaded completely.
+        """
+        quadkey = self.quadkey_of(url) if self.store else None
+        if quadkey is not None:
+            image = self._stored(url, quadkey)
+            if not image:
+                return False
+            try:
+                self.store.link(image, path)
+                return True
+            except OSError as e:
+                # e.g. evicted by another process in the meantime
+                print("Imagery {} could not be linked: {}".format(quadkey, e))
+        return bool(self._retry(url, lambda: self._get_once(url, path) or True))
+
+    def _store_once(self, url, quadkey, image: StoredImage) -> StoredImage:
+        headers = {}
+        if image and image.etag:
+            headers["If-None-Match"] = image.etag
+        if image and image.last_modified:
+            headers["If-Modified-Since"] = image.last_modified
+        response = self.session.get(url, headers=headers, stream=True, timeout=self._timeout)
+        try:
+            if image and response.status_code == 304:
+                self.store.revalidated(quadkey)
+                return image
+            response.raise_for_status()
+            return self.store.put(quadkey, response.iter_content(chunk_size=64 * 1024),
+                                  etag=response.headers.get("ETag"),
+                                  last_modified=response.headers.get("Last-Modified"))
+        finally:
+            response.close()
+
+    def _stored(self, url, quadkey):
+        """
+         * Returns the StoredImage of the tile, which is downloaded or revalidated first, if it is not stored or stale.
+           A stale image is still returned, if it could not be revalidated. Returns None, if the download failed.
+        """
+        image = self.store.get(quadkey)
+        if image and not self.store.is_stale(image):
+            return image
+        stored = self._retry(url, lambda: self._store_once(url, quadkey, image))
+        if stored is None and image:
+            print("Using the stale imagery of {}".format(quadkey))
+            return image
+        return stored
+
+    def _fetch_once(self, url) -> bytes:
+        response = self.session.get(url, timeout=self._timeout)
+        try:
+            response.raise_for_status()
+            return response.content
+        finally:
+            response.close()
+
+    def fetch(self, url):
+        """
+         * Returns the content of the url without writing it to disk (except to the store, if any), or None if it
+           could not be downloaded.
+        """
+        quadkey = self.quadkey_of(url) if self.store else None
+        if quadkey is not None:
+            image = self._stored(url, quadkey)
+            if not image:
+                return None
+            try:
+                with open(image.path, 'rb') as f:
+                    return f.read()
+            except OSError as e:
+                print("Imagery {} could not be read: {}".format(quadkey, e))
+        return self._retry(url, lambda: self._fetch_once(url))
+
+    async def _download_async(self, loop, executor, semaphore, url, path) -> bool:
+        async with semaphore:
+            if self.store:
+                return await loop.run_in_executor(executor, self.download, url, path)
+            for attempt in range(self._retries + 1):
+                try:
+                    await loop.run_in_executor(executor, self._get_once, url, path)
+                    return True
+                except requests.RequestException as e:
+                    if attempt == self._retries:
+                        print("Download of {} failed: {}".format(url, e))
+                        return False
+                    await asyncio.sleep(self._backoff * 2 ** attempt)
+
+    async def _download_batch(self, loop, executor, batch) -> int:
+        semaphore = asyncio.Semaphore(self._concurrency)
+        coroutines = []
+        for quadkey, path in batch:
+            url = self.url_for(quadkey)
+            if url:
+                coroutines.append(self._download_async(loop, executor, semaphore, url, path))
+        results = await asyncio.gather(*coroutines)
+        return sum(results)
+
+    def download_all(self, tiles: Iterable[Tuple[str, str]], batch_size=1000) -> int:
+        """
+         * Downloads the imagery of all (quadkey, path) tuples concurrently, with at most 'concurrency' requests in
+           flight. Returns the number of downloaded tiles.
+        """
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self._concurrency)
+        downloaded = 0
+        try:
+            tiles = iter(tiles)
+            while True:
+                batch = list(itertools.islice(tiles, batch_size))
+                if not batch:
+                    break
+                downloaded += loop.run_until_complete(self._download_batch(loop, executor, batch))
+        finally:
+            executor.shutdown(wait=True)
+            loop.close()
+        return downloaded
+
+    def backfill(self, directory: str) -> int:
+        """
+         * Downloads the missing imagery of all tiles below directory, for which at least one mask exists.
+        """
+        return self.download_all(missing_imagery(directory))
+
+
+def missing_imagery(directory: str):
+    """
+     * Yields (quadkey, image path) of each tile below directory, which has a mask but no imagery.
+    """
+    for root, _, files in os.walk(directory):
+        names = set(files)
+        seen = set()
+        for name in sorted(files):
+            match = mask_name_pattern.match(name)
+            if not match:
+                continue
+            z, x, y = map(int, match.groups())
+            img_name = "{}_{}_{}.tiff".format(z, x, y)
+            if img_name in names or img_name in seen:
+                continue
+            seen.add(img_name)
+            yield Tile.from_tms(tms_x=x, tms_y=y, zoom=z).quad_tree, os.path.join(root, img_name)
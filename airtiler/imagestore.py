@@ -0,0 +1,172 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from .tilequeue import _Transaction
+
+StoredImage = namedtuple('StoredImage', 'quadkey path etag last_modified checked')
+
+schema = """
+CREATE TABLE IF NOT EXISTS images (
+    quadkey TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    checked REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_digest ON images (digest);
+CREATE INDEX IF NOT EXISTS images_used ON images (used);
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+"""
+
+
+class ImageryStore:
+    """
+     * Content addressed on-disk store of imagery tiles, shared by all bounding boxes and runs. Each tile is indexed by
+       its quadkey (which contains the zoom level) and refers to a file named by the hash of its content, so identical
+       images, e.g. the placeholders of areas without imagery, are stored once.
+     * The images are hard linked into the output directories, or copied if the filesystem does not support it.
+       Images older than max_age seconds are stale and should be revalidated with their ETag or Last-Modified. If the
+       objects grow beyond max_size bytes, the least recently used tiles are evicted; linked output files are kept.
+    """
+
+    def __init__(self, directory: str, max_size: int = None, max_age: float = None):
+        self._directory = directory
+        self._max_size = max_size
+        self.max_age = max_age
+        self._path = os.path.join(directory, "index.db")
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self._path, timeout=60)
+        try:
+            connection.executescript(schema)
+        finally:
+            connection.close()
+
+    def _connect(self) -> _Transaction:
+        connection = sqlite3.connect(self._path, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=DELETE")
+        return _Transaction(connection)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._directory, "objects", digest[:2], digest)
+
+    @property
+    def size(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def get(self, quadkey: str) -> StoredImage:
+        """
+         * Returns the stored image of the tile or None, if it is not stored.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT digest, etag, last_modified, checked FROM images WHERE quadkey=?",
+                                     (quadkey,)).fetchone()
+            if not row:
+                return None
+            connection.execute("UPDATE images SET used=? WHERE quadkey=?", (time.time(), quadkey))
+        digest, etag, last_modified, checked = row
+        path = self._object_path(digest)
+        if not os.path.isfile(path):
+            return None
+        return StoredImage(quadkey=quadkey, path=path, etag=etag, last_modified=last_modified, checked=checked)
+
+    def is_stale(self, image: StoredImage) -> bool:
+        return bool(self.max_age) and time.time() - image.checked > self.max_age
+
+    def revalidated(self, quadkey: str) -> None:
+        """
+         * Records that the stored image of the tile is still up to date.
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE images SET checked=? WHERE quadkey=?", (time.time(), quadkey))
+
+    def put(self, quadkey: str, chunks, etag: str = None, last_modified: str = None) -> StoredImage:
+        """
+         * Stores the image of the tile, which is given as an iterable of bytes, e.g. the chunks of a response.
+        """
+        tmp_path = os.path.join(self._directory, "{}.{}.{}.tmp".format(quadkey, os.getpid(), threading.get_ident()))
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = sha.hexdigest()
+            path = self._object_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # an existing object is kept, as it may already be linked into output directories
+            if not os.path.isfile(path):
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        now = time.time()
+        with self._connect() as connection:
+            previous = connection.execute("SELECT digest FROM images WHERE quadkey=?", (quadkey,)).fetchone()
+            connection.execute("INSERT OR REPLACE INTO objects (digest, size) VALUES (?, ?)", (digest, size))
+            connection.execute("INSERT OR REPLACE INTO images (quadkey, digest, etag, last_modified, checked, used) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", (quadkey, digest, etag, last_modified, now, now))
+            # the previous image of a tile, which changed, is removed if no other tile refers to it
+            if previous and previous[0] != digest:
+                self._remove_unreferenced(connection, previous[0])
+        if self._max_size:
+            self._evict(keep=digest)
+        return StoredImage(quadkey=quadkey, path=path, etag=etag, last_modified=last_modified, checked=now)
+
+    def _evict(self, keep: str = None) -> None:
+        """
+         * Removes the least recently used tiles and the objects no tile refers to anymore, until the objects use at
+           most 90% of max_size.
+        """
+        if self.size <= self._max_size:
+            return
+        target = self._max_size * 0.9
+        with self._lock, self._connect() as connection:
+            size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            rows = connection.execute("SELECT quadkey, digest FROM images ORDER BY used").fetchall()
+            for quadkey, digest in rows:
+                if size <= target:
+                    break
+                if digest == keep:
+                    continue
+                connection.execute("DELETE FROM images WHERE quadkey=?", (quadkey,))
+                size -= self._remove_unreferenced(connection, digest)
+
+    def _remove_unreferenced(self, connection: sqlite3.Connection, digest: str) -> int:
+        """
+         * Removes the object, if no tile refers to it anymore. Returns the size of the removed object.
+        """
+        if connection.execute("SELECT 1 FROM images WHERE digest=? LIMIT 1", (digest,)).fetchone():
+            return 0
+        row = connection.execute("SELECT size FROM objects WHERE digest=?", (digest,)).fetchone()
+        connection.execute("DELETE FROM objects WHERE digest=?", (digest,))
+        try:
+            os.remove(self._object_path(digest))
+        except OSError:
+            pass
+        return row[0] if row else 0
+
+    @staticmethod
+    def link(image: StoredImage, path: str) -> None:
+        """
+         * Hard links the stored image to path, replacing an existing file. Falls back to a copy, if the path is on
+           another filesystem.
+        """
+        tmp_path = "{}.{}.link".format(path, threading.get_ident())
+        try:
+            os.link(image.path, tmp_path)
+        except OSError:
+            shutil.copyfile(image.path, tmp_path)
+        os.replace(tmp_path, path)
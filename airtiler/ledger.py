@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+TileResult = namedtuple('TileResult', 'masks has_image image_failed')
+
+DONE = "done"
+EMPTY = "empty"
+PARTIAL = "partial"
+FAILED = "failed"
+
+schema = """
+CREATE TABLE IF NOT EXISTS tiles (
+    bbox TEXT NOT NULL,
+    zoom INTEGER NOT NULL,
+    tile TEXT NOT NULL,
+    status TEXT NOT NULL,
+    has_image INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    updated REAL NOT NULL,
+    PRIMARY KEY (bbox, zoom, tile)
+);
+CREATE TABLE IF NOT EXISTS masks (
+    bbox TEXT NOT NULL,
+    zoom INTEGER NOT NULL,
+    tile TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    written INTEGER NOT NULL,
+    PRIMARY KEY (bbox, zoom, tile, tag)
+);
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY
+);
+"""
+
+
+def status_of(result: TileResult) -> str:
+    if not any(result.masks.values()):
+        return EMPTY
+    if result.image_failed:
+        return PARTIAL
+    return DONE
+
+
+class TileLedger:
+    """
+     * Records the state of each tile of a run in an SQLite database: its status, whether the imagery and the mask
+       of each tag were written, the last error and the time of the last update.
+     * The records are committed in batches of batch_size. After a crash, at most the last batch is lost, which only
+       causes these tiles to be processed again.
+     * Tiles with the status 'done' or 'empty' are finished, tiles which are 'partial' (e.g. the imagery could not
+       be downloaded) or 'failed' are processed again on the next run.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self._path = path
+        self._batch_size = batch_size
+        self._pending = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(schema)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def finished_tiles(self, bbox: str, zoom: int) -> set:
+        """
+         * Returns the names of the tiles of the bbox and zoom level, which do not have to be processed again.
+        """
+        rows = self._connection.execute("SELECT tile FROM tiles WHERE bbox=? AND zoom=? AND status IN (?, ?)",
+                                        (bbox, zoom, DONE, EMPTY))
+        return set(r[0] for r in rows)
+
+    def status(self, bbox: str, zoom: int, tile: str):
+        row = self._connection.execute("SELECT status FROM tiles WHERE bbox=? AND zoom=? AND tile=?",
+                                       (bbox, zoom, tile)).fetchone()
+        return row[0] if row else None
+
+    def _upsert(self, bbox: str, zoom: int, tile: str, status: str, updated: float) -> None:
+        """
+         * Inserts the tile with no attempts, if it is not recorded yet, so the update of the record counts the attempt.
+           The upsert syntax of SQLite is avoided, as it requires SQLite 3.24.
+        """
+        self._connection.execute("INSERT OR IGNORE INTO tiles (bbox, zoom, tile, status, attempts, updated) "
+                                 "VALUES (?, ?, ?, ?, 0, ?)", (bbox, zoom, tile, status, updated))
+
+    def record(self, bbox: str, zoom: int, tile: str, result: TileResult) -> None:
+        status, updated = status_of(result), time.time()
+        self._upsert(bbox, zoom, tile, status, updated)
+        self._connection.execute("UPDATE tiles SET status=?, has_image=?, error=NULL, attempts=attempts + 1, updated=? "
+                                 "WHERE bbox=? AND zoom=? AND tile=?",
+                                 (status, int(bool(result.has_image)), updated, bbox, zoom, tile))
+        self._connection.executemany("INSERT OR REPLACE INTO masks (bbox, zoom, tile, tag, written) VALUES "
+                                     "(?, ?, ?, ?, ?)",
+                                     [(bbox, zoom, tile, tag, int(bool(w))) for tag, w in result.masks.items()])
+        self._written()
+
+    def record_failure(self, bbox: str, zoom: int, tile: str, error: Exception) -> None:
+        updated = time.time()
+        self._upsert(bbox, zoom, tile, FAILED, updated)
+        self._connection.execute("UPDATE tiles SET status=?, error=?, attempts=attempts + 1, updated=? "
+                                 "WHERE bbox=? AND zoom=? AND tile=?",
+                                 (FAILED, "{}: {}".format(type(error).__name__, error), updated, bbox, zoom, tile))
+        self._written()
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self._connection.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+    def import_tiles_txt(self, bbox: str, path: str) -> int:
+        """
+         * Marks the tiles listed in a tiles.txt of previous versions as done. Each file is only imported once.
+        """
+        if not os.path.isfile(path):
+            return 0
+        path = os.path.abspath(path)
+        if self._connection.execute("SELECT 1 FROM imports WHERE path=?", (path,)).fetchone():
+            return 0
+        rows = []
+        with open(path, 'r', encoding="utf-8") as f:
+            for line in f:
+                tile = line.strip()
+                if tile:
+                    rows.append((bbox, int(tile.split("_")[0]), tile, DONE, time.time()))
+        self._connection.executemany("INSERT OR IGNORE INTO tiles (bbox, zoom, tile, status, updated) "
+                                     "VALUES (?, ?, ?, ?, ?)", rows)
+        self._connection.execute("INSERT INTO imports (path) VALUES (?)", (path,))
+        self.flush()
+        return len(rows)
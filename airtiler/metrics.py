@@ -0,0 +1,116 @@
+import datetime
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+     * Collects the time spent in each stage of a run (e.g. 'query', 'geometry', 'render', 'write', 'imagery'), the
+       number of calls and counters like bytes and polygons per stage. It is safe to be used from several threads.
+     * Each hook is called as hook(stage, seconds, counts) after a stage finished, e.g. to export the measurements
+       to a monitoring system.
+    """
+
+    def __init__(self):
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages = {}
+            self._started = time.time()
+            self.tiles = 0
+
+    @contextmanager
+    def timer(self, stage: str, **counts):
+        """
+         * Measures the duration of the with block. Counts can be added to the yielded dict inside the block.
+        """
+        counts = dict(counts)
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(stage, time.perf_counter() - start, **counts)
+
+    def record(self, stage: str, seconds: float, **counts) -> None:
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            for name, value in counts.items():
+                stats[name] = stats.get(name, 0) + value
+        for hook in self.hooks:
+            hook(stage, seconds, counts)
+
+    def add(self, stage: str, **counts) -> None:
+        """
+         * Adds counts to a stage, without recording a call.
+        """
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            for name, value in counts.items():
+                stats[name] = stats.get(name, 0) + value
+
+    def tile_done(self) -> None:
+        with self._lock:
+            self.tiles += 1
+
+    def report(self) -> dict:
+        """
+         * Returns the measurements since the last reset.
+        """
+        with self._lock:
+            elapsed = time.time() - self._started
+            stages = {}
+            for stage, stats in self._stages.items():
+                stats = dict(stats)
+                stats["mean_seconds"] = stats["seconds"] / stats["calls"] if stats["calls"] else 0.0
+                stages[stage] = stats
+            return {
+                "started": datetime.datetime.fromtimestamp(self._started).isoformat(),
+                "elapsed_seconds": elapsed,
+                "tiles": self.tiles,
+                "tiles_per_second": self.tiles / elapsed if elapsed else 0.0,
+                "stages": stages
+            }
+
+    def write_report(self, path: str) -> None:
+        with open(path, 'w', encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class Progress:
+    """
+     * Prints the number of processed tiles, the throughput and the estimated remaining time at most every interval
+       seconds.
+    """
+
+    def __init__(self, name: str, total: int, interval: float = 10, clock=time.monotonic):
+        self._name = name
+        self._total = total
+        self._interval = interval
+        self._clock = clock
+        self._started = clock()
+        self._printed = self._started
+        self.done = 0
+
+    def tile_done(self) -> None:
+        self.done += 1
+        now = self._clock()
+        if now - self._printed >= self._interval or self.done == self._total:
+            self._printed = now
+            print(self.status(now))
+
+    def status(self, now=None) -> str:
+        elapsed = (now if now is not None else self._clock()) - self._started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if rate:
+            eta = str(datetime.timedelta(seconds=int((self._total - self.done) / rate)))
+        else:
+            eta = "unknown"
+        return "{}: {}/{} tiles, {:.2f} tiles/s, ETA {}".format(self._name, self.done, self._total, rate, eta)
@@ -0,0 +1,124 @@
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+TileJob = namedtuple('TileJob', 'tile_name zoom min_lon min_lat max_lon max_lat bing_url output_directory block')
+
+
+def render_masks(image_width, polygons_by_tag, separate_instances, verbose=0, labels=None):
+    """
+     * Renders the masks in a worker process. A new Airtiler is created, as the calling instance may hold state
+       which cannot be pickled. Returns the masks and the time it took to render them.
+    """
+    from . import Airtiler
+    start = time.perf_counter()
+    airtiler = Airtiler(image_width=image_width)
+    airtiler._labels = labels
+    masks = airtiler._render_masks(polygons_by_tag, separate_instances, verbose)
+    return masks, time.perf_counter() - start
+
+
+class TilePipeline:
+    """
+     * Processes tiles in three stages: the OSM data is fetched by a thread pool, the masks are rendered by a process
+       pool and the masks and imagery are written by the thread pool again. At most max_pending tiles are in flight
+       at once, which bounds the memory used by the queues between the stages.
+     * Tiles complete out of order. Completed tiles are reported to on_complete from the calling thread only.
+    """
+
+    def __init__(self, airtiler, workers: int, separate_instances: bool, tags, verbose=0, max_pending=None):
+        self._airtiler = airtiler
+        self._workers = workers
+        self._separate_instances = separate_instances
+        self._tags = tags or ['building']
+        self._verbose = verbose
+        self._max_pending = max_pending or 4 * workers
+        self._completed = queue.Queue()
+        self._io_pool = None
+        self._cpu_pool = None
+
+    def run(self, jobs, on_complete, on_error=None, feature_index_for=None) -> None:
+        """
+         * Processes all jobs and calls on_complete(job, result) for each finished tile and on_error(job, error) for
+           each failed tile. After the first failure, no more jobs are started and the error is raised once the
+           pending tiles are done. If feature_index_for is set, it is called with a job and returns a future of the
+           FeatureIndex which contains the job's tile.
+        """
+        pending = 0
+        error = None
+        with ThreadPoolExecutor(max_workers=self._workers) as io_pool, \
+                ProcessPoolExecutor(max_workers=self._workers) as cpu_pool:
+            self._io_pool = io_pool
+            self._cpu_pool = cpu_pool
+            for job in jobs:
+                while pending >= self._max_pending:
+                    error = self._wait(on_complete, on_error) or error
+                    pending -= 1
+                if error:
+                    break
+                index_future = feature_index_for(job, io_pool) if feature_index_for else None
+                io_pool.submit(self._fetch, job, index_future)
+                pending += 1
+            while pending:
+                error = self._wait(on_complete, on_error) or error
+                pending -= 1
+        if error:
+            raise error
+
+    def _wait(self, on_complete, on_error):
+        job, result, error = self._completed.get()
+        if error:
+            if on_error:
+                on_error(job, error)
+            return error
+        on_complete(job, result)
+        return None
+
+    def _fail(self, job, error):
+        self._completed.put((job, None, error))
+
+    def _fetch(self, job, index_future):
+        try:
+            feature_index = index_future.result() if index_future else None
+            polygons_by_tag = self._airtiler._get_polygons_by_tag(self._tags, job.min_lon, job.min_lat, job.max_lon,
+                                                                  job.max_lat, feature_index=feature_index)
+            future = self._cpu_pool.submit(render_masks, self._airtiler._image_width, polygons_by_tag,
+                                           self._separate_instances, self._verbose, self._airtiler._labels)
+            nr_polygons = sum(map(len, polygons_by_tag.values()))
+            future.add_done_callback(lambda f: self._rendered(job, f, nr_polygons))
+        except Exception as e:
+            self._fail(job, e)
+
+    def _rendered(self, job, future, nr_polygons):
+        try:
+            masks_by_tag, seconds = future.result()
+            self._airtiler.metrics.record("render", seconds, polygons=nr_polygons)
+            self._io_pool.submit(self._write, job, masks_by_tag)
+        except Exception as e:
+            self._fail(job, e)
+
+    def _write(self, job, masks_by_tag):
+        try:
+            result = self._airtiler._write_tile(masks_by_tag, job.output_directory, job.tile_name, job.bing_url)
+            self._completed.put((job, result, None))
+        except Exception as e:
+            self._fail(job, e)
+
+
+class BlockPrefetcher:
+    """
+     * Fetches the FeatureIndex of each block of tiles once, when the first tile of the block is submitted. The jobs
+       must be ordered by block, so only the index of the current block has to be kept.
+    """
+
+    def __init__(self, fetch_block):
+        self._fetch_block = fetch_block
+        self._current_block = None
+        self._current_future = None
+
+    def __call__(self, job, io_pool):
+        if job.block != self._current_block:
+            self._current_block = job.block
+            self._current_future = io_pool.submit(self._fetch_block, job.block)
+        return self._current_future
@@ -0,0 +1,87 @@
+import math
+import numpy as np
+
+MAX_LATITUDE = 85.0511287798
+
+
+def mercator(lon, lat):
+    """
+     * Projects WGS84 coordinates to Web Mercator, normalized to [0, 1] with the origin in the north west, as used by
+       the tile pyramid. Works on scalars and numpy arrays.
+    """
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) / (2 * math.pi)
+    return x, y
+
+
+class NodeCoordinates:
+    """
+     * The node coordinates of a set of ways, converted once into numpy arrays. The nodes of each way are stored as a
+       contiguous slice, so the points of many ways can be projected to the pixels of a tile in one operation.
+    """
+
+    def __init__(self, ways):
+        self._slices = {}
+        lons = []
+        lats = []
+        start = 0
+        for way in ways:
+            if way.id in self._slices:
+                continue
+            nodes = way.nodes
+            lons.extend(n.lon for n in nodes)
+            lats.extend(n.lat for n in nodes)
+            self._slices[way.id] = (start, start + len(nodes))
+            start += len(nodes)
+        self.lon = np.array(lons, dtype=np.float64)
+        self.lat = np.array(lats, dtype=np.float64)
+        self._x, self._y = mercator(self.lon, self.lat)
+
+    def bounds(self, ways):
+        """
+         * Returns (min_lon, min_lat, max_lon, max_lat) of the ways or None, if they have no nodes.
+        """
+        indices = self._indices(ways)
+        if not len(indices):
+            return None
+        lon = self.lon[indices]
+        lat = self.lat[indices]
+        return lon.min(), lat.min(), lon.max(), lat.max()
+
+    def _indices(self, ways):
+        ranges = [np.arange(*self._slices[w.id]) for w in ways if w.id in self._slices]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    def project(self, ways, min_lon, min_lat, max_lon, max_lat, image_width):
+        """
+         * Returns the points of each way in pixel coordinates of the tile with the specified bounds, by way id.
+        """
+        ways = [w for w in ways if w.id in self._slices]
+        indices = self._indices(ways)
+        (x0, x1), (y0, y1) = mercator(np.array([min_lon, max_lon]), np.array([max_lat, min_lat]))
+        x = (self._x[indices] - x0) * (image_width / (x1 - x0))
+        y = (self._y[indices] - y0) * (image_width / (y1 - y0))
+        return self._split(ways, np.column_stack((x, y)))
+
+    def project_grid(self, ways, zoom_level, image_width, origin_x, origin_y):
+        """
+         * Returns the points of each way in pixel coordinates of the tile grid at the zoom level, in which each tile
+           is image_width pixels wide, relative to the north west corner of the tile (origin_x, origin_y) in Google
+           coordinates.
+        """
+        ways = [w for w in ways if w.id in self._slices]
+        indices = self._indices(ways)
+        n = 2 ** zoom_level
+        x = (self._x[indices] * n - origin_x) * image_width
+        y = (self._y[indices] * n - origin_y) * image_width
+        return self._split(ways, np.column_stack((x, y)))
+
+    def _split(self, ways, points):
+        points_by_way = {}
+        offset = 0
+        for way in ways:
+            start, end = self._slices[way.id]
+            points_by_way[way.id] = points[offset:offset + end - start]
+            offset += end - start
+        return points_by_way
@@ -0,0 +1,97 @@
+import math
+from collections import namedtuple
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+LabelSpec = namedtuple('LabelSpec', 'mode classes order')
+
+
+def _window(bounds, shape):
+    """
+     * Returns the pixel window (x0, y0, x1, y1) which contains the bounds plus a margin of one pixel, clipped to the
+       shape of the mask.
+     * The window always starts at the column 0: the polygon fill of Pillow is not invariant to a translation along
+       x, but it is along y, so only the rows are cut to keep the result identical to a canvas of the size of the
+       mask.
+    """
+    _, min_y, max_x, max_y = bounds
+    height, width = shape
+    x0 = 0
+    y0 = max(int(math.floor(min_y)) - 1, 0)
+    x1 = min(int(math.ceil(max_x)) + 2, width)
+    y1 = min(int(math.ceil(max_y)) + 2, height)
+    return x0, y0, x1, y1
+
+
+def _translated(coords, x0, y0):
+    return [(x - x0, y - y0) for x, y in coords]
+
+
+def _draw(polygon, x0, y0, x1, y1, separate_instances):
+    size = (x1 - x0, y1 - y0)
+    poly_area = Image.new('L', size, 0)
+    outline_color = 0 if separate_instances else 255
+    ImageDraw.Draw(poly_area).polygon(_translated(polygon.exterior.coords, x0, y0), fill=255, outline=outline_color)
+    covered = np.asarray(poly_area) != 0
+    holes = None
+    if polygon.interiors:
+        holes_area = Image.new('L', size, 0)
+        draw = ImageDraw.Draw(holes_area)
+        for h in polygon.interiors:
+            draw.polygon(_translated(h.coords, x0, y0), fill=255, outline=255)
+        holes = np.asarray(holes_area) != 0
+    return covered, holes
+
+
+def burn_polygon(mask: np.ndarray, polygon, separate_instances: bool = False, value: int = 255) -> None:
+    """
+     * Burns the polygon into the mask. Only the rows of the mask covered by the polygon (up to its right edge) are
+       drawn and updated, so the cost depends on the size of the polygon instead of the size of the mask. As the
+       coordinates are only translated along y by whole pixels, the result is identical to drawing on a canvas of
+       the size of the mask.
+     * With separate_instances, the outline is not drawn, so adjacent polygons stay separated.
+    """
+    x0, y0, x1, y1 = _window(polygon.bounds, mask.shape)
+    if x1 <= x0 or y1 <= y0:
+        return
+    covered, holes = _draw(polygon, x0, y0, x1, y1, separate_instances)
+    window = mask[y0:y1, x0:x1]
+    window[covered] = value
+    if holes is not None:
+        window[holes] = 0
+
+
+def burn_label(labels: np.ndarray, polygon, value: int, bitmask: bool = False,
+               separate_instances: bool = False) -> None:
+    """
+     * Burns the polygon into a label raster, in which several classes share the pixels. Unlike burn_polygon, the
+       holes of the polygon keep the labels of other polygons below them.
+     * The covered pixels are set to value, or value is or-ed into them if bitmask is set.
+    """
+    x0, y0, x1, y1 = _window(polygon.bounds, labels.shape)
+    if x1 <= x0 or y1 <= y0:
+        return
+    covered, holes = _draw(polygon, x0, y0, x1, y1, separate_instances)
+    if holes is not None:
+        covered &= ~holes
+    window = labels[y0:y1, x0:x1]
+    if bitmask:
+        window[covered] |= value
+    else:
+        window[covered] = value
+
+
+def label_dtype(mode: str, nr_classes: int):
+    """
+     * Returns the smallest dtype of a label raster, which can hold nr_classes in the mode 'classes' or 'bitmask'.
+    """
+    if mode == "classes":
+        if nr_classes > 255:
+            raise RuntimeError("At most 255 classes can be rendered as a class map.")
+        return np.uint8
+    if mode == "bitmask":
+        if nr_classes > 16:
+            raise RuntimeError("At most 16 tags can be rendered as a bitmask.")
+        return np.uint8 if nr_classes <= 8 else np.uint16
+    raise RuntimeError("Unknown labels '{}', must be one of 'masks', 'classes' or 'bitmask'.".format(mode))
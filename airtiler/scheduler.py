@@ -0,0 +1,205 @@
+import re
+import threading
+import time
+from collections import namedtuple
+from typing import Iterable
+from urllib.request import urlopen
+import overpy
+from overpy import exception
+
+OverpassStatus = namedtuple('OverpassStatus', 'rate_limit slots_available wait')
+
+rate_limit_pattern = re.compile(r"^Rate limit: (\d+)", re.MULTILINE)
+slots_available_pattern = re.compile(r"^(\d+) slots? available now", re.MULTILINE)
+slot_wait_pattern = re.compile(r"^Slot available after: .*, in (-?\d+) seconds?", re.MULTILINE)
+
+
+def parse_status(text: str) -> OverpassStatus:
+    """
+     * Parses the response of the /api/status endpoint of an Overpass server. wait is the time in seconds until
+       the next slot becomes available, 0 if a slot is available now.
+    """
+    rate_limit = rate_limit_pattern.search(text)
+    slots = slots_available_pattern.search(text)
+    waits = [max(0, int(w)) for w in slot_wait_pattern.findall(text)]
+    slots_available = int(slots.group(1)) if slots else 0
+    wait = 0 if slots_available or not waits else min(waits)
+    return OverpassStatus(rate_limit=int(rate_limit.group(1)) if rate_limit else None,
+                          slots_available=slots_available, wait=wait)
+
+
+class TokenBucket:
+    """
+     * Limits the rate of requests to rate per second, with bursts of up to burst requests. A rate of None does not
+       limit the requests. The rate is increased additively after successful requests and halved on throttling.
+    """
+
+    def __init__(self, rate: float = None, burst: int = 1, min_rate: float = 0.05, max_rate: float = None,
+                 increase: float = 0.05, fallback_rate: float = 1.0):
+        self.rate = rate
+        self._burst = burst
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._fallback_rate = fallback_rate
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if not self.rate:
+                    return
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def speed_up(self) -> None:
+        with self._lock:
+            if self.rate:
+                self._refill(time.monotonic())
+                self.rate += self._increase
+                if self._max_rate:
+                    self.rate = min(self.rate, self._max_rate)
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self._min_rate, self.rate / 2 if self.rate else self._fallback_rate)
+            self._tokens = min(self._tokens, 0)
+
+
+class _EndpointClient(overpy.Overpass):
+    """
+     * Overpass client of a single endpoint, which does not retry and parses the responses with its owner, so
+       subclasses of the owner (e.g. the CachingOverpass) see the raw responses.
+    """
+
+    def __init__(self, owner: overpy.Overpass, url: str):
+        super().__init__(url=url, max_retry_count=0)
+        self._owner = owner
+
+    def parse_json(self, data, encoding="utf-8"):
+        self._owner.received(data)
+        return self._owner.parse_json(data, encoding=encoding)
+
+    def parse_xml(self, data, encoding="utf-8", parser=None):
+        self._owner.received(data)
+        return self._owner.parse_xml(data, encoding=encoding, parser=parser)
+
+
+class Endpoint:
+    def __init__(self, owner: overpy.Overpass, url: str, concurrency: int):
+        self.url = url
+        self.status_url = re.sub(r"/interpreter/?$", "/status", url)
+        self.client = _EndpointClient(owner, url)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.available_at = 0.0
+        self.failures = 0
+        self.in_flight = 0
+
+
+class ScheduledOverpass(overpy.Overpass):
+    """
+     * Overpass API, which distributes the queries across a pool of endpoints. The queries are rate limited by a
+       token bucket and at most concurrency queries run at once per endpoint.
+     * If an endpoint throttles (429), its /api/status is consulted and it is not used until a slot becomes
+       available; the rate is halved. Gateway timeouts, other errors and unreachable endpoints put the endpoint on
+       an exponential backoff. In both cases, the query fails over to the next available endpoint. Only after
+       max_retries failed attempts, the last error is raised.
+    """
+
+    throttling_errors = (exception.OverpassTooManyRequests,)
+    endpoint_errors = (exception.OverpassGatewayTimeout, exception.OverpassUnknownHTTPStatusCode,
+                       exception.OverpassUnknownContentType, OSError)
+
+    def __init__(self, urls: Iterable[str] = None, rate: float = None, concurrency: int = 2, max_retries: int = 4,
+                 backoff: float = 1, max_backoff: float = 120, status_timeout: float = 10, metrics=None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        urls = list(urls or [self.url])
+        self.endpoints = [Endpoint(self, url, concurrency) for url in urls]
+        self.bucket = TokenBucket(rate)
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._status_timeout = status_timeout
+        self._lock = threading.Lock()
+
+    def received(self, data) -> None:
+        """
+         * Is called with each raw response received from an endpoint.
+        """
+        if self.metrics is not None:
+            self.metrics.add("overpass", bytes=len(data), responses=1)
+
+    def _next_endpoint(self) -> Endpoint:
+        """
+         * Returns the endpoint, which becomes available first and has the fewest queries running.
+        """
+        with self._lock:
+            endpoint = min(self.endpoints, key=lambda e: (max(e.available_at, time.monotonic()), e.in_flight))
+            endpoint.in_flight += 1
+        wait = endpoint.available_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        return endpoint
+
+    def status(self, endpoint: Endpoint):
+        """
+         * Returns the OverpassStatus of the endpoint, or None, if it could not be loaded.
+        """
+        try:
+            with urlopen(endpoint.status_url, timeout=self._status_timeout) as response:
+                return parse_status(response.read().decode("utf-8", errors="replace"))
+        except OSError:
+            return None
+
+    def _back_off(self, endpoint: Endpoint, wait: float = None) -> float:
+        """
+         * Does not use the endpoint for wait seconds, or an exponentially growing time if wait is None.
+        """
+        with self._lock:
+            endpoint.failures += 1
+            if wait is None:
+                wait = min(self._max_backoff, self._backoff * 2 ** (endpoint.failures - 1))
+            endpoint.available_at = max(endpoint.available_at, time.monotonic() + wait)
+        return wait
+
+    def query(self, query):
+        last_error = None
+        for _ in range(self._max_retries + 1):
+            endpoint = self._next_endpoint()
+            try:
+                self.bucket.acquire()
+                with endpoint.slots:
+                    result = endpoint.client.query(query)
+            except self.throttling_errors as e:
+                last_error = e
+                self.bucket.slow_down()
+                status = self.status(endpoint)
+                wait = self._back_off(endpoint, status.wait if status and status.wait else None)
+                print("Overpass {} throttled, waiting {}s...".format(endpoint.url, wait))
+            except self.endpoint_errors as e:
+                last_error = e
+                wait = self._back_off(endpoint)
+                print("Overpass {} failed ({}), waiting {}s...".format(endpoint.url, type(e).__name__, wait))
+            else:
+                with self._lock:
+                    endpoint.failures = 0
+                self.bucket.speed_up()
+                return result
+            finally:
+                with self._lock:
+                    endpoint.in_flight -= 1
+        raise last_error
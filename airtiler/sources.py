@@ -0,0 +1,196 @@
+import xml.etree.ElementTree as ElementTree
+from typing import Iterable
+import overpy
+from .features import FeatureIndex, build_union_query, tags_match, query_tag, occupied_tiles, tile_range
+from .projection import NodeCoordinates
+from .scheduler import ScheduledOverpass
+
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+query_template = """
+[out:json][timeout:50];
+(
+  relation[{tag}]({bbox});
+  way[{tag}]({bbox});
+);
+//out geom;
+(._;>>;);
+out body;
+"""
+
+
+class OverpassSource:
+    """
+     * Queries the OSM data of each tile and tag from the Overpass API.
+    """
+
+    def __init__(self, overpass: overpy.Overpass = None):
+        self.overpass = overpass or ScheduledOverpass()
+
+    def query(self, tag, min_lon, min_lat, max_lon, max_lat):
+        bbox = "{},{},{},{}".format(min_lat, min_lon, max_lat, max_lon)
+        return self.overpass.query(query_template.format(bbox=bbox, tag=query_tag(tag)))
+
+    def prefetch(self, tags, min_lon, min_lat, max_lon, max_lat, zoom_level) -> FeatureIndex:
+        """
+         * Queries the data of all tags for the whole bbox at once.
+        """
+        query = build_union_query(tags, min_lon, min_lat, max_lon, max_lat)
+        return FeatureIndex(self.overpass.query(query), tags, zoom_level)
+
+    def occupancy(self, tags, min_lon, min_lat, max_lon, max_lat, zoom_level, margin=0.0) -> set:
+        """
+         * Returns the tiles of the bbox at the zoom level, which may contain an element of one of the tags. Only the
+           skeleton of the elements is queried, without tags.
+        """
+        query = build_union_query(tags, min_lon, min_lat, max_lon, max_lat, out="skel qt")
+        result = self.overpass.query(query)
+        range_x, range_y = tile_range(min_lon, min_lat, max_lon, max_lat, zoom_level)
+        return occupied_tiles(result.relations, result.ways, NodeCoordinates(result.ways), zoom_level, range_x,
+                              range_y, margin=margin)
+
+
+class _OsmCollector:
+    """
+     * Collects the elements of an OSM extract while it is streamed and keeps only the ways and relations matching
+       the tags, including the ways, relations and nodes they are made of. The extract is read in passes: first the
+       relations, then the ways, then the nodes, so each pass knows which elements the previous ones refer to.
+    """
+
+    def __init__(self, tags: Iterable[str]):
+        self._tags = list(tags)
+        self._nodes = {}
+        self._ways = {}
+        self._relations = {}
+        self._node_ids = set()
+        self._way_ids = set()
+        self._relation_ids = set()
+
+    def relation(self, rel_id, members, tags):
+        if rel_id in self._relations or not (rel_id in self._relation_ids or self._matches(tags)):
+            return
+        self._relations[rel_id] = (members, tags)
+        for member_type, ref, _ in members:
+            if member_type == "way":
+                self._way_ids.add(ref)
+            elif member_type == "relation":
+                self._relation_ids.add(ref)
+
+    def way(self, way_id, node_ids, tags):
+        if way_id in self._way_ids or self._matches(tags):
+            self._ways[way_id] = (node_ids, tags)
+            self._node_ids.update(node_ids)
+
+    def node(self, node_id, lat, lon):
+        if node_id in self._node_ids:
+            self._nodes[node_id] = (lat, lon)
+
+    @property
+    def nr_relations(self) -> int:
+        return len(self._relations)
+
+    @property
+    def missing_relations(self) -> bool:
+        return any(i not in self._relations for i in self._relation_ids)
+
+    def _matches(self, tags) -> bool:
+        return any(tags_match(tags, t) for t in self._tags)
+
+    def result(self) -> overpy.Result:
+        result = overpy.Result()
+        for rel_id, (members, tags) in self._relations.items():
+            relation_members = []
+            for member_type, ref, role in members:
+                if member_type == "way" and ref in self._ways:
+                    relation_members.append(overpy.RelationWay(attributes={}, ref=ref, role=role, result=result))
+                elif member_type == "relation" and ref in self._relations:
+                    relation_members.append(overpy.RelationRelation(attributes={}, ref=ref, role=role,
+                                                                    result=result))
+            result.append(overpy.Relation(rel_id=rel_id, members=relation_members, tags=tags, attributes={},
+                                          result=result))
+        for way_id, (refs, tags) in self._ways.items():
+            refs = [r for r in refs if r in self._nodes]
+            result.append(overpy.Way(way_id=way_id, node_ids=refs, tags=tags, attributes={}, result=result))
+        for node_id, (lat, lon) in self._nodes.items():
+            result.append(overpy.Node(node_id=node_id, lat=lat, lon=lon, tags={}, attributes={}, result=result))
+        return result
+
+
+def _read_xml(path: str, collector: _OsmCollector, element_type: str) -> None:
+    context = ElementTree.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event != "end" or elem.tag not in ("node", "way", "relation"):
+            continue
+        if elem.tag == element_type:
+            element_id = int(elem.get("id"))
+            if elem.tag == "node":
+                collector.node(element_id, float(elem.get("lat")), float(elem.get("lon")))
+            else:
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                if elem.tag == "way":
+                    collector.way(element_id, [int(nd.get("ref")) for nd in elem.iter("nd")], tags)
+                else:
+                    members = [(m.get("type"), int(m.get("ref")), m.get("role", "")) for m in elem.iter("member")]
+                    collector.relation(element_id, members, tags)
+        root.clear()
+
+
+def _read_pbf(path: str, collector: _OsmCollector, element_type: str) -> None:
+    if osmium is None:
+        raise RuntimeError("Reading .osm.pbf files requires the 'osmium' package.")
+
+    # osmium only decodes the element types, for which the handler has a callback
+    class NodeHandler(osmium.SimpleHandler):
+        def node(self, n):
+            if n.location.valid():
+                collector.node(n.id, n.location.lat, n.location.lon)
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, w):
+            collector.way(w.id, [n.ref for n in w.nodes], {t.k: t.v for t in w.tags})
+
+    class RelationHandler(osmium.SimpleHandler):
+        def relation(self, r):
+            members = [({'n': 'node', 'w': 'way', 'r': 'relation'}[m.type], m.ref, m.role) for m in r.members]
+            collector.relation(r.id, members, {t.k: t.v for t in r.tags})
+
+    handlers = {"node": NodeHandler, "way": WayHandler, "relation": RelationHandler}
+    handlers[element_type]().apply_file(path)
+
+
+def _collect(path: str, tags: Iterable[str]) -> _OsmCollector:
+    """
+     * Reads the elements of the extract, which belong to the tags. Extracts list child relations before their
+       parents, so the relations are read again as long as new child relations are found.
+    """
+    read = _read_pbf if path.endswith(".pbf") else _read_xml
+    collector = _OsmCollector(tags)
+    nr_relations = -1
+    while collector.nr_relations != nr_relations:
+        nr_relations = collector.nr_relations
+        read(path, collector, "relation")
+        if not collector.missing_relations:
+            break
+    read(path, collector, "way")
+    read(path, collector, "node")
+    return collector
+
+
+class OsmFileSource(FeatureIndex):
+    """
+     * Serves the OSM data from a local extract (.osm.pbf or OSM XML) instead of the Overpass API. The extract is
+       streamed in passes (relations, ways, nodes) and only the elements matching the tags and the elements they are
+       made of are kept in a spatial index. The grid of the index has the tiles of index_zoom as cells; a query
+       returns all elements of the cells it covers.
+    """
+
+    def __init__(self, path: str, tags: Iterable[str], index_zoom: int = 16):
+        tags = list(tags) or ['building']
+        super().__init__(_collect(path, tags).result(), tags, index_zoom)
+
+    def prefetch(self, tags, min_lon, min_lat, max_lon, max_lat, zoom_level) -> FeatureIndex:
+        return self
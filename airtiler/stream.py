@@ -0,0 +1,96 @@
+import io
+import random
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+TileSample = namedtuple('TileSample', 'image masks metadata')
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """
+     * Decodes an image to an RGB array of shape (height, width, 3).
+    """
+    return np.array(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+class TileStream:
+    """
+     * Yields a TileSample for each tile: the imagery as an RGB array (None, if there is no imagery), the mask of each
+       tag as an array and the metadata of the tile. Nothing is written to disk.
+     * The tiles are loaded by a pool of threads, at most buffer_size tiles ahead of the consumer. If shuffle_window is
+       greater than 1, the samples are shuffled within a window of that many samples.
+    """
+
+    def __init__(self, airtiler, tiles, tags, separate_instances=False, buffer_size=16, shuffle_window=0,
+                 seed=None, skip_empty=True, workers=4):
+        self._airtiler = airtiler
+        self._tiles = tiles
+        self._tags = tags or ['building']
+        self._separate_instances = separate_instances
+        self._buffer_size = max(1, buffer_size)
+        self._shuffle_window = shuffle_window
+        self._random = random.Random(seed)
+        self._skip_empty = skip_empty
+        self._workers = workers
+
+    def _load(self, bbox_name, tile) -> TileSample:
+        airtiler = self._airtiler
+        min_lon, min_lat, max_lon, max_lat = tile.min_lon, tile.min_lat, tile.max_lon, tile.max_lat
+        masks = airtiler._get_masks_by_tag(self._tags, min_lon, min_lat, max_lon, max_lat, self._separate_instances, 0)
+        if self._skip_empty and not any(mask.max() for mask in masks.values()):
+            return None
+        image = None
+        url = airtiler._imagery.url_for(tile.quad_tree)
+        if url:
+            with airtiler.metrics.timer("imagery", bytes=0) as counts:
+                data = airtiler._imagery.fetch(url)
+                if data:
+                    counts["bytes"] = len(data)
+            if data:
+                image = decode_image(data)
+        metadata = {
+            "bbox": bbox_name,
+            "zoom": tile.zoom,
+            "tms_x": tile.tms_x,
+            "tms_y": tile.tms_y,
+            "quadkey": tile.quad_tree,
+            "bounds": (min_lon, min_lat, max_lon, max_lat)
+        }
+        airtiler.metrics.tile_done()
+        return TileSample(image=image, masks=masks, metadata=metadata)
+
+    def _shuffled(self, samples):
+        if self._shuffle_window <= 1:
+            yield from samples
+            return
+        window = []
+        for sample in samples:
+            window.append(sample)
+            if len(window) >= self._shuffle_window:
+                yield window.pop(self._random.randrange(len(window)))
+        self._random.shuffle(window)
+        yield from window
+
+    def _loaded(self):
+        pool = ThreadPoolExecutor(max_workers=self._workers)
+        pending = deque()
+        try:
+            for bbox_name, tile in self._tiles:
+                if len(pending) >= self._buffer_size:
+                    sample = pending.popleft().result()
+                    if sample is not None:
+                        yield sample
+                pending.append(pool.submit(self._load, bbox_name, tile))
+            while pending:
+                sample = pending.popleft().result()
+                if sample is not None:
+                    yield sample
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def __iter__(self):
+        return self._shuffled(self._loaded())
@@ -0,0 +1,199 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from itertools import islice
+from typing import Iterable, List
+
+QueuedTile = namedtuple('QueuedTile', 'bbox zoom tile tms_x tms_y')
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+schema = """
+CREATE TABLE IF NOT EXISTS queue (
+    bbox TEXT NOT NULL,
+    zoom INTEGER NOT NULL,
+    tile TEXT NOT NULL,
+    tms_x INTEGER NOT NULL,
+    tms_y INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (bbox, zoom, tile)
+);
+CREATE INDEX IF NOT EXISTS queue_status ON queue (status, lease_until);
+CREATE TABLE IF NOT EXISTS published (
+    updated REAL NOT NULL
+);
+"""
+
+
+def worker_name() -> str:
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+class TileQueue:
+    """
+     * A work queue of tiles in an SQLite database, which may be placed on a filesystem shared by several nodes.
+       The tiles are published once, e.g. by a coordinator, and claimed by any number of workers. A claim is a
+       lease, which the worker extends with heartbeat(); tiles whose lease expired, e.g. because the worker died,
+       are claimed again.
+     * A released tile is retried until it failed max_attempts times.
+     * Each operation uses a short lived connection in rollback journal mode, because WAL does not work on network
+       filesystems.
+    """
+
+    def __init__(self, path: str, lease: float = 300, max_attempts: int = 3):
+        self._path = path
+        self.lease = lease
+        self._max_attempts = max_attempts
+        connection = sqlite3.connect(self._path, timeout=60)
+        try:
+            connection.executescript(schema)
+        finally:
+            connection.close()
+
+    def _connect(self) -> "_Transaction":
+        connection = sqlite3.connect(self._path, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=DELETE")
+        return _Transaction(connection)
+
+    def publish(self, tiles: Iterable[QueuedTile], chunk_size: int = 10000) -> int:
+        """
+         * Adds the tiles to the queue in transactions of chunk_size tiles, so the tiles can be generated lazily and
+           workers are not blocked for the whole publication. Tiles which are already queued keep their state, so
+           publishing the same config again only adds the new tiles. Returns the number of added tiles.
+        """
+        tiles = iter(tiles)
+        published = 0
+        while True:
+            chunk = list(islice(tiles, chunk_size))
+            if not chunk:
+                break
+            now = time.time()
+            with self._connect() as connection:
+                before = connection.total_changes
+                connection.executemany("INSERT OR IGNORE INTO queue (bbox, zoom, tile, tms_x, tms_y, status, updated) "
+                                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       [(t.bbox, t.zoom, t.tile, t.tms_x, t.tms_y, PENDING, now) for t in chunk])
+                published += connection.total_changes - before
+        with self._connect() as connection:
+            connection.execute("DELETE FROM published")
+            connection.execute("INSERT INTO published (updated) VALUES (?)", (time.time(),))
+        return published
+
+    @property
+    def published(self) -> bool:
+        """
+         * Whether the tiles have been published completely, so an empty queue means that all tiles are processed.
+        """
+        with self._connect() as connection:
+            return connection.execute("SELECT 1 FROM published").fetchone() is not None
+
+    def claim(self, worker: str, limit: int = 1) -> List[QueuedTile]:
+        """
+         * Claims up to limit pending tiles, or tiles whose lease has expired, for the worker. The tiles are not
+           sorted, which would sort the whole queue within the lock on every claim; pending tiles are claimed in the
+           order they were published.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            rows = connection.execute("SELECT bbox, zoom, tile, tms_x, tms_y FROM queue "
+                                      "WHERE status=? OR (status=? AND lease_until<?) LIMIT ?",
+                                      (PENDING, CLAIMED, now, limit)).fetchall()
+            connection.executemany("UPDATE queue SET status=?, owner=?, lease_until=?, attempts=attempts + 1, "
+                                   "updated=? WHERE bbox=? AND zoom=? AND tile=?",
+                                   [(CLAIMED, worker, now + self.lease, now) + r[:3] for r in rows])
+        return [QueuedTile(*r) for r in rows]
+
+    def heartbeat(self, worker: str) -> int:
+        """
+         * Extends the leases of all tiles claimed by the worker. Returns the number of tiles.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute("UPDATE queue SET lease_until=?, updated=? WHERE status=? AND owner=?",
+                                        (now + self.lease, now, CLAIMED, worker))
+            return cursor.rowcount
+
+    def complete(self, worker: str, tile: QueuedTile) -> bool:
+        """
+         * Marks the tile as done. Returns False, if the lease of the worker has been lost in the meantime.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute("UPDATE queue SET status=?, owner=NULL, lease_until=NULL, error=NULL, "
+                                        "updated=? WHERE bbox=? AND zoom=? AND tile=? AND status=? AND owner=?",
+                                        (DONE, time.time(), tile.bbox, tile.zoom, tile.tile, CLAIMED, worker))
+            return cursor.rowcount == 1
+
+    def release(self, worker: str, tile: QueuedTile, error: str) -> None:
+        """
+         * Returns the tile to the queue after a failure, or marks it as failed after max_attempts.
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE queue SET status=CASE WHEN attempts>=? THEN ? ELSE ? END, owner=NULL, "
+                               "lease_until=NULL, error=?, updated=? "
+                               "WHERE bbox=? AND zoom=? AND tile=? AND status=? AND owner=?",
+                               (self._max_attempts, FAILED, PENDING, error, time.time(), tile.bbox, tile.zoom,
+                                tile.tile, CLAIMED, worker))
+
+    def counts(self) -> dict:
+        with self._connect() as connection:
+            rows = connection.execute("SELECT status, COUNT(*) FROM queue GROUP BY status").fetchall()
+        counts = {PENDING: 0, CLAIMED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+
+class _Transaction:
+    """
+     * Runs the statements of a with block in a single immediate transaction and closes the connection afterwards.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute("BEGIN IMMEDIATE")
+        return self._connection
+
+    def __exit__(self, exc_type, *args):
+        try:
+            self._connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._connection.close()
+
+
+class Heartbeat:
+    """
+     * Extends the leases of a worker in the background, every third of the lease duration.
+    """
+
+    def __init__(self, queue: TileQueue, worker: str):
+        self._queue = queue
+        self._worker = worker
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self._queue.lease / 3):
+            try:
+                self._queue.heartbeat(self._worker)
+            except sqlite3.Error as e:
+                print("Heartbeat failed: {}".format(e))
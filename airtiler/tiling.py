@@ -0,0 +1,190 @@
+import math
+from collections import namedtuple
+from typing import Iterator, List, Tuple
+import numpy as np
+
+EARTH_RADIUS = 6378137.0
+TILE_SIZE = 256
+ORIGIN_SHIFT = 2.0 * math.pi * EARTH_RADIUS / 2.0
+INITIAL_RESOLUTION = 2.0 * math.pi * EARTH_RADIUS / float(TILE_SIZE)
+
+ORDERS = ("rows", "zorder", "hilbert")
+
+_GridTile = namedtuple('GridTile', 'zoom tms_x tms_y quad_tree min_lon min_lat max_lon max_lat')
+
+
+class GridTile(_GridTile):
+    """
+     * A tile with its precomputed quadkey and WGS84 bounds, which equal the ones of pygeotile's Tile up to the
+       rounding of the latitude.
+    """
+    __slots__ = ()
+
+    @property
+    def tms(self) -> Tuple[int, int]:
+        return self.tms_x, self.tms_y
+
+
+def tile_bounds(zoom: int, tms_x: np.ndarray, tms_y: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+     * Returns the arrays min_lon, min_lat, max_lon, max_lat of the tiles, computed with the formulas of
+       pygeotile's Tile.bounds.
+    """
+    resolution = INITIAL_RESOLUTION / (2 ** zoom)
+    google_y = (2 ** zoom - 1) - np.asarray(tms_y, dtype=np.int64)
+    tms_x = np.asarray(tms_x, dtype=np.int64)
+
+    def longitude(pixel_x):
+        return (pixel_x * resolution - ORIGIN_SHIFT) / ORIGIN_SHIFT * 180.0
+
+    def latitude(pixel_y):
+        latitude = -(pixel_y * resolution - ORIGIN_SHIFT) / ORIGIN_SHIFT * 180.0
+        return 180.0 / math.pi * (2 * np.arctan(np.exp(latitude * math.pi / 180.0)) - math.pi / 2.0)
+
+    return (longitude((tms_x * TILE_SIZE).astype(np.float64)),
+            latitude(((google_y + 1) * TILE_SIZE).astype(np.float64)),
+            longitude(((tms_x + 1) * TILE_SIZE).astype(np.float64)),
+            latitude((google_y * TILE_SIZE).astype(np.float64)))
+
+
+def quadkeys(zoom: int, tms_x: np.ndarray, tms_y: np.ndarray) -> List[str]:
+    """
+     * Returns the Bing quadkeys of the tiles.
+    """
+    if not zoom:
+        return [""] * len(tms_x)
+    tms_x = np.asarray(tms_x, dtype=np.int64)
+    google_y = (2 ** zoom - 1) - np.asarray(tms_y, dtype=np.int64)
+    shifts = np.arange(zoom - 1, -1, -1, dtype=np.int64)
+    digits = ((tms_x[:, None] >> shifts) & 1) + 2 * ((google_y[:, None] >> shifts) & 1) + ord("0")
+    return digits.astype(np.uint8).view("S{}".format(zoom)).ravel().astype(str).tolist()
+
+
+def grid_tiles(zoom: int, tms_x: np.ndarray, tms_y: np.ndarray) -> List[GridTile]:
+    """
+     * Returns a GridTile for each pair of TMS coordinates.
+    """
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(zoom, tms_x, tms_y)
+    keys = quadkeys(zoom, tms_x, tms_y)
+    return [GridTile(zoom, *values) for values in zip(np.asarray(tms_x).tolist(), np.asarray(tms_y).tolist(), keys,
+                                                       min_lon.tolist(), min_lat.tolist(), max_lon.tolist(),
+                                                       max_lat.tolist())]
+
+
+def grid_tile(zoom: int, tms_x: int, tms_y: int) -> GridTile:
+    return grid_tiles(zoom, np.array([tms_x]), np.array([tms_y]))[0]
+
+
+def _curve_coordinates(order: str, levels: int, d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+     * Returns the coordinates of the positions d along the Z-order or Hilbert curve through a square of
+       2 ** levels x 2 ** levels cells.
+    """
+    x = np.zeros_like(d)
+    y = np.zeros_like(d)
+    if order == "zorder":
+        for i in range(levels):
+            x |= ((d >> (2 * i)) & 1) << i
+            y |= ((d >> (2 * i + 1)) & 1) << i
+        return x, y
+    t = d.copy()
+    for i in range(levels):
+        s = 1 << i
+        rx = (t >> 1) & 1
+        ry = (t ^ rx) & 1
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        x += s * rx
+        y += s * ry
+        t >>= 2
+    return x, y
+
+
+def _rows(range_x: range, range_y: range, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    if not len(range_x) or not len(range_y):
+        return
+    ys = np.arange(range_y.start, range_y.stop, dtype=np.int64)
+    if len(ys) >= chunk_size:
+        for x in range_x:
+            for start in range(0, len(ys), chunk_size):
+                chunk = ys[start:start + chunk_size]
+                yield np.full(len(chunk), x, dtype=np.int64), chunk
+        return
+    columns = max(1, chunk_size // len(ys))
+    for start in range(range_x.start, range_x.stop, columns):
+        xs = np.arange(start, min(start + columns, range_x.stop), dtype=np.int64)
+        yield np.repeat(xs, len(ys)), np.tile(ys, len(xs))
+
+
+def _curve(order: str, range_x: range, range_y: range, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+     * Walks the curve through the smallest square of 2 ** n cells at the origin, which contains the ranges. Each
+       aligned square of the curve covers a contiguous part of it, so the squares outside of the ranges are skipped
+       and the squares of at most chunk_size cells are converted at once.
+    """
+    if not len(range_x) or not len(range_y):
+        return
+    levels = max(range_x.stop - 1, range_y.stop - 1, 1).bit_length()
+    chunk_levels = max(0, int(math.log(max(chunk_size, 1), 4)))
+    stack = [(levels, 0)]
+    while stack:
+        level, start = stack.pop()
+        size = 1 << level
+        x0, y0 = _curve_coordinates(order, levels - level, np.array([start >> (2 * level)], dtype=np.int64))
+        x0, y0 = int(x0[0]) * size, int(y0[0]) * size
+        if x0 >= range_x.stop or x0 + size <= range_x.start or y0 >= range_y.stop or y0 + size <= range_y.start:
+            continue
+        if level > chunk_levels:
+            quarter = 1 << (2 * (level - 1))
+            stack.extend((level - 1, start + i * quarter) for i in reversed(range(4)))
+            continue
+        xs, ys = _curve_coordinates(order, levels, np.arange(start, start + size * size, dtype=np.int64))
+        inside = (xs >= range_x.start) & (xs < range_x.stop) & (ys >= range_y.start) & (ys < range_y.stop)
+        yield xs[inside], ys[inside]
+
+
+def coordinates(range_x: range, range_y: range, order: str = "rows",
+                chunk_size: int = 4096) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+     * Yields the TMS coordinates of the ranges as chunks of arrays of at most chunk_size coordinates, in the order
+       'rows' (x, then y), 'zorder' or 'hilbert'. The curves keep neighbouring tiles close together in the sequence,
+       e.g. for the caches of the data and the imagery.
+    """
+    if order == "rows":
+        return _rows(range_x, range_y, chunk_size)
+    if order in ORDERS:
+        return _curve(order, range_x, range_y, chunk_size)
+    raise RuntimeError("Unknown tile order '{}', must be one of {}.".format(order, ", ".join(ORDERS)))
+
+
+def iter_tiles(zoom: int, range_x: range, range_y: range, order: str = "rows",
+               chunk_size: int = 4096) -> Iterator[GridTile]:
+    """
+     * Lazily yields a GridTile for each tile of the ranges. Only chunk_size tiles are held in memory at once.
+    """
+    for xs, ys in coordinates(range_x, range_y, order, chunk_size):
+        if len(xs):
+            yield from grid_tiles(zoom, xs, ys)
+
+
+def iter_blocks(zoom: int, range_x: range, range_y: range, block_size: int, order: str = "rows",
+                chunk_size: int = 4096) -> Iterator[List[GridTile]]:
+    """
+     * Lazily yields the tiles of the ranges grouped into square blocks of block_size x block_size tiles, aligned to
+       multiples of block_size. The blocks and the tiles within a block follow the order. If block_size is 0, each
+       tile is a block of its own.
+    """
+    if not block_size:
+        for tile in iter_tiles(zoom, range_x, range_y, order, chunk_size):
+            yield [tile]
+        return
+    blocks_x = range(range_x.start // block_size, (range_x.stop - 1) // block_size + 1) if len(range_x) else range(0)
+    blocks_y = range(range_y.start // block_size, (range_y.stop - 1) // block_size + 1) if len(range_y) else range(0)
+    for block_xs, block_ys in coordinates(blocks_x, blocks_y, order, chunk_size):
+        for bx, by in zip(block_xs.tolist(), block_ys.tolist()):
+            xs = range(max(range_x.start, bx * block_size), min(range_x.stop, (bx + 1) * block_size))
+            ys = range(max(range_y.start, by * block_size), min(range_y.stop, (by + 1) * block_size))
+            yield list(iter_tiles(zoom, xs, ys, order, chunk_size))
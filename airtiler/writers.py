@@ -0,0 +1,221 @@
+import io
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+shard_name_pattern = re.compile(r"^shard-(\d+)\.tar$")
+
+
+def encode_mask(mask) -> bytes:
+    data = io.BytesIO()
+    Image.fromarray(mask).save(data, format="TIFF")
+    return data.getvalue()
+
+
+class TiffWriter:
+    """
+     * Writes each mask as '<tile>_<tag>.tif' and the imagery as '<tile>.tiff' into the directory of the zoom level.
+    """
+
+    def begin(self, output_directory: str, zoom_level: int, range_x: range, range_y: range) -> None:
+        """
+         * Is called with the TMS ranges of the tile grid, before the tiles of a directory are written.
+        """
+        pass
+
+    def image_path(self, output_directory: str, file_name: str) -> str:
+        """
+         * Returns the path to which the imagery of the tile is downloaded.
+        """
+        return os.path.join(output_directory, "{}.tiff".format(file_name))
+
+    def write(self, output_directory: str, file_name: str, masks_by_tag: dict, image_path: str = None) -> None:
+        """
+         * Writes the masks of the tile. The imagery, if any, has already been downloaded to image_path.
+        """
+        for tag, mask in masks_by_tag.items():
+            mask_path = os.path.join(output_directory, "{name}_{tag}.tif".format(name=file_name, tag=tag))
+            Image.fromarray(mask).save(mask_path)
+
+    def close(self) -> None:
+        pass
+
+
+class _Shard:
+    def __init__(self, directory: str, number: int):
+        self.name = "shard-{:06d}.tar".format(number)
+        self.tar = tarfile.open(os.path.join(directory, self.name), mode="w")
+        self.nr_tiles = 0
+
+
+class ShardWriter:
+    """
+     * Appends the tiles to tar shards in the directory of the zoom level, in the layout used by WebDataset: all files
+       of a tile share the tile name as key, e.g. '18_1_2.tiff' for the imagery and '18_1_2.building.tif' for a mask.
+       A new shard is started after shard_size tiles and on each run, so existing shards are never modified.
+     * Each written tile is appended to 'index.jsonl' with the shard and the names of its members, so readers can
+       locate a tile without scanning the shards.
+    """
+
+    def __init__(self, shard_size: int = 1000):
+        self._shard_size = shard_size
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def begin(self, output_directory: str, zoom_level: int, range_x: range, range_y: range) -> None:
+        pass
+
+    def image_path(self, output_directory: str, file_name: str) -> str:
+        return os.path.join(output_directory, "{}.tiff.download".format(file_name))
+
+    def _next_number(self, output_directory: str) -> int:
+        numbers = [int(m.group(1)) for m in map(shard_name_pattern.match, os.listdir(output_directory)) if m]
+        return max(numbers) + 1 if numbers else 0
+
+    def _shard(self, output_directory: str) -> _Shard:
+        shard = self._shards.get(output_directory)
+        if shard and shard.nr_tiles >= self._shard_size:
+            shard.tar.close()
+            shard = _Shard(output_directory, int(shard_name_pattern.match(shard.name).group(1)) + 1)
+            self._shards[output_directory] = shard
+        elif not shard:
+            shard = _Shard(output_directory, self._next_number(output_directory))
+            self._shards[output_directory] = shard
+        return shard
+
+    @staticmethod
+    def _add(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        tar.addfile(info, io.BytesIO(data))
+
+    def write(self, output_directory: str, file_name: str, masks_by_tag: dict, image_path: str = None) -> None:
+        members = {tag: ("{}.{}.tif".format(file_name, tag), encode_mask(mask)) for tag, mask in masks_by_tag.items()}
+        image = None
+        if image_path and os.path.isfile(image_path):
+            with open(image_path, 'rb') as f:
+                image = f.read()
+        with self._lock:
+            shard = self._shard(output_directory)
+            entry = {"tile": file_name, "shard": shard.name, "masks": {}}
+            if image is not None:
+                entry["image"] = "{}.tiff".format(file_name)
+                self._add(shard.tar, entry["image"], image)
+            for tag, (name, data) in members.items():
+                self._add(shard.tar, name, data)
+                entry["masks"][tag] = name
+            shard.tar.fileobj.flush()
+            shard.nr_tiles += 1
+            with open(os.path.join(output_directory, "index.jsonl"), 'a', encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        if image is not None:
+            os.remove(image_path)
+
+    def close(self) -> None:
+        with self._lock:
+            for shard in self._shards.values():
+                shard.tar.close()
+            self._shards = {}
+
+
+class MosaicWriter(TiffWriter):
+    """
+     * Writes the masks of all tiles of a bbox and zoom level into one memory mapped array per tag,
+       'mosaic_<tag>.npy', in which the tile with the TMS coordinates (x, y) starts at row
+       (max_tms_y - y) * tile_size and column (x - min_tms_x) * tile_size, i.e. north is up. The grid is described
+       by 'mosaic.json'. The imagery is still written as '<tile>.tiff'.
+    """
+
+    def __init__(self, tile_size: int):
+        self._tile_size = tile_size
+        self._grids = {}
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def begin(self, output_directory: str, zoom_level: int, range_x: range, range_y: range) -> None:
+        grid = {
+            "zoom": zoom_level,
+            "tile_size": self._tile_size,
+            "min_tms_x": range_x.start,
+            "max_tms_y": range_y.stop - 1,
+            "columns": len(range_x),
+            "rows": len(range_y),
+            "tags": {}
+        }
+        header_path = os.path.join(output_directory, "mosaic.json")
+        if os.path.isfile(header_path):
+            with open(header_path, 'r', encoding="utf-8") as f:
+                existing = json.load(f)
+            grid["tags"] = existing.get("tags", {})
+            if {k: v for k, v in existing.items() if k != "tags"} != {k: v for k, v in grid.items() if k != "tags"}:
+                raise RuntimeError("The mosaic in '{}' has a different grid.".format(output_directory))
+        with self._lock:
+            self._grids[output_directory] = grid
+            self._write_header(output_directory)
+
+    def _write_header(self, output_directory):
+        with open(os.path.join(output_directory, "mosaic.json"), 'w', encoding="utf-8") as f:
+            json.dump(self._grids[output_directory], f, indent=2)
+
+    def _array(self, output_directory: str, tag: str, dtype) -> np.ndarray:
+        key = (output_directory, tag)
+        if key not in self._arrays:
+            grid = self._grids[output_directory]
+            name = "mosaic_{}.npy".format(tag)
+            path = os.path.join(output_directory, name)
+            if os.path.isfile(path):
+                self._arrays[key] = np.load(path, mmap_mode='r+')
+            else:
+                shape = (grid["rows"] * self._tile_size, grid["columns"] * self._tile_size)
+                self._arrays[key] = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+                grid["tags"][tag] = name
+                self._write_header(output_directory)
+        return self._arrays[key]
+
+    def write(self, output_directory: str, file_name: str, masks_by_tag: dict, image_path: str = None) -> None:
+        zoom_level, x, y = map(int, file_name.split("_"))
+        grid = self._grids[output_directory]
+        row = (grid["max_tms_y"] - y) * self._tile_size
+        column = (x - grid["min_tms_x"]) * self._tile_size
+        for tag, mask in masks_by_tag.items():
+            with self._lock:
+                array = self._array(output_directory, tag, mask.dtype)
+            array[row:row + self._tile_size, column:column + self._tile_size] = mask
+
+    def close(self) -> None:
+        with self._lock:
+            for array in self._arrays.values():
+                array.flush()
+            self._arrays = {}
+            self._grids = {}
+
+
+def open_mosaic(directory: str):
+    """
+     * Returns the grid description and the read only memory mapped mask array of each tag of a mosaic.
+    """
+    with open(os.path.join(directory, "mosaic.json"), 'r', encoding="utf-8") as f:
+        grid = json.load(f)
+    arrays = {tag: np.load(os.path.join(directory, name), mmap_mode='r') for tag, name in grid["tags"].items()}
+    return grid, arrays
+
+
+def read_index(directory: str) -> dict:
+    """
+     * Returns the index entries of all tiles written to the shards of a directory, by tile name.
+    """
+    entries = {}
+    path = os.path.join(directory, "index.jsonl")
+    if os.path.isfile(path):
+        with open(path, 'r', encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["tile"]] = entry
+    return entries
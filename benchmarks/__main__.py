@@ -0,0 +1,40 @@
+import argparse
+import json
+import sys
+from .harness import run, compare, format_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks the rendering of tiles offline, with replayed Overpass "
+                                                 "responses and stubbed imagery")
+    parser.add_argument('--scale', type=float, default=1.0, help="Size of the synthetic scenes")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of tiles per benchmark")
+    parser.add_argument('--quick', action='store_true', help="Small scenes and few repetitions, e.g. for CI")
+    parser.add_argument('--recorded', type=str, metavar='DIR',
+                        help="Directory with recorded Overpass responses (.json or the .json.gz of a cache)")
+    parser.add_argument('--json', type=str, metavar='FILE', help="Write the results to the file")
+    parser.add_argument('--baseline', type=str, metavar='FILE', help="Fail, if slower than the results in the file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.scale = min(args.scale, 0.1)
+        args.repeat = min(args.repeat, 5)
+    results = run(scale=args.scale, repeat=args.repeat, recorded=args.recorded)
+    print(format_results(results))
+
+    if args.json:
+        with open(args.json, 'w', encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), tolerance=args.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import overpy
+from airtiler import Airtiler
+from airtiler.sources import OverpassSource
+from .scenes import SCENES, tile_bounds
+
+IMAGE = b"\0" * 64 * 1024
+RECORDED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+class ReplayOverpass(overpy.Overpass):
+    """
+     * Answers every query with the same recorded or generated Overpass JSON response, which is parsed each time.
+    """
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self._data = data
+
+    def query(self, query):
+        return self.parse_json(self._data)
+
+
+class StubImagery:
+    """
+     * Replaces the Bing imagery download by writing a fixed image.
+    """
+    store = None
+
+    def url_for(self, quadkey):
+        return "stub://{}".format(quadkey)
+
+    def download(self, url, path) -> bool:
+        with open(path, 'wb') as f:
+            f.write(IMAGE)
+        return True
+
+
+def load_recorded(directory: str) -> dict:
+    """
+     * Loads the recorded Overpass responses of a directory: plain '.json' files or the '.json.gz' files of a
+       response cache (e.g. '<target_dir>/.cache/overpass'), by file name.
+    """
+    responses = {}
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*.json*"), recursive=True)):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rb') as f:
+            responses[os.path.basename(path).split(".")[0]] = f.read()
+    return responses
+
+
+def benchmark(name: str, data: bytes, tags, bounds, repeat: int = 5, image_width: int = 256) -> dict:
+    """
+     * Processes the tile repeat times with download_bbox and returns the latency per tile, the throughput of the
+       rendering, the peak memory allocated by Python and the time spent in each stage.
+    """
+    airtiler = Airtiler(image_width=image_width)
+    airtiler._source = OverpassSource(ReplayOverpass(data))
+    airtiler._imagery = StubImagery()
+    directory = tempfile.mkdtemp(prefix="airtiler-benchmark-")
+
+    def process(file_name):
+        airtiler.download_bbox(*bounds, output_directory=directory, file_name=file_name, tags=tags,
+                               bing_url=airtiler._imagery.url_for(file_name))
+
+    latencies = []
+    try:
+        # the first tile pays for lazy imports and caches, so it is not measured
+        process("tile_warmup")
+        airtiler.metrics.reset()
+        for i in range(repeat):
+            start = time.perf_counter()
+            process("tile_{}".format(i))
+            latencies.append(time.perf_counter() - start)
+        stages = airtiler.metrics.report()["stages"]
+        # tracemalloc slows down the allocations considerably, so the memory is measured in a separate pass
+        tracemalloc.start()
+        process("tile_memory")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    render = stages.get("render", {})
+    latencies.sort()
+    return {
+        "name": name,
+        "tiles": repeat,
+        "response_bytes": len(data),
+        "latency_mean": sum(latencies) / len(latencies),
+        "latency_median": latencies[len(latencies) // 2],
+        "latency_max": latencies[-1],
+        "polygons": render.get("polygons", 0) // repeat,
+        "polygons_per_second": render.get("polygons", 0) / render["seconds"] if render.get("seconds") else 0.0,
+        "peak_memory": peak,
+        "stages": {stage: stats["seconds"] / repeat for stage, stats in stages.items()},
+    }
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+     * Returns the median time of a fixed mix of Python and numpy work, which scales the latencies of a baseline
+       recorded on another machine.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = 0
+        for i in range(200000):
+            total += i % 7
+        a = np.arange(1000000, dtype=np.float64)
+        np.sort(np.sin(a))
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def run(scale: float = 1.0, repeat: int = 5, recorded: str = None) -> list:
+    """
+     * Runs the synthetic scenes and the recorded responses, if a directory is given. Recorded responses are
+       rendered as a tile at the zoom level of the synthetic scenes with the tag 'building'. Each result contains
+       the calibration time of the machine.
+    """
+    calibration = calibrate()
+    results = []
+    for name, (build, tags) in sorted(SCENES.items()):
+        data = json.dumps(build(scale).json()).encode("utf-8")
+        results.append(benchmark(name, data, tags, tile_bounds(), repeat=repeat))
+    if recorded:
+        for name, data in load_recorded(recorded).items():
+            results.append(benchmark("recorded/{}".format(name), data, ["building"], tile_bounds(), repeat=repeat))
+    for result in results:
+        result["calibration"] = calibration
+    return results
+
+
+def compare(results: list, baseline: list, tolerance: float = 0.25) -> list:
+    """
+     * Returns a message for each benchmark, whose median latency is more than tolerance slower than the baseline.
+       If both have a calibration time, the latency of the baseline is scaled to the speed of this machine.
+    """
+    baseline = {r["name"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["name"])
+        if not base:
+            continue
+        expected = base["latency_median"]
+        if result.get("calibration") and base.get("calibration"):
+            expected *= result["calibration"] / base["calibration"]
+        if result["latency_median"] > expected * (1 + tolerance):
+            regressions.append("{}: {:.1f} ms instead of {:.1f} ms".format(
+                result["name"], result["latency_median"] * 1000, expected * 1000))
+    return regressions
+
+
+def format_results(results: list) -> str:
+    lines = ["{:<28} {:>10} {:>10} {:>10} {:>14} {:>12}".format("benchmark", "median ms", "max ms", "polygons",
+                                                                 "polygons/s", "peak MB")]
+    for r in results:
+        lines.append("{:<28} {:>10.1f} {:>10.1f} {:>10} {:>14.0f} {:>12.1f}".format(
+            r["name"], r["latency_median"] * 1000, r["latency_max"] * 1000, r["polygons"],
+            r["polygons_per_second"], r["peak_memory"] / 1024 / 1024))
+        stages = ", ".join("{} {:.1f} ms".format(s, t * 1000) for s, t in sorted(r["stages"].items()))
+        lines.append("    {}".format(stages))
+    return "\n".join(lines)
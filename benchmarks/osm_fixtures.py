@@ -0,0 +1,86 @@
+import overpy
+from xml.sax.saxutils import quoteattr
+
+
+class Scene:
+    """
+     * Builds synthetic Overpass JSON responses, so the rendering can be tested and benchmarked without network
+       access.
+    """
+
+    def __init__(self, first_id=1):
+        self._elements = []
+        self._next_id = first_id
+
+    def _id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _nodes(self, coords):
+        ids = []
+        for lon, lat in coords:
+            node_id = self._id()
+            self._elements.append({"type": "node", "id": node_id, "lat": lat, "lon": lon})
+            ids.append(node_id)
+        return ids
+
+    def way(self, coords, tags=None):
+        way_id = self._id()
+        self._elements.append({"type": "way", "id": way_id, "nodes": self._nodes(coords), "tags": tags or {}})
+        return way_id
+
+    def box(self, min_lon, min_lat, max_lon, max_lat, tags=None):
+        coords = [(min_lon, min_lat), (max_lon, min_lat), (max_lon, max_lat), (min_lon, max_lat), (min_lon, min_lat)]
+        return self.way(coords, tags=tags)
+
+    def relation(self, members, tags=None):
+        rel_id = self._id()
+        self._elements.append({
+            "type": "relation",
+            "id": rel_id,
+            "members": [{"type": t, "ref": ref, "role": role} for t, ref, role in members],
+            "tags": tags or {}
+        })
+        return rel_id
+
+    def multipolygon(self, outer, inner, tags):
+        outer_id = self.box(*outer)
+        inner_id = self.box(*inner)
+        return self.relation([("way", outer_id, "outer"), ("way", inner_id, "inner")],
+                             tags=dict(tags, type="multipolygon"))
+
+    def json(self):
+        return {"version": 0.6, "elements": list(self._elements)}
+
+    def result(self):
+        return overpy.Result.from_json(self.json())
+
+    def xml(self):
+        """
+         * Returns the scene in the OSM XML format, as it is used by extracts.
+        """
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+        for e in self._elements:
+            tags = ['  <tag k={} v={}/>'.format(quoteattr(k), quoteattr(v)) for k, v in e.get("tags", {}).items()]
+            if e["type"] == "node":
+                lines.append('<node id="{id}" lat="{lat}" lon="{lon}"/>'.format(**e))
+            elif e["type"] == "way":
+                lines.append('<way id="{}">'.format(e["id"]))
+                lines.extend('  <nd ref="{}"/>'.format(ref) for ref in e["nodes"])
+                lines.extend(tags)
+                lines.append('</way>')
+            else:
+                lines.append('<relation id="{}">'.format(e["id"]))
+                lines.extend('  <member type="{type}" ref="{ref}" role="{role}"/>'.format(**m) for m in e["members"])
+                lines.extend(tags)
+                lines.append('</relation>')
+        lines.append('</osm>')
+        return "\n".join(lines)
+
+
+def merge(*scenes):
+    """
+     * Returns the union of the scenes as a single Overpass result. The ids of the scenes must not overlap.
+    """
+    elements = [e for s in scenes for e in s.json()["elements"]]
+    return overpy.Result.from_json({"version": 0.6, "elements": elements})
@@ -0,0 +1,79 @@
+import math
+import random
+from pygeotile.tile import Tile
+from .osm_fixtures import Scene
+
+ZOOM = 18
+TILE = Tile.from_tms(137283, 170333, ZOOM)
+
+
+def tile_bounds(tile=TILE):
+    min_lat, min_lon = tile.bounds[0].latitude_longitude
+    max_lat, max_lon = tile.bounds[1].latitude_longitude
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def dense_buildings(scale: float = 1.0) -> Scene:
+    """
+     * A grid of small buildings covering the tile, about 3000 at scale 1.
+    """
+    scene = Scene()
+    min_lon, min_lat, max_lon, max_lat = tile_bounds()
+    n = max(1, int(round(55 * math.sqrt(scale))))
+    d_lon = (max_lon - min_lon) / n
+    d_lat = (max_lat - min_lat) / n
+    for i in range(n):
+        for j in range(n):
+            scene.box(min_lon + (i + 0.2) * d_lon, min_lat + (j + 0.2) * d_lat,
+                      min_lon + (i + 0.8) * d_lon, min_lat + (j + 0.8) * d_lat, tags={"building": "yes"})
+    return scene
+
+
+def long_highways(scale: float = 1.0) -> Scene:
+    """
+     * Highways with many nodes, which cross the tile and extend far beyond it, 40 at scale 1.
+    """
+    rng = random.Random(17)
+    scene = Scene()
+    min_lon, min_lat, max_lon, max_lat = tile_bounds()
+    width = max_lon - min_lon
+    height = max_lat - min_lat
+    types = ["motorway", "primary", "secondary", "residential", "footway"]
+    for i in range(max(1, int(40 * scale))):
+        lat = min_lat + rng.random() * height
+        coords = []
+        for k in range(500):
+            lon = min_lon - 10 * width + k * 21 * width / 500
+            coords.append((lon, lat + math.sin(k / 10) * height / 20))
+        scene.way(coords, tags={"highway": types[i % len(types)]})
+    return scene
+
+
+def nested_multipolygons(scale: float = 1.0) -> Scene:
+    """
+     * Multipolygons with many inner rings, grouped in nested relations, 20 outer rings at scale 1.
+    """
+    scene = Scene()
+    min_lon, min_lat, max_lon, max_lat = tile_bounds()
+    n = max(1, int(20 * scale))
+    d_lon = (max_lon - min_lon) / n
+    members = []
+    for i in range(n):
+        left = min_lon + i * d_lon
+        outer = scene.box(left + 0.05 * d_lon, min_lat - (max_lat - min_lat), left + 0.95 * d_lon, max_lat)
+        ring_members = [("way", outer, "outer")]
+        for j in range(20):
+            bottom = min_lat + j * (max_lat - min_lat) / 20
+            inner = scene.box(left + 0.3 * d_lon, bottom + 0.01 * (max_lat - min_lat),
+                              left + 0.7 * d_lon, bottom + 0.04 * (max_lat - min_lat))
+            ring_members.append(("way", inner, "inner"))
+        members.append(("relation", scene.relation(ring_members, tags={"type": "multipolygon"}), ""))
+    scene.relation(members, tags={"type": "multipolygon", "landuse": "forest"})
+    return scene
+
+
+SCENES = {
+    "dense_buildings": (dense_buildings, ["building"]),
+    "long_highways": (long_highways, ["highway"]),
+    "nested_multipolygons": (nested_multipolygons, ["landuse=forest"]),
+}
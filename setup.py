@@ -11,7 +11,7 @@ with open(path.join(curr_dir, 'requirements.txt'), encoding='utf-8') as f:
 
 setup(
     name='airtiler',
-    packages=find_packages(exclude=('tests', 'docs')),
+    packages=find_packages(exclude=('tests', 'docs', 'benchmarks')),
     version='2.1.7',
     description='The airtiler generates training / test data for neural networks by downloading buildings from vector '
                 'data from OpenStreetMap and the corresponding satellite images from Microsoft Bing Maps.',
@@ -20,6 +20,7 @@ setup(
     url='https://github.com/mnboos/airtiler',
     license='MIT',
     keywords='machinelearning',
+    python_requires='>=3.8',
     install_requires=all_reqs,
     entry_points={
         'console_scripts': ['airtiler=airtiler.__init__:main'],
@@ -0,0 +1,46 @@
+import gzip
+import json
+from benchmarks.harness import run, compare, load_recorded, RECORDED, BASELINE
+from benchmarks.scenes import dense_buildings
+
+
+def test_benchmarks_run_offline(tmp_path):
+    response = json.dumps(dense_buildings(0.01).json()).encode("utf-8")
+    (tmp_path / "roads.json").write_bytes(response)
+    with gzip.open(str(tmp_path / "cached.json.gz"), "wb") as f:
+        f.write(response)
+    assert sorted(load_recorded(str(tmp_path))) == ["cached", "roads"]
+
+    results = run(scale=0.01, repeat=1, recorded=str(tmp_path))
+    by_name = {r["name"]: r for r in results}
+    assert sorted(by_name) == ["dense_buildings", "long_highways", "nested_multipolygons", "recorded/cached",
+                               "recorded/roads"]
+    for result in results:
+        assert result["latency_median"] > 0
+        assert result["peak_memory"] > 0
+        assert "query" in result["stages"]
+    assert by_name["dense_buildings"]["polygons"] > 0
+    assert by_name["dense_buildings"]["polygons_per_second"] > 0
+    json.dumps(results)
+
+
+def test_compare_reports_regressions():
+    baseline = [{"name": "a", "latency_median": 0.1}, {"name": "b", "latency_median": 0.1}]
+    results = [{"name": "a", "latency_median": 0.11}, {"name": "b", "latency_median": 0.2},
+               {"name": "c", "latency_median": 1.0}]
+    assert compare(results, baseline, tolerance=0.25) == ["b: 200.0 ms instead of 100.0 ms"]
+
+
+def test_compare_scales_the_baseline_by_the_calibration():
+    baseline = [{"name": "a", "latency_median": 0.1, "calibration": 0.01}]
+    assert not compare([{"name": "a", "latency_median": 0.19, "calibration": 0.02}], baseline)
+    assert compare([{"name": "a", "latency_median": 0.19, "calibration": 0.01}], baseline)
+
+
+def test_baseline_covers_all_benchmarks():
+    with open(BASELINE, 'r', encoding="utf-8") as f:
+        baseline = json.load(f)
+    assert sorted(r["name"] for r in baseline) == sorted(
+        ["dense_buildings", "long_highways", "nested_multipolygons"] +
+        ["recorded/{}".format(name) for name in load_recorded(RECORDED)])
+    assert all(r["calibration"] > 0 for r in baseline)
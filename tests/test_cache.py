@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+import overpy
+from airtiler import Airtiler
+from airtiler.cache import ResponseCache, CachingOverpass
+from benchmarks.osm_fixtures import Scene
+
+BBOX = [8.5290505109, 47.3665699008, 8.5317756352, 47.3685391392]
+
+
+def _response():
+    scene = Scene()
+    min_lon, min_lat, max_lon, max_lat = BBOX
+    scene.box(min_lon, min_lat, (min_lon + max_lon) / 2, (min_lat + max_lat) / 2, tags={"building": "yes"})
+    return json.dumps(scene.json()).encode("utf-8")
+
+
+def _fake_server(monkeypatch, response=None):
+    """
+     * Replaces the HTTP request of overpy, while the raw response is still parsed by parse_json.
+    """
+    queries = []
+    response = response or _response()
+
+    def query(self, q):
+        queries.append(q)
+        return self.parse_json(response)
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    return queries
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("query") is None
+    cache.put("query", b"response")
+    assert cache.get("query") == b"response"
+    assert ResponseCache(str(tmp_path)).size == cache.size > 0
+
+
+def test_cache_replaces_entry(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("query", os.urandom(1000))
+    cache.put("query", b"response")
+    assert cache.get("query") == b"response"
+    assert cache.size == os.path.getsize(cache._path("query"))
+
+
+def test_cache_entry_removed_while_read(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("query", b"response")
+    utime = os.utime
+
+    def remove_after_utime(path, times):
+        utime(path, times)
+        os.remove(path)
+
+    monkeypatch.setattr(os, "utime", remove_after_utime)
+    assert cache.get("query") is None
+
+
+def test_cache_concurrent_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    errors = []
+
+    def run(i):
+        try:
+            for j in range(200):
+                cache.put("query", "response{}".format(i * j).encode("utf-8"))
+                assert cache.get("query").startswith(b"response")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert cache.size == os.path.getsize(cache._path("query"))
+
+
+def test_cache_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60)
+    cache.put("query", b"response")
+    path = cache._path("query")
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.get("query") is None
+    assert not os.path.exists(path)
+    assert cache.size == 0
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    for i in range(3):
+        cache.put("query{}".format(i), os.urandom(1000))
+        old = time.time() - 100 + i
+        os.utime(cache._path("query{}".format(i)), (old, old))
+    cache.get("query0")
+    cache._max_size = cache.size - 1
+    cache._evict()
+    assert cache.get("query0") is not None
+    assert cache.get("query1") is None
+    assert cache.get("query2") is not None
+
+
+def test_caching_overpass(tmp_path, monkeypatch):
+    queries = _fake_server(monkeypatch)
+    api = CachingOverpass(ResponseCache(str(tmp_path)))
+    first = api.query("q")
+    second = api.query("q")
+    assert len(queries) == 1
+    assert [w.id for w in first.ways] == [w.id for w in second.ways]
+
+
+def test_process_with_cache(tmp_path, monkeypatch):
+    queries = _fake_server(monkeypatch)
+    config = {
+        "options": {"target_dir": str(tmp_path), "zoom_levels": [18], "cache": True},
+        "query": {"tags": ["building"]},
+        "boundingboxes": {"roads": BBOX}
+    }
+    Airtiler(image_width=64).process(config)
+    nr_queries = len(queries)
+    os.remove(str(tmp_path / "tiles.db"))
+    Airtiler(image_width=64).process(config)
+    assert len(queries) == nr_queries
@@ -0,0 +1,109 @@
+import numpy as np
+import overpy
+from pygeotile.tile import Tile
+from airtiler import Airtiler
+from airtiler.features import FeatureIndex, build_union_query, parse_tag, occupied_tiles
+from airtiler.projection import NodeCoordinates
+from benchmarks.osm_fixtures import Scene, merge
+
+ZOOM = 18
+TILE_A = Tile.from_tms(137283, 170333, ZOOM)
+TILE_B = Tile.from_tms(137284, 170333, ZOOM)
+
+
+def _bounds(tile):
+    min_lat, min_lon = tile.bounds[0].latitude_longitude
+    max_lat, max_lon = tile.bounds[1].latitude_longitude
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _inner_box(tile, start=0.2, end=0.6):
+    min_lon, min_lat, max_lon, max_lat = _bounds(tile)
+    d_lon = max_lon - min_lon
+    d_lat = max_lat - min_lat
+    return min_lon + start * d_lon, min_lat + start * d_lat, min_lon + end * d_lon, min_lat + end * d_lat
+
+
+def _scenes():
+    buildings = Scene()
+    buildings.box(*_inner_box(TILE_A), tags={"building": "yes"})
+    buildings.multipolygon(_inner_box(TILE_B, 0.1, 0.9), _inner_box(TILE_B, 0.4, 0.6), tags={"building": "yes"})
+    vineyards = Scene(first_id=1000)
+    vineyards.box(*_inner_box(TILE_B, 0.05, 0.3), tags={"landuse": "vineyard"})
+    return buildings, vineyards
+
+
+def test_parse_tag():
+    assert parse_tag("building") == ("building", None)
+    assert parse_tag("landuse=vineyard") == ("landuse", "vineyard")
+
+
+def test_union_query_contains_all_tags():
+    query = build_union_query(["building", "landuse=vineyard"], 8.5, 47.3, 8.6, 47.4)
+    assert 'way["building"](47.3,8.5,47.4,8.6);' in query
+    assert 'relation["landuse"="vineyard"](47.3,8.5,47.4,8.6);' in query
+
+
+def test_index_returns_elements_per_tile():
+    index = FeatureIndex(merge(*_scenes()), ["building", "landuse=vineyard"], ZOOM)
+    view_a = index.query("building", *_bounds(TILE_A))
+    assert len(view_a.ways) == 1
+    assert not view_a.relations
+    view_b = index.query("building", *_bounds(TILE_B))
+    assert len(view_b.relations) == 1
+    assert len(view_b.ways) == 2  # the member ways of the relation
+    assert len(index.query("landuse=vineyard", *_bounds(TILE_A)).ways) == 0
+    assert len(index.query("landuse=vineyard", *_bounds(TILE_B)).ways) == 1
+
+
+def test_prefetched_masks_equal_per_tile_masks(monkeypatch):
+    buildings, vineyards = _scenes()
+    monkeypatch.setattr(overpy.Overpass, "query",
+                        lambda self, query: vineyards.result() if "vineyard" in query else buildings.result())
+    tags = ["building", "landuse=vineyard"]
+    index = FeatureIndex(merge(buildings, vineyards), tags, ZOOM)
+    airtiler = Airtiler(image_width=256)
+    for tile in (TILE_A, TILE_B):
+        expected = airtiler._get_masks_by_tag(tags, *_bounds(tile), separate_instances=False, verbose=0)
+        actual = airtiler._get_masks_by_tag(tags, *_bounds(tile), separate_instances=False, verbose=0,
+                                            feature_index=index)
+        assert set(actual) == {"building", "vineyard"}
+        for tag in expected:
+            assert np.array_equal(expected[tag], actual[tag])
+    assert actual["building"].max() == 255
+
+
+def test_nested_relations(monkeypatch):
+    scene = Scene()
+    outer = scene.box(*_inner_box(TILE_A, 0.1, 0.9))
+    inner = scene.box(*_inner_box(TILE_A, 0.4, 0.6))
+    child = scene.relation([("way", outer, "outer"), ("way", inner, "inner")], tags={"type": "multipolygon"})
+    scene.relation([("relation", child, "")], tags={"type": "site", "building": "yes"})
+    result = scene.result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+
+    index = FeatureIndex(result, ["building"], ZOOM)
+    view = index.query("building", *_bounds(TILE_A))
+    assert len(view.relations) == 2
+    assert len(view.ways) == 2
+
+    airtiler = Airtiler(image_width=256)
+    for feature_index in (None, index):
+        mask = airtiler._get_masks_by_tag(["building"], *_bounds(TILE_A), separate_instances=False, verbose=0,
+                                          feature_index=feature_index)["building"]
+        assert mask[50, 50] == 255
+        assert mask[128, 128] == 0
+
+
+def test_occupied_tiles():
+    scene = Scene()
+    scene.box(*_inner_box(TILE_A, 0.4, 0.6), tags={"building": "yes"})
+    scene.multipolygon(_inner_box(TILE_B, 0.1, 0.9), _inner_box(TILE_B, 0.4, 0.6), tags={"building": "yes"})
+    result = scene.result()
+    coordinates = NodeCoordinates(result.ways)
+    range_x, range_y = range(137280, 137290), range(170330, 170340)
+    occupied = occupied_tiles(result.relations, result.ways, coordinates, ZOOM, range_x, range_y)
+    assert occupied == {TILE_A.tms, TILE_B.tms}
+    occupied = occupied_tiles(result.relations, result.ways, coordinates, ZOOM, range_x, range_y, margin=0.2)
+    assert occupied == {(x, y) for x in range(137283, 137286) for y in range(170332, 170335)}
+    assert not occupied_tiles(result.relations, result.ways, coordinates, ZOOM, range(0, 1), range_y)
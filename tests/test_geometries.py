@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import shapely.geometry as geometry
+from airtiler.features import FeatureIndex
+from airtiler.geometries import PreparedArea, PreparedGeometries, grid_origin, zoom_of
+from airtiler.tiling import grid_tile
+from benchmarks.osm_fixtures import Scene
+
+ZOOM = 18
+
+
+def test_clip_to_tile():
+    origin = (100, 200)
+    polygons = [
+        geometry.box(10, 10, 20, 20),
+        geometry.box(50, 50, 80, 60),
+        geometry.Polygon([(0, 0), (10, 0), (0, 10), (10, 10)]),  # invalid bow tie
+        geometry.box(300, 300, 310, 310),
+    ]
+    geometries = PreparedGeometries(polygons, ZOOM, 64, origin)
+    tile = grid_tile(ZOOM, 100, 2 ** ZOOM - 1 - 200)
+    assert grid_origin(tile.min_lon, tile.max_lat, ZOOM) == origin
+    assert zoom_of(tile.min_lon, tile.max_lon) == ZOOM
+
+    clipped = geometries.clip(tile.min_lon, tile.max_lat)
+    assert [p.bounds for p in clipped] == [(10, 10, 20, 20), (50, 50, 64, 60), polygons[2].buffer(0).bounds]
+    assert all(p.is_valid for p in clipped)
+
+    neighbour = grid_tile(ZOOM, 101, 2 ** ZOOM - 1 - 200)
+    assert [p.bounds for p in geometries.clip(neighbour.min_lon, neighbour.max_lat)] == [(0, 50, 16, 60)]
+
+
+def test_area_prepares_once():
+    tile = grid_tile(ZOOM, 137283, 170333)
+    scene = Scene()
+    scene.box(tile.min_lon, tile.min_lat, tile.max_lon, tile.max_lat, tags={"building": "yes"})
+    area = PreparedArea(FeatureIndex(scene.result(), ["building"], ZOOM), tile.min_lon, tile.min_lat, tile.max_lon,
+                        tile.max_lat)
+    calls = []
+
+    def build(view, zoom_level, origin):
+        calls.append((zoom_level, origin))
+        return len(view.ways)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: area.geometries("building", ZOOM, build), range(8)))
+    assert results == [1] * 8
+    assert calls == [(ZOOM, (137283, 2 ** ZOOM - 1 - 170333))]
+    area.geometries("building", ZOOM + 1, build)
+    assert calls[1] == (ZOOM + 1, (2 * 137283, 2 * (2 ** ZOOM - 1 - 170333)))
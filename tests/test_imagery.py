@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from airtiler.imagery import ImageryDownloader, missing_imagery
+from airtiler.imagestore import ImageryStore
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    requested = []
+    failures = {}
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        if self.failures.get(self.path, 0) > 0:
+            self.failures[self.path] -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _TileHandler.requested = []
+    _TileHandler.failures = {}
+    httpd = HTTPServer(("127.0.0.1", 0), _TileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _downloader(server, **kwargs):
+    downloader = ImageryDownloader(backoff=0, **kwargs)
+    url = "http://127.0.0.1:{}/{{subdomain}}/a{{quadkey}}.jpeg".format(server.server_address[1])
+    downloader.set_metadata(["t0", "t1", "t2"], url)
+    return downloader
+
+
+def test_url_rotates_subdomains(server):
+    downloader = _downloader(server)
+    urls = [downloader.url_for("0123") for _ in range(4)]
+    assert [u.split("/")[3] for u in urls] == ["t0", "t1", "t2", "t0"]
+
+
+def test_no_url_without_key():
+    assert ImageryDownloader().url_for("0123") is None
+
+
+def test_download_retries(server, tmp_path):
+    downloader = _downloader(server)
+    url = downloader.url_for("0123")
+    _TileHandler.failures["/t0/a0123.jpeg"] = 2
+    path = str(tmp_path / "img.tiff")
+    assert downloader.download(url, path)
+    assert len(_TileHandler.requested) == 3
+    with open(path, "rb") as f:
+        assert f.read() == b"/t0/a0123.jpeg"
+
+
+def test_download_gives_up(server, tmp_path):
+    downloader = _downloader(server, retries=1)
+    url = downloader.url_for("0123")
+    _TileHandler.failures["/t0/a0123.jpeg"] = 5
+    path = str(tmp_path / "img.tiff")
+    assert not downloader.download(url, path)
+    assert not os.path.exists(path)
+
+
+def test_backfill(server, tmp_path):
+    zoom_dir = tmp_path / "city" / "18"
+    zoom_dir.mkdir(parents=True)
+    for name in ["18_1_2_building.tif", "18_1_2_swimming_pool.tif", "18_3_4_highway.tif", "18_5_6_building.tif",
+                 "18_5_6.tiff", "tiles.txt"]:
+        (zoom_dir / name).write_bytes(b"")
+    assert sorted(os.path.basename(p) for _, p in missing_imagery(str(tmp_path))) == ["18_1_2.tiff", "18_3_4.tiff"]
+
+    downloader = _downloader(server, concurrency=2)
+    assert downloader.backfill(str(tmp_path)) == 2
+    assert (zoom_dir / "18_1_2.tiff").read_bytes()
+    assert (zoom_dir / "18_3_4.tiff").read_bytes()
+    assert len({p.split("/")[1] for p in _TileHandler.requested}) == 2
+    assert not list(missing_imagery(str(tmp_path)))
+
+
+class _RevalidatingHandler(BaseHTTPRequestHandler):
+    """
+     * Serves the same image for every quadkey and answers conditional requests with 304.
+    """
+    requested = []
+    etag = '"v1"'
+
+    def do_GET(self):
+        conditional = self.headers.get("If-None-Match")
+        self.requested.append((self.path, conditional))
+        if conditional == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = self.etag.encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def revalidating_server():
+    _RevalidatingHandler.requested = []
+    _RevalidatingHandler.etag = '"v1"'
+    httpd = HTTPServer(("127.0.0.1", 0), _RevalidatingHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_store_deduplicates_and_links(revalidating_server, tmp_path):
+    store = ImageryStore(str(tmp_path / "store"))
+    downloader = _downloader(revalidating_server)
+    downloader.use_store(store)
+    for city in ["a", "b"]:
+        (tmp_path / city).mkdir()
+        for quadkey in ["0123", "0120"]:
+            assert downloader.download(downloader.url_for(quadkey), str(tmp_path / city / quadkey))
+    assert len(_RevalidatingHandler.requested) == 2
+    assert (tmp_path / "b" / "0123").read_bytes() == b'"v1"'
+    # both quadkeys have the same content, so a single object is stored and linked four times
+    assert os.stat(str(tmp_path / "a" / "0123")).st_ino == os.stat(str(tmp_path / "b" / "0120")).st_ino
+    assert store.size == 4
+    assert downloader.fetch(downloader.url_for("0120")) == b'"v1"'
+    assert len(_RevalidatingHandler.requested) == 2
+
+
+def test_store_revalidates_stale_images(revalidating_server, tmp_path):
+    store = ImageryStore(str(tmp_path / "store"), max_age=60)
+    downloader = _downloader(revalidating_server)
+    downloader.use_store(store)
+    path = str(tmp_path / "img.tiff")
+    assert downloader.download(downloader.url_for("0123"), path)
+    image = store.get("0123")
+    assert image.etag == '"v1"'
+    assert not store.is_stale(image)
+
+    store.max_age = 1e-9
+    assert downloader.download(downloader.url_for("0123"), path)
+    assert _RevalidatingHandler.requested[-1][1] == '"v1"'
+
+    _RevalidatingHandler.etag = '"v2"'
+    assert downloader.download(downloader.url_for("0123"), path)
+    assert store.get("0123").etag == '"v2"'
+    with open(path, "rb") as f:
+        assert f.read() == b'"v2"'
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = ImageryStore(str(tmp_path / "store"), max_size=15)
+    for i, quadkey in enumerate(["0", "1", "2"]):
+        store.put(quadkey, [bytes([i]) * 10])
+        time.sleep(0.01)
+    assert store.get("0") is None
+    assert store.get("1") is None
+    assert store.get("2") is not None
+    assert store.size == 10
+    assert sum(len(files) for _, _, files in os.walk(str(tmp_path / "store" / "objects"))) == 1
+
+
+def test_store_removes_replaced_images(tmp_path):
+    store = ImageryStore(str(tmp_path / "store"), max_size=25)
+    store.put("0", [b"a" * 10])
+    time.sleep(0.01)
+    store.put("0", [b"b" * 10])
+    assert store.size == 10
+    time.sleep(0.01)
+    store.put("1", [b"c" * 10])
+    assert store.size == 20
+    with open(store.get("0").path, "rb") as f:
+        assert f.read() == b"b" * 10
+    assert store.get("1") is not None
+    assert sum(len(files) for _, _, files in os.walk(str(tmp_path / "store" / "objects"))) == 2
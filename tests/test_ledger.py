@@ -0,0 +1,47 @@
+import sqlite3
+from airtiler.ledger import TileLedger, TileResult, DONE, EMPTY, PARTIAL, FAILED
+
+
+def test_finished_tiles(tmp_path):
+    with TileLedger(str(tmp_path / "tiles.db")) as ledger:
+        ledger.record("city", 18, "18_1_1", TileResult(masks={"building": True}, has_image=True, image_failed=False))
+        ledger.record("city", 18, "18_1_2", TileResult(masks={"building": False}, has_image=False,
+                                                       image_failed=False))
+        ledger.record("city", 18, "18_1_3", TileResult(masks={"building": True}, has_image=False, image_failed=True))
+        ledger.record_failure("city", 18, "18_1_4", RuntimeError("boom"))
+        ledger.record("city", 19, "19_1_1", TileResult(masks={"building": True}, has_image=True, image_failed=False))
+        assert ledger.status("city", 18, "18_1_1") == DONE
+        assert ledger.status("city", 18, "18_1_2") == EMPTY
+        assert ledger.status("city", 18, "18_1_3") == PARTIAL
+        assert ledger.status("city", 18, "18_1_4") == FAILED
+
+    with TileLedger(str(tmp_path / "tiles.db")) as ledger:
+        assert ledger.finished_tiles("city", 18) == {"18_1_1", "18_1_2"}
+        ledger.record("city", 18, "18_1_4", TileResult(masks={"building": True}, has_image=True, image_failed=False))
+        assert ledger.finished_tiles("city", 18) == {"18_1_1", "18_1_2", "18_1_4"}
+
+    connection = sqlite3.connect(str(tmp_path / "tiles.db"))
+    assert connection.execute("SELECT attempts, error FROM tiles WHERE tile='18_1_4'").fetchone() == (2, None)
+    assert connection.execute("SELECT attempts, has_image FROM tiles WHERE tile='18_1_1'").fetchone() == (1, 1)
+    assert connection.execute("SELECT written FROM masks WHERE tile='18_1_2'").fetchone() == (0,)
+
+
+def test_records_are_committed_in_batches(tmp_path):
+    path = str(tmp_path / "tiles.db")
+    ledger = TileLedger(path, batch_size=2)
+    result = TileResult(masks={"building": True}, has_image=True, image_failed=False)
+    ledger.record("city", 18, "18_1_1", result)
+    assert not TileLedger(path).finished_tiles("city", 18)
+    ledger.record("city", 18, "18_1_2", result)
+    assert TileLedger(path).finished_tiles("city", 18) == {"18_1_1", "18_1_2"}
+    ledger.close()
+
+
+def test_import_tiles_txt(tmp_path):
+    tiles_txt = tmp_path / "tiles.txt"
+    tiles_txt.write_text("18_1_1\n18_1_2\n19_2_2\n")
+    with TileLedger(str(tmp_path / "tiles.db")) as ledger:
+        assert ledger.import_tiles_txt("city", str(tiles_txt)) == 3
+        assert ledger.import_tiles_txt("city", str(tiles_txt)) == 0
+        assert ledger.finished_tiles("city", 18) == {"18_1_1", "18_1_2"}
+        assert ledger.finished_tiles("city", 19) == {"19_2_2"}
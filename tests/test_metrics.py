@@ -0,0 +1,55 @@
+import json
+import overpy
+import pytest
+from airtiler import Airtiler
+from airtiler.metrics import Metrics, Progress
+from tests.test_pipeline import _config, _scene
+
+
+def test_metrics_report():
+    calls = []
+    metrics = Metrics()
+    metrics.hooks.append(lambda stage, seconds, counts: calls.append((stage, counts)))
+    with metrics.timer("render", polygons=0) as counts:
+        counts["polygons"] += 3
+    metrics.record("render", 0.5, polygons=2)
+    metrics.add("overpass", bytes=100)
+    metrics.tile_done()
+
+    report = metrics.report()
+    assert report["tiles"] == 1
+    assert report["stages"]["render"]["calls"] == 2
+    assert report["stages"]["render"]["polygons"] == 5
+    assert report["stages"]["render"]["max_seconds"] == 0.5
+    assert report["stages"]["overpass"] == {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 100,
+                                            "mean_seconds": 0.0}
+    assert calls == [("render", {"polygons": 3}), ("render", {"polygons": 2})]
+
+
+def test_progress(capsys):
+    now = [0.0]
+    progress = Progress("city @ zoom 18", 10, interval=5, clock=lambda: now[0])
+    for _ in range(4):
+        now[0] += 2
+        progress.tile_done()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ["city @ zoom 18: 3/10 tiles, 0.50 tiles/s, ETA 0:00:14"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_report(tmp_path, monkeypatch, workers):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    stages = []
+    airtiler = Airtiler(image_width=64)
+    airtiler.add_metrics_hook(lambda stage, seconds, counts: stages.append(stage))
+    airtiler.process(_config(tmp_path, workers=workers))
+
+    with open(str(tmp_path / "run_report.json")) as f:
+        report = json.load(f)
+    assert report["tiles"] == 9
+    assert report["stages"]["query"]["calls"] == 9
+    assert report["stages"]["render"]["calls"] == 9
+    assert report["stages"]["geometry"]["polygons"] == report["stages"]["render"]["polygons"] > 0
+    assert report["stages"]["write"]["bytes"] > 0
+    assert set(stages) == {"query", "geometry", "render", "write"}
@@ -0,0 +1,279 @@
+import json
+import os
+import pytest
+import numpy as np
+import overpy
+from PIL import Image
+from airtiler import Airtiler
+from airtiler.ledger import TileLedger
+from airtiler.pipeline import TilePipeline
+from pygeotile.tile import Tile
+from benchmarks.osm_fixtures import Scene, merge
+
+BBOX = [8.5290505109, 47.3665699008, 8.5317756352, 47.3685391392]
+
+
+def _scene():
+    scene = Scene()
+    min_lon, min_lat, max_lon, max_lat = BBOX
+    d_lon = (max_lon - min_lon) / 10
+    d_lat = (max_lat - min_lat) / 10
+    for i in range(9):
+        for j in range(9):
+            scene.box(min_lon + i * d_lon, min_lat + j * d_lat,
+                      min_lon + (i + 0.6) * d_lon, min_lat + (j + 0.6) * d_lat, tags={"building": "yes"})
+    return scene
+
+
+def _config(target_dir, **options):
+    options = dict(options, target_dir=str(target_dir), zoom_levels=[18])
+    return {"options": options, "query": {"tags": ["building"]}, "boundingboxes": {"roads": BBOX}}
+
+
+def _masks(directory):
+    masks = {}
+    for name in os.listdir(directory):
+        masks[name] = np.array(Image.open(os.path.join(directory, name)))
+    return masks
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_pipeline_matches_serial_run(tmp_path, monkeypatch, prefetch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    Airtiler(image_width=64).process(_config(tmp_path / "serial"))
+    Airtiler(image_width=64).process(_config(tmp_path / "parallel", workers=3, prefetch=prefetch, prefetch_size=2))
+
+    serial = _masks(tmp_path / "serial" / "roads" / "18")
+    parallel = _masks(tmp_path / "parallel" / "roads" / "18")
+    assert serial
+    assert sorted(serial) == sorted(parallel)
+    for name in serial:
+        assert np.array_equal(serial[name], parallel[name])
+
+    with TileLedger(str(tmp_path / "parallel" / "tiles.db")) as ledger:
+        parallel_tiles = ledger.finished_tiles("roads", 18)
+    with TileLedger(str(tmp_path / "serial" / "tiles.db")) as ledger:
+        serial_tiles = ledger.finished_tiles("roads", 18)
+    assert parallel_tiles == serial_tiles
+    assert len(serial_tiles) == 9
+
+
+def test_pipeline_resumes_from_ledger(tmp_path, monkeypatch):
+    queries = []
+
+    def query(self, q):
+        queries.append(q)
+        return _scene().result()
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    config = _config(tmp_path, workers=2)
+    Airtiler(image_width=64).process(config)
+    nr_queries = len(queries)
+    assert nr_queries
+    Airtiler(image_width=64).process(config)
+    assert len(queries) == nr_queries
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pyramid_matches_per_zoom_run(tmp_path, monkeypatch, workers):
+    queries = []
+
+    def query(self, q):
+        queries.append(q)
+        return _scene().result()
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    config = _config(tmp_path / "per_zoom")
+    config["options"]["zoom_levels"] = [17, 18]
+    Airtiler(image_width=64).process(config)
+    nr_queries = len(queries)
+
+    config = _config(tmp_path / "pyramid", pyramid=True, workers=workers)
+    config["options"]["zoom_levels"] = [17, 18]
+    Airtiler(image_width=64).process(config)
+    assert len(queries) - nr_queries == 1
+
+    for z in ("17", "18"):
+        per_zoom = _masks(tmp_path / "per_zoom" / "roads" / z)
+        pyramid = _masks(tmp_path / "pyramid" / "roads" / z)
+        assert per_zoom
+        assert sorted(per_zoom) == sorted(pyramid)
+        for name in per_zoom:
+            assert np.array_equal(per_zoom[name], pyramid[name])
+
+
+def test_pyramid_runs_all_blocks_through_one_pipeline(tmp_path, monkeypatch):
+    queries = []
+    pipelines = []
+    finished = []
+
+    def query(self, q):
+        queries.append(q)
+        return _scene().result()
+
+    def finished_tiles(ledger, bbox, zoom):
+        finished.append(zoom)
+        return original_finished_tiles(ledger, bbox, zoom)
+
+    def run(pipeline, *args, **kwargs):
+        pipelines.append(pipeline)
+        original_run(pipeline, *args, **kwargs)
+
+    original_run = TilePipeline.run
+    original_finished_tiles = TileLedger.finished_tiles
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    monkeypatch.setattr(TilePipeline, "run", run)
+    monkeypatch.setattr(TileLedger, "finished_tiles", finished_tiles)
+    config = _config(tmp_path, pyramid=True, workers=2, prefetch_size=1)
+    config["options"]["zoom_levels"] = [17, 18]
+    Airtiler(image_width=64).process(config)
+    assert len(queries) > 1
+    assert len(pipelines) == 1
+    assert sorted(finished) == [17, 18]
+
+    with TileLedger(str(tmp_path / "tiles.db")) as ledger:
+        assert len(original_finished_tiles(ledger, "roads", 18)) == 9
+        assert original_finished_tiles(ledger, "roads", 17)
+
+
+def _single_building_scene():
+    """
+     * A single building in the tile 18_137283_170334 of the bbox.
+    """
+    scene = Scene()
+    tile = Tile.from_tms(137283, 170334, 18)
+    min_lat, min_lon = tile.bounds[0].latitude_longitude
+    max_lat, max_lon = tile.bounds[1].latitude_longitude
+    d_lon, d_lat = max_lon - min_lon, max_lat - min_lat
+    scene.box(min_lon + 0.4 * d_lon, min_lat + 0.4 * d_lat, min_lon + 0.6 * d_lon, min_lat + 0.6 * d_lat,
+              tags={"building": "yes"})
+    return scene
+
+
+def test_occupancy_skips_empty_tiles(tmp_path, monkeypatch):
+    queries = []
+    scene = _single_building_scene()
+
+    def query(self, q):
+        queries.append(q)
+        return scene.result()
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    Airtiler(image_width=64).process(_config(tmp_path / "all"))
+    assert len(queries) == 9
+
+    Airtiler(image_width=64).process(_config(tmp_path / "occupied", occupancy=True))
+    assert len(queries) == 9 + 2
+    assert "out skel qt;" in queries[9]
+
+    expected = _masks(tmp_path / "all" / "roads" / "18")
+    actual = _masks(tmp_path / "occupied" / "roads" / "18")
+    assert sorted(expected) == sorted(actual) == ["18_137283_170334_building.tif"]
+    assert np.array_equal(expected["18_137283_170334_building.tif"], actual["18_137283_170334_building.tif"])
+    with TileLedger(str(tmp_path / "occupied" / "tiles.db")) as ledger:
+        assert len(ledger.finished_tiles("roads", 18)) == 9
+
+
+@pytest.mark.parametrize("labels", ["classes", "bitmask"])
+@pytest.mark.parametrize("priority", [["building=yes", "building"], ["building=yes"]])
+def test_labels_combine_masks_of_tags(tmp_path, monkeypatch, labels, priority):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    config = _config(tmp_path / "masks")
+    config["query"]["tags"] = ["building", "building=yes"]
+    Airtiler(image_width=64).process(config)
+    config = _config(tmp_path / "labels", labels=labels, label_priority=priority)
+    config["query"]["tags"] = ["building", "building=yes"]
+    Airtiler(image_width=64).process(config)
+
+    masks = _masks(tmp_path / "masks" / "roads" / "18")
+    actual = _masks(tmp_path / "labels" / "roads" / "18")
+    assert len(actual) == 9
+    for name, label in actual.items():
+        building = masks[name.replace("_labels.tif", "_building.tif")] != 0
+        yes = masks[name.replace("_labels.tif", "_yes.tif")] != 0
+        if labels == "classes":
+            expected = np.where(yes, 2, np.where(building, 1, 0))
+        else:
+            expected = building * 1 | yes * 2
+        assert np.array_equal(expected, label)
+    with open(tmp_path / "labels" / "labels.json", encoding="utf-8") as f:
+        assert json.load(f) == {"mode": labels, "classes": {"building": 1, "yes": 2}}
+
+
+@pytest.mark.parametrize("tile_order", ["zorder", "hilbert"])
+def test_tile_order_does_not_change_tiles(tmp_path, monkeypatch, tile_order):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    Airtiler(image_width=64).process(_config(tmp_path / "rows"))
+    Airtiler(image_width=64).process(_config(tmp_path / "curve", tile_order=tile_order, workers=2, prefetch=True,
+                                             prefetch_size=2))
+
+    expected = _masks(tmp_path / "rows" / "roads" / "18")
+    actual = _masks(tmp_path / "curve" / "roads" / "18")
+    assert sorted(expected) == sorted(actual)
+    for name in expected:
+        assert np.array_equal(expected[name], actual[name])
+
+
+def test_prepared_geometries_match_per_tile_geometries(tmp_path, monkeypatch):
+    min_lon, min_lat, max_lon, max_lat = BBOX
+    d_lon = (max_lon - min_lon) / 10
+    d_lat = (max_lat - min_lat) / 10
+    scenes = {"building": _scene(), "landuse": Scene(first_id=100000), "highway": Scene(first_id=200000)}
+    scenes["landuse"].multipolygon((min_lon + d_lon, min_lat + d_lat, max_lon - d_lon, max_lat - d_lat),
+                                   (min_lon + 3 * d_lon, min_lat + 3 * d_lat, max_lon - 3 * d_lon,
+                                    max_lat - 3 * d_lat), tags={"landuse": "grass"})
+    scenes["highway"].way([(min_lon - 5 * d_lon, min_lat + 2.5 * d_lat), (max_lon + 5 * d_lon, max_lat - 1.5 * d_lat)],
+                          tags={"highway": "primary"})
+    scenes["highway"].way([(min_lon + 4.5 * d_lon, min_lat - 5 * d_lat), (min_lon + 5.5 * d_lon, max_lat + 5 * d_lat)],
+                          tags={"highway": "residential"})
+
+    def query(self, q):
+        return merge(*[scene for tag, scene in scenes.items() if '"{}"'.format(tag) in q])
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    for name, options in [("tile", {}), ("prepared", {"prefetch": True, "prefetch_size": 2})]:
+        config = _config(tmp_path / name, separate_instances=True, **options)
+        config["query"]["tags"] = list(scenes)
+        Airtiler(image_width=64).process(config)
+
+    expected = _masks(tmp_path / "tile" / "roads" / "18")
+    actual = _masks(tmp_path / "prepared" / "roads" / "18")
+    assert any(name.endswith("_highway.tif") for name in expected)
+    assert any(name.endswith("_landuse.tif") for name in expected)
+    assert sorted(expected) == sorted(actual)
+    for name in expected:
+        assert np.array_equal(expected[name], actual[name]), name
+
+
+def test_pyramid_skips_empty_tiles(tmp_path, monkeypatch):
+    queries = []
+    scene = _single_building_scene()
+
+    def query(self, q):
+        queries.append(q)
+        return scene.result()
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    data_queries = {}
+    for name, occupancy in (("all", False), ("occupied", True)):
+        config = _config(tmp_path / name, pyramid=True, prefetch_size=1, occupancy=occupancy)
+        config["options"]["zoom_levels"] = [17, 18]
+        Airtiler(image_width=64).process(config)
+        data_queries[name] = [q for q in queries if "out skel qt;" not in q]
+        del queries[:]
+    # a single block at zoom 17 contains the building
+    assert len(data_queries["all"]) == 4
+    assert len(data_queries["occupied"]) == 1
+
+    with TileLedger(str(tmp_path / "occupied" / "tiles.db")) as ledger:
+        for z, nr_tiles in ((17, 4), (18, 9)):
+            expected = _masks(tmp_path / "all" / "roads" / str(z))
+            actual = _masks(tmp_path / "occupied" / "roads" / str(z))
+            assert expected
+            assert sorted(expected) == sorted(actual)
+            for name in expected:
+                assert np.array_equal(expected[name], actual[name])
+            assert len(ledger.finished_tiles("roads", z)) == nr_tiles
@@ -0,0 +1,28 @@
+import numpy as np
+from pygeotile.point import Point
+from airtiler.projection import mercator, NodeCoordinates
+from benchmarks.osm_fixtures import Scene
+from tests.test_features import TILE_A, _bounds
+
+
+def test_mercator_matches_pygeotile():
+    lat, lon = 47.3667, 8.5301
+    x, y = mercator(lon, lat)
+    pixel_x, pixel_y = Point.from_latitude_longitude(latitude=lat, longitude=lon).pixels(zoom=18)
+    size = 256 * 2 ** 18
+    assert abs(x * size - pixel_x) <= 1
+    assert abs(y * size - pixel_y) <= 1
+
+
+def test_tile_corners_are_projected_to_image_corners():
+    min_lon, min_lat, max_lon, max_lat = _bounds(TILE_A)
+    scene = Scene()
+    scene.way([(min_lon, max_lat), (max_lon, min_lat), ((min_lon + max_lon) / 2, (min_lat + max_lat) / 2)])
+    result = scene.result()
+    coordinates = NodeCoordinates(result.ways)
+    points = coordinates.project(result.ways, min_lon, min_lat, max_lon, max_lat, 512)[result.ways[0].id]
+    assert np.allclose(points[0], (0, 0), atol=1e-6)
+    assert np.allclose(points[1], (512, 512), atol=1e-6)
+    assert abs(points[2][0] - 256) < 1e-6
+    assert 250 < points[2][1] < 262
+    assert coordinates.bounds(result.ways) == (min_lon, min_lat, max_lon, max_lat)
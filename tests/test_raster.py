@@ -0,0 +1,97 @@
+import random
+import numpy as np
+import pytest
+import shapely.geometry as geometry
+from PIL import Image, ImageDraw
+from airtiler.raster import burn_polygon, burn_label, label_dtype
+
+SIZE = 128
+
+
+def _burn_full_canvas(mask, p, separate_instances):
+    poly_area = Image.fromarray(np.zeros(mask.shape, dtype=np.uint8))
+    holes = Image.fromarray(np.zeros(mask.shape, dtype=np.uint8))
+    outline_color = 0 if separate_instances else 255
+    ImageDraw.Draw(poly_area).polygon(p.exterior.coords, fill=255, outline=outline_color)
+    for h in p.interiors:
+        ImageDraw.Draw(holes).polygon(h.coords, fill=255, outline=255)
+    mask[np.nonzero(np.array(poly_area, dtype=np.uint8))] = 255
+    mask[np.nonzero(np.array(holes, dtype=np.uint8))] = 0
+
+
+def _random_polygons(rnd, count):
+    tile = geometry.box(0, 0, SIZE, SIZE)
+    polygons = []
+    for _ in range(count):
+        cx, cy = rnd.uniform(-10, SIZE + 10), rnd.uniform(-10, SIZE + 10)
+        radius = rnd.uniform(1, 40)
+        poly = geometry.Point(cx, cy).buffer(radius, quad_segs=rnd.randint(1, 6))
+        if rnd.random() < 0.5:
+            poly = poly.difference(geometry.Point(cx, cy).buffer(radius / 3))
+        poly = poly.intersection(tile)
+        if isinstance(poly, geometry.Polygon) and not poly.is_empty:
+            polygons.append(poly)
+    return polygons
+
+
+def _assert_identical(polygon, separate_instances, size=SIZE):
+    expected = np.zeros((size, size), dtype=np.uint8)
+    actual = np.zeros((size, size), dtype=np.uint8)
+    _burn_full_canvas(expected, polygon, separate_instances)
+    burn_polygon(actual, polygon, separate_instances)
+    assert np.array_equal(expected, actual), polygon.wkt
+
+
+@pytest.mark.parametrize("separate_instances", [False, True])
+def test_identical_to_full_canvas(separate_instances):
+    rnd = random.Random(42)
+    polygons = _random_polygons(rnd, 2000)
+    for p in polygons:
+        _assert_identical(p, separate_instances)
+
+
+@pytest.mark.parametrize("separate_instances", [False, True])
+def test_identical_to_full_canvas_near_window_edge(separate_instances):
+    # the fill of this triangle differs by one pixel, if the coordinates are translated along x
+    triangle = geometry.Polygon([(191.62027335946593, 157.75819909083276), (189.9662657747153, 185.26726299981925),
+                                 (220.1994228133197, 158.9918769333393)])
+    _assert_identical(triangle, separate_instances, size=256)
+
+
+def test_polygon_outside_of_mask():
+    mask = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    burn_polygon(mask, geometry.box(SIZE + 5, SIZE + 5, SIZE + 10, SIZE + 10))
+    assert not mask.any()
+
+
+@pytest.mark.parametrize("bitmask", [False, True])
+def test_labels_combine_masks(bitmask):
+    rnd = random.Random(7)
+    polygons_by_class = [_random_polygons(rnd, 30) for _ in range(3)]
+    labels = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    expected = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    for i, polygons in enumerate(polygons_by_class):
+        value = 1 << i if bitmask else i + 1
+        covered = np.zeros((SIZE, SIZE), dtype=bool)
+        for p in polygons:
+            burn_label(labels, p, value, bitmask=bitmask)
+            # unlike in a mask, the hole of a polygon does not erase the other polygons of its class
+            mask = np.zeros((SIZE, SIZE), dtype=np.uint8)
+            burn_polygon(mask, p)
+            covered |= mask != 0
+        if bitmask:
+            expected[covered] |= value
+        else:
+            expected[covered] = value
+    assert len(np.unique(labels)) > 3
+    assert np.array_equal(expected, labels)
+
+
+def test_label_dtype():
+    assert label_dtype("classes", 255) == np.uint8
+    assert label_dtype("bitmask", 8) == np.uint8
+    assert label_dtype("bitmask", 9) == np.uint16
+    with pytest.raises(RuntimeError):
+        label_dtype("bitmask", 17)
+    with pytest.raises(RuntimeError):
+        label_dtype("rgb", 1)
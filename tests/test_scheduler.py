@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from overpy import exception
+from airtiler.scheduler import ScheduledOverpass, TokenBucket, parse_status
+from benchmarks.osm_fixtures import Scene
+
+STATUS = """Connected as: 1234
+Current time: 2026-10-17T10:00:00Z
+Announced endpoint: none
+Rate limit: 2
+Slot available after: 2026-10-17T10:00:03Z, in 3 seconds.
+Slot available after: 2026-10-17T10:00:09Z, in 9 seconds.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+
+def _response():
+    scene = Scene()
+    scene.box(8.53, 47.36, 8.54, 47.37, tags={"building": "yes"})
+    return json.dumps(scene.json()).encode("utf-8")
+
+
+class _OverpassHandler(BaseHTTPRequestHandler):
+    """
+     * Stand-in for an Overpass server, which answers the next queued status code of its path prefix.
+    """
+    codes = {}
+    requests = []
+    status = STATUS
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        prefix = self.path.split("/")[1]
+        self.requests.append(prefix)
+        codes = self.codes.get(prefix, [])
+        code = codes.pop(0) if codes else 200
+        body = _response() if code == 200 else b"error"
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        body = self.status.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _OverpassHandler.codes = {}
+    _OverpassHandler.requests = []
+    _OverpassHandler.status = STATUS
+    httpd = HTTPServer(("127.0.0.1", 0), _OverpassHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server, prefix):
+    return "http://127.0.0.1:{}/{}/api/interpreter".format(server.server_address[1], prefix)
+
+
+def test_parse_status():
+    assert parse_status(STATUS) == (2, 0, 3)
+    assert parse_status("Rate limit: 2\n2 slots available now.\n") == (2, 2, 0)
+
+
+def test_token_bucket_adapts_rate():
+    bucket = TokenBucket()
+    bucket.acquire()
+    assert bucket.rate is None
+    bucket.slow_down()
+    assert bucket.rate == 1.0
+    bucket.slow_down()
+    assert bucket.rate == 0.5
+    bucket.speed_up()
+    assert bucket.rate == pytest.approx(0.55)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_fails_over_on_gateway_timeout(server):
+    _OverpassHandler.codes = {"a": [504, 504]}
+    api = ScheduledOverpass(urls=[_url(server, "a"), _url(server, "b")], backoff=30)
+    for _ in range(3):
+        assert [w.id for w in api.query("q").ways]
+    assert _OverpassHandler.requests == ["a", "b", "b", "b"]
+
+
+def test_waits_for_slot_when_throttled(server):
+    _OverpassHandler.codes = {"a": [429]}
+    _OverpassHandler.status = "Rate limit: 2\nSlot available after: 2026-10-17T10:00:00Z, in 0 seconds.\n"
+    api = ScheduledOverpass(urls=[_url(server, "a")], backoff=0.05)
+    assert [w.id for w in api.query("q").ways]
+    assert _OverpassHandler.requests == ["a", "a"]
+    assert api.bucket.rate == pytest.approx(1.05)
+
+
+def test_raises_after_max_retries(server):
+    _OverpassHandler.codes = {"a": [429] * 3}
+    _OverpassHandler.status = "Rate limit: 2\n"
+    api = ScheduledOverpass(urls=[_url(server, "a")], max_retries=2, backoff=0.01)
+    with pytest.raises(exception.OverpassTooManyRequests):
+        api.query("q")
+    assert len(_OverpassHandler.requests) == 3
@@ -0,0 +1,112 @@
+import os
+import numpy as np
+import overpy
+import pytest
+from airtiler import Airtiler
+from airtiler.features import FeatureIndex
+from airtiler.sources import OsmFileSource, _collect
+from benchmarks.osm_fixtures import Scene
+from tests.test_features import TILE_A, TILE_B, _bounds, _inner_box
+
+TAGS = ["building", "landuse=vineyard"]
+
+
+def _scene():
+    scene = Scene()
+    scene.box(*_inner_box(TILE_A), tags={"building": "yes"})
+    scene.multipolygon(_inner_box(TILE_B, 0.1, 0.9), _inner_box(TILE_B, 0.4, 0.6), tags={"building": "yes"})
+    scene.box(*_inner_box(TILE_B, 0.05, 0.3), tags={"landuse": "vineyard"})
+    scene.box(*_inner_box(TILE_A, 0.7, 0.9), tags={"amenity": "parking"})
+    return scene
+
+
+@pytest.fixture
+def osm_file(tmp_path):
+    path = tmp_path / "extract.osm"
+    path.write_text(_scene().xml())
+    return str(path)
+
+
+def test_file_source_keeps_matching_elements(osm_file):
+    source = OsmFileSource(osm_file, TAGS)
+    view = source.query("building", *_bounds(TILE_B))
+    assert len(view.relations) == 1
+    assert len(view.ways) == 2
+    assert all("amenity" not in w.tags for w in source.query("building", *_bounds(TILE_A)).ways)
+
+
+def test_file_source_reads_only_referenced_elements(tmp_path):
+    scene = Scene()
+    outer = scene.box(*_inner_box(TILE_A, 0.1, 0.9))
+    inner = scene.box(*_inner_box(TILE_A, 0.4, 0.6))
+    # the child relation is listed before its parent, so it is only known in a second pass over the relations
+    child = scene.relation([("way", outer, "outer"), ("way", inner, "inner")])
+    parent = scene.relation([("relation", child, "")], tags={"building": "yes"})
+    parking = scene.box(*_inner_box(TILE_B), tags={"amenity": "parking"})
+    scene.relation([("way", parking, "outer")], tags={"type": "multipolygon", "amenity": "parking"})
+    path = tmp_path / "nested.osm"
+    path.write_text(scene.xml())
+
+    collector = _collect(str(path), TAGS)
+    assert sorted(collector._relations) == [child, parent]
+    assert sorted(collector._ways) == [outer, inner]
+    assert len(collector._nodes) == 10
+
+
+def test_file_source_ignores_overpass_options(osm_file, tmp_path, monkeypatch):
+    def query(self, q):
+        raise AssertionError("The Overpass API must not be queried")
+
+    monkeypatch.setattr(overpy.Overpass, "query", query)
+    airtiler = Airtiler(image_width=64)
+    airtiler.use_osm_file(osm_file, TAGS)
+    bbox = list(_bounds(TILE_B))
+    config = {"options": {"target_dir": str(tmp_path / "out"), "zoom_levels": [18], "cache": True,
+                          "overpass_rate": 1},
+              "query": {"tags": TAGS}, "boundingboxes": {"tile": bbox}}
+    airtiler.process(config)
+    assert isinstance(airtiler._source, OsmFileSource)
+    assert os.listdir(str(tmp_path / "out" / "tile" / "18"))
+
+
+def test_file_source_renders_like_overpass(osm_file):
+    index = FeatureIndex(_scene().result(), TAGS, 18)
+    expected = Airtiler(image_width=256)
+    actual = Airtiler(image_width=256)
+    actual.use_osm_file(osm_file, TAGS)
+    for tile in (TILE_A, TILE_B):
+        expected_masks = expected._get_masks_by_tag(TAGS, *_bounds(tile), separate_instances=True, verbose=0,
+                                                    feature_index=index)
+        assert expected_masks["building"].any()
+        actual_masks = actual._get_masks_by_tag(TAGS, *_bounds(tile), separate_instances=True, verbose=0)
+        for tag in expected_masks:
+            assert np.array_equal(expected_masks[tag], actual_masks[tag])
+
+
+def test_missing_file():
+    with pytest.raises(FileNotFoundError):
+        Airtiler().use_osm_file("does_not_exist.osm.pbf", TAGS)
+
+
+def test_pbf_file_source(osm_file, tmp_path):
+    osmium = pytest.importorskip("osmium")
+    pbf_file = str(tmp_path / "extract.osm.pbf")
+    writer = osmium.SimpleWriter(pbf_file)
+
+    class Copy(osmium.SimpleHandler):
+        def node(self, n):
+            writer.add_node(n)
+
+        def way(self, w):
+            writer.add_way(w)
+
+        def relation(self, r):
+            writer.add_relation(r)
+
+    Copy().apply_file(osm_file)
+    writer.close()
+
+    source = OsmFileSource(pbf_file, TAGS)
+    view = source.query("building", *_bounds(TILE_B))
+    assert len(view.relations) == 1
+    assert len(view.ways) == 2
@@ -0,0 +1,72 @@
+import io
+import threading
+import numpy as np
+import overpy
+from PIL import Image
+from airtiler import Airtiler
+from airtiler.stream import TileStream
+from tests.test_pipeline import _config, _masks, _scene
+
+
+class _Imagery:
+    def __init__(self):
+        self.fetched = []
+
+    def url_for(self, quadkey):
+        return "stub://{}".format(quadkey)
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        data = io.BytesIO()
+        Image.new("RGB", (64, 64), (10, 20, 30)).save(data, format="PNG")
+        return data.getvalue()
+
+
+def test_stream_yields_the_masks_of_process(tmp_path, monkeypatch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    Airtiler(image_width=64).process(_config(tmp_path))
+    expected = _masks(tmp_path / "roads" / "18")
+
+    airtiler = Airtiler(image_width=64)
+    airtiler._imagery = _Imagery()
+    samples = list(airtiler.stream(_config(tmp_path / "unused")))
+    assert len(samples) == len(expected) == 9
+    for sample in samples:
+        name = "18_{tms_x}_{tms_y}_building.tif".format(**sample.metadata)
+        assert np.array_equal(sample.masks["building"], expected[name])
+        assert sample.image.shape == (64, 64, 3)
+        assert tuple(sample.image[0, 0]) == (10, 20, 30)
+        assert sample.metadata["bbox"] == "roads"
+        assert sample.metadata["zoom"] == 18
+    assert not (tmp_path / "unused").exists()
+
+
+def test_shuffle_window_permutes_samples(monkeypatch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    airtiler = Airtiler(image_width=64)
+    airtiler._imagery = _Imagery()
+    config = _config("unused")
+    ordered = [s.metadata["quadkey"] for s in airtiler.stream(config)]
+    shuffled = [s.metadata["quadkey"] for s in airtiler.stream(config, shuffle_window=4, seed=1)]
+    assert sorted(ordered) == sorted(shuffled)
+    assert ordered != shuffled
+    assert shuffled == [s.metadata["quadkey"] for s in airtiler.stream(config, shuffle_window=4, seed=1)]
+
+
+def test_prefetch_is_bounded():
+    loaded = []
+    lock = threading.Lock()
+
+    class _Stream(TileStream):
+        def _load(self, bbox_name, tile):
+            with lock:
+                loaded.append(tile)
+            return tile
+
+    stream = iter(_Stream(None, (("a", i) for i in range(100)), ["building"], buffer_size=3, workers=2))
+    assert next(stream) == 0
+    assert next(stream) == 1
+    assert len(loaded) <= 5
+    stream.close()
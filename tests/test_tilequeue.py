@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import time
+import numpy as np
+import overpy
+from airtiler import Airtiler
+from airtiler.tilequeue import TileQueue, QueuedTile, PENDING, CLAIMED, DONE, FAILED
+from tests.test_pipeline import _config, _masks, _scene
+
+
+def _tiles(n):
+    return [QueuedTile(bbox="city", zoom=18, tile="18_{}_1".format(x), tms_x=x, tms_y=1) for x in range(n)]
+
+
+def test_workers_claim_distinct_tiles(tmp_path):
+    queue = TileQueue(str(tmp_path / "queue.db"))
+    assert queue.publish(_tiles(5)) == 5
+    assert queue.publish(_tiles(6)) == 1
+
+    first = queue.claim("a", limit=4)
+    second = queue.claim("b", limit=4)
+    assert len(first) == 4 and len(second) == 2
+    assert not set(t.tile for t in first) & set(t.tile for t in second)
+    assert not queue.claim("c")
+
+    assert queue.complete("a", first[0])
+    assert not queue.complete("b", first[1])
+    assert queue.counts() == {PENDING: 0, CLAIMED: 5, DONE: 1, FAILED: 0}
+
+
+def test_publish_in_chunks(tmp_path):
+    queue = TileQueue(str(tmp_path / "queue.db"))
+    assert not queue.published
+    assert queue.publish(iter(_tiles(5)), chunk_size=2) == 5
+    assert queue.published
+    assert queue.counts()[PENDING] == 5
+    assert [t.tile for t in queue.claim("a", limit=5)] == [t.tile for t in _tiles(5)]
+
+
+def test_claim_does_not_sort_the_queue(tmp_path):
+    path = str(tmp_path / "queue.db")
+    TileQueue(path)
+    connection = sqlite3.connect(path)
+    plan = connection.execute("EXPLAIN QUERY PLAN SELECT bbox, zoom, tile, tms_x, tms_y FROM queue "
+                              "WHERE status=? OR (status=? AND lease_until<?) LIMIT ?",
+                              (PENDING, CLAIMED, 0, 1)).fetchall()
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+def test_expired_leases_are_claimed_again(tmp_path):
+    queue = TileQueue(str(tmp_path / "queue.db"), lease=0.2)
+    queue.publish(_tiles(2))
+    claimed = queue.claim("a", limit=2)
+    time.sleep(0.1)
+    assert queue.heartbeat("a") == 2
+    time.sleep(0.15)
+    assert not queue.claim("b")
+    time.sleep(0.1)
+    assert len(queue.claim("b", limit=2)) == 2
+    assert not queue.complete("a", claimed[0])
+
+
+def test_released_tiles_fail_after_max_attempts(tmp_path):
+    queue = TileQueue(str(tmp_path / "queue.db"), max_attempts=2)
+    queue.publish(_tiles(1))
+    for _ in range(2):
+        tile, = queue.claim("a")
+        queue.release("a", tile, "boom")
+    assert not queue.claim("a")
+    assert queue.counts()[FAILED] == 1
+
+
+def test_queue_run_matches_serial_run(tmp_path, monkeypatch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    Airtiler(image_width=64).process(_config(tmp_path / "serial"))
+    config = _config(tmp_path / "queued", queue="queue.db", queue_batch=4)
+    assert Airtiler(image_width=64).publish(config) == 9
+    Airtiler(image_width=64).process(config)
+
+    serial = _masks(tmp_path / "serial" / "roads" / "18")
+    queued = _masks(tmp_path / "queued" / "roads" / "18")
+    assert serial
+    assert sorted(serial) == sorted(queued)
+    for name in serial:
+        assert np.array_equal(serial[name], queued[name])
+    assert TileQueue(str(tmp_path / "queued" / "queue.db")).counts()[DONE] == 9
+
+
+def test_workers_do_not_publish(tmp_path, monkeypatch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    config = _config(tmp_path, queue="queue.db")
+    assert Airtiler(image_width=64).publish(config) == 9
+    config["boundingboxes"]["other"] = [8.54, 47.37, 8.541, 47.371]
+    Airtiler(image_width=64).process(config)
+    counts = TileQueue(str(tmp_path / "queue.db")).counts()
+    assert counts[DONE] == sum(counts.values()) == 9
+    assert not os.path.exists(str(tmp_path / "other"))
@@ -0,0 +1,67 @@
+import random
+import pytest
+from pygeotile.tile import Tile
+from airtiler.tiling import coordinates, grid_tile, iter_blocks, iter_tiles, ORDERS
+
+
+def _cells(range_x, range_y, order, chunk_size=16):
+    return [(x, y) for xs, ys in coordinates(range_x, range_y, order, chunk_size)
+            for x, y in zip(xs.tolist(), ys.tolist())]
+
+
+def test_same_as_pygeotile():
+    rnd = random.Random(3)
+    for _ in range(2000):
+        zoom = rnd.randint(0, 22)
+        x, y = rnd.randrange(2 ** zoom), rnd.randrange(2 ** zoom)
+        expected = Tile.from_tms(tms_x=x, tms_y=y, zoom=zoom)
+        tile = grid_tile(zoom, x, y)
+        assert tile.quad_tree == expected.quad_tree
+        assert tile.tms == expected.tms
+        point_min, point_max = expected.bounds
+        assert tile.min_lon == point_min.longitude
+        assert tile.max_lon == point_max.longitude
+        assert tile.min_lat == pytest.approx(point_min.latitude, abs=1e-12)
+        assert tile.max_lat == pytest.approx(point_max.latitude, abs=1e-12)
+
+
+@pytest.mark.parametrize("order", ORDERS)
+@pytest.mark.parametrize("range_x, range_y", [(range(3, 17), range(5, 6)), (range(0, 1), range(0, 1)),
+                                              (range(100, 164), range(7, 300)), (range(5, 5), range(0, 3))])
+def test_covers_ranges_once(order, range_x, range_y):
+    cells = _cells(range_x, range_y, order)
+    assert len(cells) == len(set(cells))
+    assert set(cells) == set((x, y) for x in range_x for y in range_y)
+
+
+def test_rows_order():
+    assert _cells(range(2, 4), range(7, 10), "rows", chunk_size=2) == \
+        [(2, 7), (2, 8), (2, 9), (3, 7), (3, 8), (3, 9)]
+
+
+def test_hilbert_steps_to_neighbours():
+    cells = _cells(range(0, 64), range(0, 64), "hilbert")
+    assert all(abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 for a, b in zip(cells, cells[1:]))
+
+
+def test_zorder():
+    assert _cells(range(0, 4), range(0, 2), "zorder", chunk_size=4) == \
+        [(0, 0), (1, 0), (0, 1), (1, 1), (2, 0), (3, 0), (2, 1), (3, 1)]
+
+
+def test_unknown_order():
+    with pytest.raises(RuntimeError):
+        coordinates(range(1), range(1), "spiral")
+
+
+def test_lazy():
+    tiles = iter_tiles(19, range(0, 2 ** 19), range(0, 2 ** 19), "hilbert")
+    assert next(tiles).quad_tree == "2" * 19
+
+
+@pytest.mark.parametrize("order", ORDERS)
+def test_blocks_are_aligned(order):
+    blocks = list(iter_blocks(10, range(5, 21), range(3, 9), 4, order))
+    assert sorted(t.tms for block in blocks for t in block) == sorted((x, y) for x in range(5, 21) for y in range(3, 9))
+    for block in blocks:
+        assert len(set((t.tms_x // 4, t.tms_y // 4) for t in block)) == 1
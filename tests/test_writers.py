@@ -0,0 +1,105 @@
+import io
+import os
+import tarfile
+import numpy as np
+import overpy
+from PIL import Image
+from airtiler import Airtiler
+from airtiler.writers import ShardWriter, MosaicWriter, open_mosaic, read_index
+from tests.test_pipeline import _config, _masks, _scene
+
+
+def _shard_masks(directory):
+    masks = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".tar"):
+            with tarfile.open(os.path.join(directory, name)) as tar:
+                for member in tar.getmembers():
+                    tile, tag, _ = member.name.split(".")
+                    data = io.BytesIO(tar.extractfile(member).read())
+                    masks["{}_{}.tif".format(tile, tag)] = np.array(Image.open(data))
+    return masks
+
+
+def test_shards_contain_the_same_masks(tmp_path, monkeypatch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    Airtiler(image_width=64).process(_config(tmp_path / "tiff"))
+    Airtiler(image_width=64).process(_config(tmp_path / "shards", output="shards", shard_size=4))
+
+    shard_dir = str(tmp_path / "shards" / "roads" / "18")
+    expected = _masks(tmp_path / "tiff" / "roads" / "18")
+    actual = _shard_masks(shard_dir)
+    assert sorted(expected) == sorted(actual)
+    for name in expected:
+        assert np.array_equal(expected[name], actual[name])
+
+    shards = sorted(n for n in os.listdir(shard_dir) if n.endswith(".tar"))
+    assert shards == ["shard-000000.tar", "shard-000001.tar", "shard-000002.tar"]
+    index = read_index(shard_dir)
+    assert len(index) == 9
+    assert all(e["masks"]["building"].startswith(t) for t, e in index.items())
+
+
+def test_shard_writer_includes_imagery(tmp_path):
+    writer = ShardWriter(shard_size=10)
+    directory = str(tmp_path)
+    image_path = writer.image_path(directory, "18_1_2")
+    with open(image_path, "wb") as f:
+        f.write(b"image")
+    mask = np.zeros((8, 8), dtype=np.uint8)
+    mask[2:4, 2:4] = 255
+    writer.write(directory, "18_1_2", {"building": mask}, image_path)
+    writer.close()
+
+    assert not os.path.exists(image_path)
+    assert read_index(directory)["18_1_2"]["image"] == "18_1_2.tiff"
+    with tarfile.open(str(tmp_path / "shard-000000.tar")) as tar:
+        assert tar.getnames() == ["18_1_2.tiff", "18_1_2.building.tif"]
+        assert tar.extractfile("18_1_2.tiff").read() == b"image"
+
+    writer = ShardWriter()
+    writer.write(directory, "18_1_3", {"building": mask})
+    writer.close()
+    assert os.path.isfile(str(tmp_path / "shard-000001.tar"))
+
+
+def test_mosaic_contains_the_same_masks(tmp_path, monkeypatch):
+    result = _scene().result()
+    monkeypatch.setattr(overpy.Overpass, "query", lambda self, query: result)
+    Airtiler(image_width=64).process(_config(tmp_path / "tiff"))
+    Airtiler(image_width=64).process(_config(tmp_path / "mosaic", output="mosaic"))
+
+    grid, arrays = open_mosaic(str(tmp_path / "mosaic" / "roads" / "18"))
+    mosaic = arrays["building"]
+    assert mosaic.shape == (grid["rows"] * 64, grid["columns"] * 64)
+    expected = _masks(tmp_path / "tiff" / "roads" / "18")
+    assert expected
+    for name, mask in expected.items():
+        z, x, y = map(int, name.split("_")[:3])
+        row = (grid["max_tms_y"] - y) * 64
+        column = (x - grid["min_tms_x"]) * 64
+        assert np.array_equal(mosaic[row:row + 64, column:column + 64], mask)
+    assert int(mosaic.astype(np.int64).sum()) == sum(int(m.astype(np.int64).sum()) for m in expected.values())
+
+
+def test_mosaic_writer_places_tiles_north_up(tmp_path):
+    writer = MosaicWriter(tile_size=4)
+    directory = str(tmp_path)
+    writer.begin(directory, 18, range(10, 12), range(20, 22))
+    mask = np.full((4, 4), 255, dtype=np.uint8)
+    writer.write(directory, "18_11_21", {"building": mask})
+    writer.close()
+
+    grid, arrays = open_mosaic(directory)
+    assert (grid["zoom"], grid["min_tms_x"], grid["max_tms_y"], grid["columns"], grid["rows"]) == (18, 10, 21, 2, 2)
+    assert arrays["building"][:4, 4:].min() == 255
+    assert arrays["building"][4:, :].max() == 0
+
+    writer = MosaicWriter(tile_size=4)
+    writer.begin(directory, 18, range(10, 12), range(20, 22))
+    writer.write(directory, "18_10_20", {"building": mask})
+    writer.close()
+    _, arrays = open_mosaic(directory)
+    assert arrays["building"][:4, 4:].min() == 255
+    assert arrays["building"][4:, :4].min() == 255